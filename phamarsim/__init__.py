@@ -2,8 +2,11 @@
 """Phamarsim - a phased microhpone array simulation library"""
 
 import mediums
+import directivities
 import environments
 import sources
 import speakers
+import filters
 import microphones
 import digitizers
+import beamforming
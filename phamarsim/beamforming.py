@@ -0,0 +1,617 @@
+# coding:utf-8
+"""Beamforming for Phamarsim
+
+Beamformers evaluate the channel data of a microphone array for a grid of
+steering points. The channel data is transformed into the frequency domain
+only once and the steering vectors of all grid points are applied as one
+matrix product per frequency bin.
+
+The channel data is expected as (M,T) array, e.g. from
+`MicrophoneArray.get_voltage_signal`, or as the transposed recording of a
+digitizer, see `load_channels`.
+
+For acoustic imaging, the cross spectral matrix (CSM) of the channels is
+estimated with Welch's method (`CrossSpectralMatrix`) and evaluated with
+conventional beamforming or CLEAN-SC deconvolution (`CSMBeamformer`), or
+with the high resolution estimators `MVDRBeamformer` and `MUSICEstimator`.
+The steering vectors for a fixed array and grid are kept in a
+`SteeringTable`, which can be shared between beamformers and datasets.
+
+"""
+from __future__ import division
+import numpy as np
+import warnings
+
+import logging
+log = logging.getLogger(__name__)
+
+import digitizers
+import caches
+
+def load_channels(filename):
+    """Return a recording of `Digitizer.record` as memory mapped (M,T) array."""
+    return digitizers.open_recording(filename).T
+
+def get_channel_spectra(data, sample_rate, block_size=None, window='hann', overlap=0.):
+    """Transform the channel data into the frequency domain.
+
+    Parameters
+    ----------
+    data : array-like
+        The (M,T) channel data.
+    sample_rate : float
+        The sample rate of the data [Hz].
+    block_size : int, optional
+        The data is split into blocks of this length, which are transformed
+        separately. Defaults to the whole length.
+    window : {'hann', 'boxcar'}, optional
+        The window applied to every block.
+    overlap : float, optional
+        The fraction by which consecutive blocks overlap.
+
+    Returns
+    -------
+    freqs : ndarray
+        The (F,) frequencies of the bins [Hz].
+    X : ndarray
+        The (F,M,S) complex amplitudes of the S blocks. A sine with amplitude
+        `a` in the center of a bin results in `|X| = a`.
+
+    """
+    data = np.asarray(data)
+    M, T = data.shape
+    if block_size is None:
+        block_size = T
+    if block_size > T:
+        raise ValueError("The data is shorter than one block.")
+    step = max(1, int(round(block_size * (1. - overlap))))
+    starts = np.arange(0, T - block_size + 1, step)
+    if window == 'hann':
+        w = np.hanning(block_size)
+    elif window == 'boxcar':
+        w = np.ones(block_size)
+    else:
+        raise ValueError("Unknown window: %s"%(window,))
+
+    if step == block_size:
+        blocks = np.asarray(data[:,:len(starts)*block_size], dtype=float).reshape(M, len(starts), block_size)
+    else:
+        blocks = np.asarray(data, dtype=float)[:, starts[:,np.newaxis] + np.arange(block_size)]
+    X = np.fft.rfft(blocks * w, axis=-1) * (2. / np.sum(w))
+    freqs = np.fft.rfftfreq(block_size, 1. / sample_rate)
+    return freqs, np.ascontiguousarray(X.transpose(2, 0, 1))
+
+def get_distances(mic_positions, grid):
+    """Return the (G,M) distances between the grid points and the microphones [m]."""
+    mic_positions = np.asarray(mic_positions, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    return np.sqrt(np.sum((grid[:,np.newaxis,:] - mic_positions[np.newaxis,:,:])**2, axis=-1))
+
+def get_steering_vectors(distances, freq, c=331.3):
+    """Return the steering vectors for one frequency.
+
+    Parameters
+    ----------
+    distances : ndarray
+        The (G,M) distances between the grid points and the microphones [m].
+    freq : float
+        The frequency [Hz].
+    c : float, optional
+        The speed of sound [m/s].
+
+    Returns
+    -------
+    h : ndarray
+        The (G,M) complex phase factors `exp(-2j*pi*freq*r/c)` of a wave
+        travelling from the grid points to the microphones.
+
+    """
+    return np.exp(-2j*np.pi*freq/c * distances)
+
+class SteeringTable():
+    """Steering vectors of a fixed array and grid
+
+    Parameters
+    ----------
+    mic_positions : array-like
+        The (M,3) positions of the microphones [m].
+    grid : array-like
+        The (G,3) steering points [m].
+    c : float, optional
+        The speed of sound [m/s].
+    max_bytes : int, optional
+        The memory budget for the cached steering vectors.
+
+    Notes
+    -----
+    The distances are calculated once. The (G,M) steering vectors of every
+    requested frequency are cached, as long as they fit into the memory
+    budget. The table does not depend on any data, so it can be reused
+    for many datasets.
+
+    """
+    def __init__(self, mic_positions, grid, c=331.3, max_bytes=256*2**20):
+        self._mic_positions = np.array(mic_positions, dtype=float, ndmin=2)
+        self._grid = np.array(grid, dtype=float, ndmin=2)
+        self._c = c
+        self._distances = get_distances(self._mic_positions, self._grid)
+        self._max_bytes = max_bytes
+        self._cache = caches.LRUCache(maxsize=None, max_bytes=max_bytes)
+
+    def get_grid(self):
+        return self._grid.copy()
+
+    def get_mic_positions(self):
+        return self._mic_positions.copy()
+
+    def get_speed_of_sound(self):
+        return self._c
+
+    def get_shape(self):
+        """Return the number of grid points and microphones."""
+        return self._distances.shape
+
+    def get(self, freq, index=slice(None)):
+        """Return the steering vectors for one frequency.
+
+        Parameters
+        ----------
+        freq : float
+            The frequency [Hz].
+        index : slice or array-like, optional
+            Selects the grid points.
+
+        Returns
+        -------
+        h : ndarray
+            The (G,M) steering vectors of the selected grid points.
+            See `get_steering_vectors`.
+
+        """
+        h = self._cache.get(freq)
+        if h is not None:
+            return h[index]
+        if 16 * self._distances.size > self._max_bytes:
+            # Too large to be cached, calculate only what is needed
+            return get_steering_vectors(self._distances[index], freq, self._c)
+        h = get_steering_vectors(self._distances, freq, self._c)
+        h.setflags(write=False)
+        self._cache.put(freq, h, h.nbytes)
+        return h[index]
+
+class CrossSpectralMatrix():
+    """Cross spectral matrix of channel data estimated with Welch's method
+
+    Parameters
+    ----------
+    data : array-like
+        The (M,T) channel data.
+    sample_rate : float
+        The sample rate of the data [Hz].
+    block_size : int, optional
+        The length of the averaged blocks.
+    overlap : float, optional
+        The fraction by which consecutive blocks overlap.
+    window : str, optional
+        See `get_channel_spectra`.
+    max_bytes : int, optional
+        The memory budget for cached frequency bands.
+
+    Notes
+    -----
+    The block spectra are calculated once. The (M,M) matrices are only
+    averaged for the bins of requested frequency bands, which are cached.
+    A sine with amplitude `a` in the center of a bin results in `C = a**2`
+    on the diagonal.
+
+    """
+    def __init__(self, data, sample_rate, block_size=1024, overlap=0.5, window='hann', max_bytes=256*2**20):
+        self._freqs, self._spectra = get_channel_spectra(data, sample_rate, block_size, window, overlap)
+        self._bands = caches.LRUCache(maxsize=None, max_bytes=max_bytes)
+
+    def get_frequencies(self):
+        return self._freqs.copy()
+
+    def get_band(self, fmin=0., fmax=np.inf):
+        """Return the matrices of all bins within a frequency band.
+
+        Returns
+        -------
+        freqs : ndarray
+            The (K,) frequencies of the bins [Hz].
+        C : ndarray
+            The (K,M,M) cross spectral matrices.
+
+        """
+        k = np.flatnonzero((self._freqs >= fmin) & (self._freqs <= fmax))
+        key = (k[0], k[-1] + 1) if len(k) else (0, 0)
+        band = self._bands.get(key)
+        if band is None:
+            X = self._spectra[key[0]:key[1]]
+            C = np.einsum('fms,fns->fmn', X, X.conj()) / X.shape[-1]
+            band = (self._freqs[key[0]:key[1]], C)
+            for a in band:
+                a.setflags(write=False)
+            self._bands.put(key, band, C.nbytes)
+        return band
+
+class CSMEstimator():
+    """Base class for estimators that work on cross spectral matrices
+
+    Parameters
+    ----------
+    steering : SteeringTable
+        The steering vectors of the array and grid.
+    max_bytes : int, optional
+        The approximate memory budget for one chunk of grid points.
+
+    """
+    def __init__(self, steering, max_bytes=32*2**20):
+        self._steering = steering
+        G, M = steering.get_shape()
+        self._chunk_size = max(1, int(max_bytes // (32 * M)))
+
+    def get_steering_table(self):
+        return self._steering
+
+    def _get_quadratic_form(self, freq, A):
+        """Return `Re(h^H A h)` of the steering vectors of all grid points."""
+        G, M = self._steering.get_shape()
+        P = np.empty(G)
+        for i in range(0, G, self._chunk_size):
+            chunk = slice(i, min(i + self._chunk_size, G))
+            h = self._steering.get(freq, chunk)
+            P[chunk] = np.real(np.sum(np.dot(h.conj(), A) * h, axis=-1))
+        return P
+
+    def get_map(self, csm, fmin=0., fmax=np.inf):
+        """Return the (G,) map of a frequency band.
+
+        Must be implemented by derived classes.
+        """
+        warnings.warn("Tried to get a map from the CSMEstimator base class.")
+        return np.zeros(self.get_steering_table().get_shape()[0])
+
+class CSMBeamformer(CSMEstimator):
+    """Beamforming and deconvolution based on cross spectral matrices
+
+    Parameters
+    ----------
+    steering : SteeringTable
+        The steering vectors of the array and grid.
+    diagonal_removal : bool, optional
+        Whether the diagonal of the matrices is ignored. This removes the
+        uncorrelated self noise of the channels from the maps.
+    **kwargs : optional
+        Passed to `CSMEstimator`.
+
+    Notes
+    -----
+    The weights of grid point g are `w = h_g / M`, and the map is
+    `w^H C w`, i.e. the delay-and-sum power for the averaged blocks.
+
+    """
+    def __init__(self, steering, diagonal_removal=False, **kwargs):
+        CSMEstimator.__init__(self, steering, **kwargs)
+        self._diagonal_removal = diagonal_removal
+
+    def _prepare(self, C):
+        C = np.array(C)
+        if self._diagonal_removal:
+            C[...,np.arange(C.shape[-1]),np.arange(C.shape[-1])] = 0.
+        return C
+
+    def _get_bin_map(self, freq, C):
+        """Return the (G,) map of a single (M,M) matrix."""
+        M = self._steering.get_shape()[1]
+        return self._get_quadratic_form(freq, C) / M**2
+
+    def get_map(self, csm, fmin=0., fmax=np.inf):
+        """Return the conventional beamforming map of a frequency band.
+
+        Parameters
+        ----------
+        csm : CrossSpectralMatrix
+            The cross spectral matrix of the data.
+        fmin, fmax : float, optional
+            The frequency range of the bins to be summed [Hz].
+
+        Returns
+        -------
+        B : ndarray
+            The (G,) beamforming power of the grid points.
+
+        """
+        freqs, C = csm.get_band(fmin, fmax)
+        C = self._prepare(C)
+        B = np.zeros(self._steering.get_shape()[0])
+        for f, Cf in zip(freqs, C):
+            B += self._get_bin_map(f, Cf)
+        return B
+
+    def get_clean_sc_map(self, csm, fmin=0., fmax=np.inf, loop_gain=0.9, max_iter=100, stop=1e-3):
+        """Return the CLEAN-SC deconvolved map of a frequency band.
+
+        Parameters
+        ----------
+        csm : CrossSpectralMatrix
+            The cross spectral matrix of the data.
+        fmin, fmax : float, optional
+            The frequency range of the bins to be summed [Hz].
+        loop_gain : float, optional
+            The fraction of the found source that is removed per iteration.
+        max_iter : int, optional
+            The maximum number of iterations per frequency bin.
+        stop : float, optional
+            The iteration stops when the peak of the remaining map drops below
+            this fraction of the initial peak.
+
+        Returns
+        -------
+        B : ndarray
+            The (G,) clean power of the grid points.
+
+        Notes
+        -----
+        Follows Sijtsma (2007): In every iteration, the strongest grid point
+        is found, the part of the matrix that is coherent with it is
+        calculated and removed, and its power is put into the clean map.
+
+        """
+        freqs, C = csm.get_band(fmin, fmax)
+        C = self._prepare(C)
+        G, M = self._steering.get_shape()
+        B = np.zeros(G)
+        for f, D in zip(freqs, C):
+            D = D.copy()
+            P0 = None
+            for i in range(max_iter):
+                P = self._get_bin_map(f, D)
+                g = np.argmax(P)
+                Pmax = P[g]
+                if P0 is None:
+                    P0 = Pmax
+                if Pmax <= 0 or Pmax < stop * P0:
+                    break
+                w = self._steering.get(f, [g])[0] / M
+                # Source component that is coherent with the peak
+                h = np.dot(D, w) / Pmax
+                D -= loop_gain * Pmax * np.outer(h, h.conj())
+                if self._diagonal_removal:
+                    D[np.arange(M),np.arange(M)] = 0.
+                B[g] += loop_gain * Pmax
+        return B
+
+def get_loaded_matrices(C, diagonal_loading):
+    """Add a multiple of the identity to cross spectral matrices.
+
+    Parameters
+    ----------
+    C : array-like
+        The (...,M,M) matrices.
+    diagonal_loading : float
+        The added value relative to the mean of the diagonal of each matrix.
+
+    Returns
+    -------
+    C : ndarray
+        The loaded (...,M,M) matrices.
+
+    """
+    C = np.array(C, dtype=complex)
+    M = C.shape[-1]
+    i = np.arange(M)
+    mean = np.real(np.trace(C, axis1=-2, axis2=-1)) / M
+    C[...,i,i] += diagonal_loading * mean[...,np.newaxis]
+    return C
+
+class MVDRBeamformer(CSMEstimator):
+    """Minimum variance distortionless response (Capon) beamformer
+
+    Parameters
+    ----------
+    steering : SteeringTable
+        The steering vectors of the array and grid.
+    diagonal_loading : float, optional
+        The regularisation of the matrices before inversion, relative to
+        their mean diagonal. See `get_loaded_matrices`.
+    **kwargs : optional
+        Passed to `CSMEstimator`.
+
+    Notes
+    -----
+    The power of grid point g is `1 / (h_g^H C^-1 h_g)`. The matrices of
+    all bins in a band are inverted in one stacked call.
+
+    """
+    def __init__(self, steering, diagonal_loading=1e-3, **kwargs):
+        CSMEstimator.__init__(self, steering, **kwargs)
+        self._diagonal_loading = diagonal_loading
+
+    def set_diagonal_loading(self, diagonal_loading):
+        self._diagonal_loading = diagonal_loading
+
+    def get_diagonal_loading(self):
+        return self._diagonal_loading
+
+    def get_map(self, csm, fmin=0., fmax=np.inf):
+        """Return the MVDR power map of a frequency band.
+
+        Parameters
+        ----------
+        csm : CrossSpectralMatrix
+            The cross spectral matrix of the data.
+        fmin, fmax : float, optional
+            The frequency range of the bins to be summed [Hz].
+
+        Returns
+        -------
+        B : ndarray
+            The (G,) power of the grid points.
+
+        """
+        freqs, C = csm.get_band(fmin, fmax)
+        Cinv = np.linalg.inv(get_loaded_matrices(C, self._diagonal_loading))
+        B = np.zeros(self._steering.get_shape()[0])
+        for f, Ci in zip(freqs, Cinv):
+            B += 1. / self._get_quadratic_form(f, Ci)
+        return B
+
+class MUSICEstimator(CSMEstimator):
+    """Multiple signal classification (MUSIC) estimator
+
+    Parameters
+    ----------
+    steering : SteeringTable
+        The steering vectors of the array and grid.
+    n_sources : int, optional
+        The dimension of the signal subspace.
+    diagonal_loading : float, optional
+        The regularisation of the matrices before the decomposition.
+        See `get_loaded_matrices`.
+    **kwargs : optional
+        Passed to `CSMEstimator`.
+
+    Notes
+    -----
+    The pseudo spectrum of grid point g is `M / (h_g^H E E^H h_g)`, where
+    `E` are the eigenvectors of the noise subspace. The matrices of all bins
+    in a band are decomposed in one stacked call. The values are not
+    powers, only the positions of the peaks are meaningful.
+
+    """
+    def __init__(self, steering, n_sources=1, diagonal_loading=0., **kwargs):
+        CSMEstimator.__init__(self, steering, **kwargs)
+        self._n_sources = n_sources
+        self._diagonal_loading = diagonal_loading
+
+    def set_number_of_sources(self, n_sources):
+        self._n_sources = n_sources
+
+    def get_number_of_sources(self):
+        return self._n_sources
+
+    def set_diagonal_loading(self, diagonal_loading):
+        self._diagonal_loading = diagonal_loading
+
+    def get_diagonal_loading(self):
+        return self._diagonal_loading
+
+    def get_map(self, csm, fmin=0., fmax=np.inf):
+        """Return the MUSIC pseudo spectrum of a frequency band.
+
+        Parameters
+        ----------
+        csm : CrossSpectralMatrix
+            The cross spectral matrix of the data.
+        fmin, fmax : float, optional
+            The frequency range of the bins to be summed [Hz].
+
+        Returns
+        -------
+        B : ndarray
+            The (G,) pseudo spectrum of the grid points.
+
+        """
+        freqs, C = csm.get_band(fmin, fmax)
+        G, M = self._steering.get_shape()
+        if not 0 < self._n_sources < M:
+            raise ValueError("The number of sources must be between 1 and %d."%(M-1,))
+        # Eigenvalues are in ascending order
+        w, V = np.linalg.eigh(get_loaded_matrices(C, self._diagonal_loading))
+        E = V[...,:M-self._n_sources]
+        Pn = np.matmul(E, E.conj().swapaxes(-1, -2))
+        B = np.zeros(G)
+        for f, P in zip(freqs, Pn):
+            B += M / self._get_quadratic_form(f, P)
+        return B
+
+class DelayAndSumBeamformer():
+    """Frequency domain delay-and-sum beamformer for a grid of steering points
+
+    Parameters
+    ----------
+    mic_positions : array-like
+        The (M,3) positions of the microphones [m].
+    grid : array-like
+        The (G,3) steering points [m].
+    c : float, optional
+        The speed of sound [m/s].
+    max_bytes : int, optional
+        The approximate memory budget for the steering vectors of one chunk
+        of grid points. The steering vectors of whole frequency bins are
+        cached if they fit into it.
+
+    Notes
+    -----
+    The beamformer output for grid point g is `b = sum(conj(h_g) * x) / M`,
+    i.e. the phases of a wave from g are aligned and the channels averaged.
+    The map is the power `|b|**2`, averaged over blocks and summed over
+    frequency bins.
+
+    """
+    def __init__(self, mic_positions, grid, c=331.3, max_bytes=32*2**20):
+        self._steering = SteeringTable(mic_positions, grid, c, max_bytes)
+        G, M = self._steering.get_shape()
+        self._chunk_size = max(1, int(max_bytes // (16 * M)))
+
+    def get_steering_table(self):
+        return self._steering
+
+    def _iter_chunks(self):
+        G, M = self._steering.get_shape()
+        for i in range(0, G, self._chunk_size):
+            yield slice(i, min(i + self._chunk_size, G))
+
+    def get_map_from_spectra(self, freqs, X, fmin=0., fmax=np.inf):
+        """Return the beamforming map for precalculated spectra.
+
+        Parameters
+        ----------
+        freqs : array-like
+            The (F,) frequencies of the bins [Hz].
+        X : ndarray
+            The (F,M,S) complex amplitudes, see `get_channel_spectra`.
+        fmin, fmax : float, optional
+            The frequency range of the bins to be summed [Hz].
+
+        Returns
+        -------
+        B : ndarray
+            The (G,) beamforming power of the grid points.
+
+        """
+        G, M = self._steering.get_shape()
+        B = np.zeros(G)
+        for k in np.flatnonzero((freqs >= fmin) & (freqs <= fmax)):
+            for chunk in self._iter_chunks():
+                h = self._steering.get(freqs[k], chunk)
+                # One matrix product for all grid points and blocks of the chunk
+                b = np.dot(h.conj(), X[k]) / M
+                B[chunk] += np.mean(np.abs(b)**2, axis=-1)
+        return B
+
+    def get_map(self, data, sample_rate, fmin=0., fmax=np.inf, block_size=None, window='hann'):
+        """Return the beamforming map of channel data.
+
+        Parameters
+        ----------
+        data : array-like
+            The (M,T) channel data.
+        sample_rate : float
+            The sample rate of the data [Hz].
+        fmin, fmax : float, optional
+            The frequency range of the bins to be summed [Hz].
+        block_size : int, optional
+            See `get_channel_spectra`.
+        window : str, optional
+            See `get_channel_spectra`.
+
+        Returns
+        -------
+        B : ndarray
+            The (G,) beamforming power of the grid points.
+
+        """
+        freqs, X = get_channel_spectra(data, sample_rate, block_size, window)
+        return self.get_map_from_spectra(freqs, X, fmin, fmax)
@@ -0,0 +1,175 @@
+# coding:utf-8
+"""Caches for Phamarsim
+
+Helpers to memoize intermediate results of the simulation.
+
+"""
+from __future__ import division
+import numpy as np
+from collections import OrderedDict
+import hashlib
+import weakref
+
+import logging
+log = logging.getLogger(__name__)
+
+# Digests of read-only arrays, keyed by the memory they describe
+_digests = {}
+
+def _root(a):
+    """Return the array that owns the memory of `a`."""
+    while isinstance(a.base, np.ndarray):
+        a = a.base
+    return a
+
+def array_key(a):
+    """Return a hashable key describing the contents of an array.
+
+    Parameters
+    ----------
+    a : array-like
+        The array to describe.
+
+    Returns
+    -------
+    key : tuple
+        The shape, data type and the contents of the array. Small arrays
+        are described by their raw bytes, larger ones by a SHA-1 digest of
+        them, so different arrays never share a key in practice.
+
+    Notes
+    -----
+    Arrays that are frozen with `setflags(write=False)` together with the
+    memory they view, e.g. cached positions, cannot change any more. Their
+    digests are remembered, so passing the same array again does not
+    read its data again.
+
+    """
+    a = np.asarray(a)
+    root = _root(a)
+    frozen = not a.flags.writeable and not root.flags.writeable and root.flags.owndata
+    if frozen:
+        memo = (id(root), a.__array_interface__['data'][0], a.shape, a.strides, a.dtype.str)
+        entry = _digests.get(memo)
+        if entry is not None and entry[0]() is root:
+            return entry[1]
+
+    data = np.ascontiguousarray(a).tobytes()
+    if len(data) > 256:
+        data = hashlib.sha1(data).digest()
+    key = (a.shape, a.dtype.str, data)
+
+    if frozen:
+        # Forget the digest together with the array
+        _digests[memo] = (weakref.ref(root, lambda ref, memo=memo: _digests.pop(memo, None)), key)
+    return key
+
+class LRUCache():
+    """Simple mapping that forgets the least recently used entries
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of entries. `None` means no limit.
+    max_bytes : int, optional
+        The maximum summed size of the entries in bytes. `None` means no limit.
+
+    """
+    def __init__(self, maxsize=128, max_bytes=None):
+        self._data = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def set_maxsize(self, maxsize):
+        self._maxsize = maxsize
+        self._evict()
+
+    def get_maxsize(self):
+        return self._maxsize
+
+    def set_max_bytes(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def get_max_bytes(self):
+        return self._max_bytes
+
+    def get_nbytes(self):
+        """Return the summed size of all entries in bytes."""
+        return self._nbytes
+
+    def get(self, key, default=None):
+        """Return the entry for `key` and mark it as recently used.
+
+        Returns `default` if the key is not in the cache.
+
+        """
+        try:
+            value, nbytes = self._data.pop(key)
+        except KeyError:
+            self._misses += 1
+            return default
+        self._hits += 1
+        self._data[key] = (value, nbytes)
+        return value
+
+    def get_stats(self):
+        """Return the number of hits and misses of `get`."""
+        return self._hits, self._misses
+
+    def put(self, key, value, nbytes=0):
+        """Store `value` under `key` and evict old entries if necessary.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry.
+        value : object
+            The value to be stored.
+        nbytes : int, optional
+            The size of the value in bytes. Values larger than the byte
+            limit are not stored at all.
+
+        """
+        self.pop(key)
+        if self._max_bytes is not None and nbytes > self._max_bytes:
+            return
+        self._data[key] = (value, nbytes)
+        self._nbytes += nbytes
+        self._evict()
+
+    def pop(self, key, default=None):
+        """Remove the entry for `key` and return it.
+
+        Returns `default` if the key is not in the cache.
+
+        """
+        try:
+            value, nbytes = self._data.pop(key)
+        except KeyError:
+            return default
+        self._nbytes -= nbytes
+        return value
+
+    def _evict(self):
+        """Remove the least recently used entries until the limits are met."""
+        while self._data and (
+                (self._maxsize is not None and len(self._data) > self._maxsize) or
+                (self._max_bytes is not None and self._nbytes > self._max_bytes) ):
+            key, (value, nbytes) = self._data.popitem(last=False)
+            self._nbytes -= nbytes
+
+    def clear(self):
+        """Remove all entries."""
+        self._data.clear()
+        self._nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
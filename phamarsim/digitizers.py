@@ -1,10 +1,454 @@
 # coding:utf-8
-"""Speakers for Phamarsim
+"""Digitizers for Phamarsim
 
-Speakers translate the signal of a SoundSource to pressure variations.
+Digitizers sample the voltage signals of microphones with a common clock
+and convert them to integers, like the analog to digital converter of a
+real acquisition system. They provide the method
+
+>>> read_block()
+
+which returns the next block of samples of all connected channels.
+
+To stand in for live hardware, `iter_realtime_blocks` delivers the blocks
+paced by the wall clock, while a background thread simulates them.
+
+Long acquisitions can be streamed into NumPy `.npy` files with `record`.
+The samples are stored interleaved as (samples, channels) array after the
+small `.npy` header, so they can be memory mapped with `open_recording` or
+any other tool that understands the format.
 
 """
 
 from __future__ import division
 import numpy as np
-#import scipy as sc
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import logging
+log = logging.getLogger(__name__)
+
+import microphones
+
+def open_recording(filename, mode='r'):
+    """Open a recording as memory mapped (samples, channels) array.
+
+    Parameters
+    ----------
+    filename : str
+        The `.npy` file written by `Digitizer.record`.
+    mode : str, optional
+        The memory map mode, see `numpy.memmap`.
+
+    """
+    return np.load(filename, mmap_mode=mode)
+
+# Monotonic clock for real time pacing, if available
+_clock = getattr(time, 'monotonic', time.time)
+
+class Digitizer():
+    """Multichannel analog to digital converter
+
+    Parameters
+    ----------
+    sample_rate : float, optional
+        The sample rate [Hz].
+    block_size : int, optional
+        The number of samples per channel and block.
+    bits : int, optional
+        The resolution of the converter. Samples are stored as int16 for up
+        to 16 bits and as int32 otherwise.
+    full_scale : float, optional
+        The voltage corresponding to the largest sample value [V].
+        Larger voltages are clipped.
+    clock_offset : float, optional
+        The offset of the sampling clock relative to the simulation time [s].
+    jitter : float, optional
+        The standard deviation of the random timing error of every sample [s].
+    seed : int, optional
+        The seed for the random timing errors.
+    microphones : iterable, optional
+        Microphones to be connected to the digitizer.
+
+    Notes
+    -----
+    Every microphone provides one channel, a `MicrophoneArray` one channel
+    per element. Channels are ordered like the connected microphones.
+
+    """
+    def __init__(self, sample_rate=50000., block_size=1024, bits=16, full_scale=1.0,
+                 clock_offset=0.0, jitter=0.0, seed=0, microphones=[]):
+        self._microphones = []
+        self._sample_rate = sample_rate
+        self._block_size = block_size
+        self._bits = bits
+        self._full_scale = full_scale
+        self._clock_offset = clock_offset
+        self._jitter = jitter
+        self._seed = seed
+        self._channel_gains = None
+        self._channel_layout = []
+        self._buffer = None
+        self._realtime_stats = None
+        for mic in microphones:
+            self.connect_microphone(mic)
+        self.reset()
+
+    def connect_microphone(self, mic):
+        """Connect a microphone to the digitizer.
+
+        Parameters
+        ----------
+        mic : Microphone
+            Microphone to connect to the digitizer.
+
+        Notes
+        -----
+        Raises ValueError if the microphone is already connected to the digitizer.
+
+        If the microphone is already connected to another digitizer, it will be disconnected from it.
+
+        """
+        if mic not in self._microphones:
+            self._microphones.append(mic)
+            try:
+                mic.connect_to_digitizer(self)
+            except ValueError:
+                # Catch ValueErrors so a mutual connect does not raise an Error.
+                pass
+            except:
+                # The microphone was not able to connect. Reset and raise Error.
+                self._microphones.remove(mic)
+                raise
+        else:
+            raise ValueError("Microphone already connected to digitizer")
+        self._channels_changed()
+        log.debug("%s is now connected to %s."%(self, mic))
+
+    def disconnect_microphone(self, mic):
+        """Disconnect a microphone from the digitizer.
+        
+        Raises ValueError if the microphone is not connected."""
+        self._microphones.remove(mic)
+        try:
+            mic.disconnect_from_digitizer(self)
+        except ValueError:
+            # Catch ValueErrors so a mutual disconnect does not raise an Error.
+            pass
+        self._channels_changed()
+        log.debug("%s is now disconnected from %s."%(self, mic))
+
+    def get_microphones(self, typ=microphones.Microphone):
+        """Return all microphones of type typ"""
+        return [M for M in self._microphones if isinstance(M, typ)]
+
+    def _get_channel_layout(self):
+        """Return the connected microphones with their numbers of channels."""
+        return [(mic, int(np.prod(mic.get_channel_shape()))) for mic in self._microphones]
+
+    def _channels_changed(self):
+        """Forget everything that depends on the channel layout.
+
+        The gains of microphones that are still connected with the same
+        number of channels are kept, new channels get a gain of 1.
+
+        """
+        layout = self._get_channel_layout()
+        if self._channel_gains is not None:
+            # Microphones compare by identity, so they key their own gains
+            old = {}
+            i = 0
+            for mic, n in self._channel_layout:
+                old[mic] = self._channel_gains[i:i+n]
+                i += n
+            gains = np.ones(sum(n for mic, n in layout))
+            i = 0
+            for mic, n in layout:
+                if mic in old and len(old[mic]) == n:
+                    gains[i:i+n] = old[mic]
+                i += n
+            self._channel_gains = gains
+        self._channel_layout = layout
+        self._buffer = None
+        self._states = [mic.new_filter_state() for mic in self._microphones]
+
+    def get_number_of_channels(self):
+        """Return the total number of channels of all connected microphones."""
+        return sum(int(np.prod(mic.get_channel_shape())) for mic in self._microphones)
+
+    def set_channel_gains(self, gains):
+        """Set the gains that are applied to the channels before conversion.
+
+        The gains stay with their microphones when other microphones are
+        connected or disconnected.
+
+        """
+        self._channel_layout = self._get_channel_layout()
+        self._channel_gains = np.ascontiguousarray(np.broadcast_to(gains, (self.get_number_of_channels(),)), dtype=float)
+
+    def get_channel_gains(self):
+        if self._channel_gains is None:
+            self._channel_gains = np.ones(self.get_number_of_channels())
+        return self._channel_gains.copy()
+
+    def get_sample_rate(self):
+        return self._sample_rate
+
+    def get_block_size(self):
+        return self._block_size
+
+    def get_bits(self):
+        return self._bits
+
+    def get_dtype(self):
+        """Return the integer data type of the samples."""
+        return np.dtype(np.int16) if self._bits <= 16 else np.dtype(np.int32)
+
+    def reset(self, start=0.):
+        """Restart the acquisition.
+
+        Parameters
+        ----------
+        start : float, optional
+            The simulation time of the first sample [s].
+
+        """
+        self._start = start
+        self._sample = 0
+        self._rng = np.random.RandomState(self._seed)
+        self._states = [mic.new_filter_state() for mic in self._microphones]
+
+    def _save_state(self):
+        """Return a copy of the sampling clock and the filter states."""
+        return (self._sample, self._rng.get_state(),
+                [None if state is None else state.copy() for state in self._states])
+
+    def _restore_state(self, saved):
+        """Return to a state saved by `_save_state`."""
+        self._sample, rng_state, states = saved
+        self._rng.set_state(rng_state)
+        for state, saved_state in zip(self._states, states):
+            if state is not None:
+                state[...] = saved_state
+
+    def get_sample_times(self):
+        """Return the nominal times of the next block of samples [s]."""
+        return self._start + (self._sample + np.arange(self._block_size)) / self._sample_rate
+
+    def read_block(self, out=None):
+        """Sample the next block of all channels.
+
+        Parameters
+        ----------
+        out : ndarray, optional
+            A (channels, block_size) array of the digitizer's data type to
+            write the samples into. It does not need to be contiguous.
+            By default, an internal buffer is used.
+
+        Returns
+        -------
+        samples : ndarray
+            The (channels, block_size) integer samples.
+
+        Notes
+        -----
+        The internal buffer is allocated once and overwritten by every call.
+        Copy the returned array if it is needed after the next call.
+
+        """
+        self._allocate_buffers()
+        shape = self._buffer.shape
+        if out is None:
+            out = self._buffer
+        elif out.shape != shape:
+            raise ValueError("The output array must have the shape %s."%(shape,))
+        return self._read_samples(out, self._block_size)
+
+    def _allocate_buffers(self):
+        """Allocate the internal sample and work buffers, if necessary."""
+        if self._buffer is None:
+            shape = (self.get_number_of_channels(), self._block_size)
+            self._buffer = np.empty(shape, dtype=self.get_dtype())
+            self._work = np.empty(shape)
+
+    def _read_samples(self, out, n_samples):
+        """Sample the next `n_samples` samples of all channels into `out`.
+
+        `n_samples` must not exceed the block size. The clock advances by
+        `n_samples`, so the next block continues right after them.
+
+        """
+        self._allocate_buffers()
+
+        # Sampling times with clock offset and jitter
+        t = self.get_sample_times()[:n_samples] + self._clock_offset
+        if self._jitter > 0:
+            t += self._rng.normal(0., self._jitter, n_samples)
+
+        # Voltages of all channels
+        work = self._work[:,:n_samples]
+        i = 0
+        for mic, state in zip(self._microphones, self._states):
+            U = mic.get_voltage_signal(t, state)
+            n = int(np.prod(mic.get_channel_shape()))
+            work[i:i+n] = U.reshape(n, -1)
+            i += n
+
+        # Conversion to integers
+        top = 2**(self._bits - 1)
+        work *= (self.get_channel_gains() * top / self._full_scale)[:,np.newaxis]
+        np.rint(work, out=work)
+        np.clip(work, -top, top - 1, out=work)
+        out[...] = work
+
+        self._sample += n_samples
+        return out
+
+    def record(self, filename, n_samples):
+        """Stream samples of all channels into a memory mapped file.
+
+        Parameters
+        ----------
+        filename : str
+            The `.npy` file to be written.
+        n_samples : int
+            The number of samples per channel.
+
+        Returns
+        -------
+        data : memmap
+            The (n_samples, channels) recording.
+
+        Notes
+        -----
+        The file is allocated at the beginning. Every block is converted
+        directly into its place in the file, without intermediate copies.
+        A shorter final block only samples the missing samples, so the clock
+        stops right after the recording.
+
+        """
+        n_channels = self.get_number_of_channels()
+        data = np.lib.format.open_memmap(filename, mode='w+', dtype=self.get_dtype(), shape=(n_samples, n_channels))
+        B = self._block_size
+        for i in range(0, n_samples, B):
+            if i + B <= n_samples:
+                self.read_block(out=data[i:i+B].T)
+            else:
+                self._read_samples(data[i:].T, n_samples - i)
+        data.flush()
+        return data
+
+    def iter_realtime_blocks(self, n_blocks=None, queue_size=4):
+        """Generate blocks of samples paced by the wall clock.
+
+        Parameters
+        ----------
+        n_blocks : int, optional
+            The number of blocks. If `None`, blocks are generated until the
+            generator is closed.
+        queue_size : int, optional
+            The maximum number of blocks that are simulated ahead of time.
+
+        Yields
+        ------
+        samples : ndarray
+            The (channels, block_size) integer samples.
+
+        Notes
+        -----
+        A block is delivered when its last sample would have been recorded by
+        real hardware, i.e. every `block_size / sample_rate` seconds. The
+        blocks are simulated by a background thread, so the caller is not
+        blocked by the simulation while waiting for the next block.
+        Event loop based programs can fetch the blocks with `next` in an
+        executor, e.g. `loop.run_in_executor(None, next, blocks)`.
+
+        Blocks that are not ready in time count as overruns. They are
+        delivered as soon as they are available, and the schedule is not
+        changed. The statistics are available via `get_realtime_stats`.
+
+        The yielded arrays are taken from a ring of `queue_size + 2` buffers.
+        They are only valid until the next block is requested.
+
+        When the generator is closed early, the blocks that were simulated
+        ahead are discarded. The digitizer continues after the last delivered
+        block.
+
+        """
+        n_channels = self.get_number_of_channels()
+        ring = [np.empty((n_channels, self._block_size), dtype=self.get_dtype()) for i in range(queue_size + 2)]
+        blocks = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+
+        def put(item):
+            # Wait for space in the queue, unless the acquisition is stopped
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def worker():
+            k = 0
+            try:
+                while not stop.is_set() and (n_blocks is None or k < n_blocks):
+                    out = self.read_block(out=ring[k % len(ring)])
+                    put((out, self._save_state()))
+                    k += 1
+            except Exception as e:
+                log.exception("Simulation of real time block failed.")
+                put(e)
+
+        stats = dict(blocks=0, overruns=0, mean_latency=0., max_latency=0.)
+        self._realtime_stats = stats
+        period = self._block_size / self._sample_rate
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        delivered = self._save_state()
+        start = _clock()
+        thread.start()
+        try:
+            k = 0
+            while n_blocks is None or k < n_blocks:
+                due = start + (k + 1) * period
+                wait = due - _clock()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    out = blocks.get_nowait()
+                except queue.Empty:
+                    stats['overruns'] += 1
+                    out = blocks.get()
+                if isinstance(out, Exception):
+                    raise out
+                out, delivered = out
+                latency = _clock() - due
+                stats['blocks'] += 1
+                stats['mean_latency'] += (latency - stats['mean_latency']) / stats['blocks']
+                stats['max_latency'] = max(stats['max_latency'], latency)
+                yield out
+                k += 1
+        finally:
+            stop.set()
+            thread.join()
+            self._restore_state(delivered)
+
+    def get_realtime_stats(self):
+        """Return the statistics of the last real time acquisition.
+
+        Returns
+        -------
+        stats : dict
+            The number of delivered `blocks`, the number of `overruns`, i.e.
+            blocks that were not simulated in time, and the `mean_latency`
+            and `max_latency` of the delivery after the scheduled time [s].
+            `None` if there was no real time acquisition.
+
+        """
+        if self._realtime_stats is None:
+            return None
+        return dict(self._realtime_stats)
@@ -0,0 +1,153 @@
+# coding:utf-8
+"""Directivities for Phamarsim
+
+Directivities describe the direction dependent gain of speakers and
+microphones. They provide the method
+
+>>> get_gain(theta, phi)
+
+which returns the gain for the directions theta and phi [deg] relative to
+the object, i.e. theta is measured from the object's z-axis and phi from its
+x-axis. The gain should be 1 in the main direction.
+
+"""
+from __future__ import division
+import numpy as np
+import scipy.special
+
+import logging
+log = logging.getLogger(__name__)
+
+class Directivity():
+    """Gain pattern tabulated on a regular grid of directions
+
+    Parameters
+    ----------
+    gains : array-like
+        The (n_theta, n_phi) gains. The polar angles of the rows are evenly
+        spaced from 0 to 180 deg, the azimuthal angles of the columns from
+        -180 to 180 deg, both including the end points.
+
+    Notes
+    -----
+    Gains in between the grid points are interpolated bilinearly. All
+    directions are evaluated at once, without any per point Python code.
+
+    """
+    def __init__(self, gains):
+        gains = np.array(gains, dtype=float)
+        if gains.ndim != 2 or gains.shape[0] < 2 or gains.shape[1] < 2:
+            raise ValueError("The gains must be tabulated on an at least (2,2) grid.")
+        self._gains = gains
+        self._dtheta = 180. / (gains.shape[0] - 1)
+        self._dphi = 360. / (gains.shape[1] - 1)
+
+    @classmethod
+    def from_function(cls, func, n_theta=181, n_phi=361):
+        """Tabulate a gain function.
+
+        Parameters
+        ----------
+        func : callable
+            Function `func(theta, phi)` returning the gains for arrays of
+            directions [deg].
+        n_theta : int, optional
+            The number of tabulated polar angles.
+        n_phi : int, optional
+            The number of tabulated azimuthal angles.
+
+        """
+        theta, phi = cls.get_grid(n_theta, n_phi)
+        return cls(np.broadcast_to(func(theta, phi), theta.shape))
+
+    @staticmethod
+    def get_grid(n_theta=181, n_phi=361):
+        """Return the (n_theta, n_phi) polar and azimuthal angles of a table [deg]."""
+        theta = np.linspace(0., 180., n_theta)
+        phi = np.linspace(-180., 180., n_phi)
+        return np.meshgrid(theta, phi, indexing='ij')
+
+    def get_table(self):
+        """Return the tabulated (n_theta, n_phi) gains."""
+        return self._gains.copy()
+
+    def get_gain(self, theta, phi):
+        """Return the gains in the specified directions.
+
+        Parameters
+        ----------
+        theta : array-like
+            The polar angles as measured from the z-axis [deg].
+        phi : array-like
+            The azimuthal angles as measured from the x-axis [deg].
+
+        Returns
+        -------
+        gain : ndarray
+            The interpolated gains in the broadcast shape of `theta` and `phi`.
+
+        """
+        theta, phi = np.broadcast_arrays(np.asarray(theta, dtype=float), np.asarray(phi, dtype=float))
+        n_theta, n_phi = self._gains.shape
+
+        u = np.clip(theta, 0., 180.) / self._dtheta
+        i = np.clip(np.floor(u).astype(int), 0, n_theta-2)
+        u -= i
+        v = np.mod(phi + 180., 360.) / self._dphi
+        j = np.clip(np.floor(v).astype(int), 0, n_phi-2)
+        v -= j
+
+        G = self._gains
+        return ( (1-u) * ((1-v) * G[i,j]   + v * G[i,j+1]) +
+                    u  * ((1-v) * G[i+1,j] + v * G[i+1,j+1]) )
+
+def omni(n_theta=2, n_phi=2):
+    """Return an isotropic directivity."""
+    return Directivity(np.ones((n_theta, n_phi)))
+
+def cardioid(a=0.5, n_theta=181, n_phi=2):
+    """Return a first order directivity pattern.
+
+    Parameters
+    ----------
+    a : float, optional
+        The pattern is `a + (1-a)*cos(theta)`. 1 is omnidirectional, 0.5 a
+        cardioid, 0.25 a hypercardioid and 0 a figure-8.
+    n_theta : int, optional
+        The number of tabulated polar angles.
+    n_phi : int, optional
+        The number of tabulated azimuthal angles.
+
+    """
+    return Directivity.from_function(lambda theta, phi: a + (1-a)*np.cos(np.pi*theta/180), n_theta, n_phi)
+
+def piston(radius, frequency, c=331.3, n_theta=181, n_phi=2):
+    """Return the far field directivity of a baffled circular piston.
+
+    Parameters
+    ----------
+    radius : float
+        The radius of the piston [m].
+    frequency : float
+        The frequency [Hz].
+    c : float, optional
+        The speed of sound [m/s].
+    n_theta : int, optional
+        The number of tabulated polar angles.
+    n_phi : int, optional
+        The number of tabulated azimuthal angles.
+
+    Notes
+    -----
+    The gain is `2*J1(x)/x` with `x = k*radius*sin(theta)`, where `J1` is the
+    Bessel function of the first kind and `k` the wave number. The piston
+    faces along the z-axis. The baffle is ignored for theta > 90 deg, where
+    the pattern is simply mirrored.
+
+    """
+    ka = 2*np.pi*frequency/c * radius
+    def func(theta, phi):
+        x = ka * np.sin(np.pi*theta/180)
+        safe = np.where(x == 0, 1., x)
+        return np.where(x == 0, 1., 2*scipy.special.j1(safe)/safe)
+    return Directivity.from_function(func, n_theta, n_phi)
@@ -18,18 +18,347 @@ signal at position `x, y, z`. This simpler signal is also returned by the functi
 
 which will call `get_plane_waves` internally.
 
+The coordinates `x, y, z` can also be arrays describing M receivers, or `x`
+can be a single (M,3) array of stacked coordinates. In that case `theta` and
+`phi` of every wave have the shape (M,) and `p` has the shape (M,T). The
+times `t` can then be either of shape (T,), or of shape (M,T) to provide
+individual times for every receiver. The summed pressure signals of all
+receivers are returned as (M,T) array by
+
+>>> get_pressure_signals(t,x,y,z)
+
+The `RoomEnvironment` adds the reflections of a rectangular room with the
+image source method. Every image source results in an additional wave.
+
 """
 from __future__ import division
 import numpy as np
+from collections import OrderedDict
+import copy
+import multiprocessing
 
 import objects
 import mediums
 import speakers
+import caches
 
 import warnings
 import logging
 log = logging.getLogger(__name__)
 
+def iter_time_blocks(sample_rate, block_size, n_samples=None, start=0.):
+    """Generate consecutive blocks of sampling times.
+
+    Parameters
+    ----------
+    sample_rate : float
+        The sample rate [Hz].
+    block_size : int
+        The number of samples per block.
+    n_samples : int, optional
+        The total number of samples. The last block is shortened if
+        necessary. If `None`, blocks are generated indefinitely.
+    start : float, optional
+        The time of the first sample [s].
+
+    Yields
+    ------
+    t : ndarray
+        The sampling times of the block [s].
+
+    Notes
+    -----
+    The times are calculated from the integer sample index, so the blocks
+    join seamlessly and do not accumulate rounding errors.
+
+    """
+    offset = 0
+    while n_samples is None or offset < n_samples:
+        size = block_size
+        if n_samples is not None:
+            size = min(block_size, n_samples - offset)
+        yield start + (offset + np.arange(size)) / sample_rate
+        offset += size
+
+def get_image_lattice(size, reflection, max_order, min_energy=None):
+    """Return the image sources of a rectangular room relative to the source position.
+
+    Parameters
+    ----------
+    size : array-like
+        The (3,) dimensions of the room, which spans from the origin to `size` [m].
+    reflection : array-like
+        The (3,2) pressure reflection factors of the walls, i.e. of the planes
+        at `0` and `size` for every axis.
+    max_order : int
+        The maximum number of reflections.
+    min_energy : float, optional
+        Image sources whose energy, i.e. the product of the squared reflection
+        factors, is lower than this are discarded.
+
+    Returns
+    -------
+    offsets : ndarray
+        The (I,3) offsets of the image sources [m].
+    mirrors : ndarray
+        The (I,3) signs of the image coordinates. The image of a source at
+        `x` is located at `offsets + mirrors * x`.
+    gains : ndarray
+        The (I,) products of the reflection factors.
+
+    Notes
+    -----
+    Follows Allen and Berkley (1979): Along every axis, the images are
+    located at `2*n*L + (1-2*q)*x` with integer `n` and `q` in `{0, 1}`, and
+    the walls at `0` and `L` are hit `|n-q|` and `|n|` times respectively.
+    The whole lattice is built with broadcasting. The images are sorted by
+    order, so the direct sound is always the first one.
+
+    """
+    size = np.asarray(size, dtype=float)
+    reflection = np.asarray(reflection, dtype=float)
+    n = np.repeat(np.arange(-max_order, max_order+1), 2)
+    q = np.tile([0, 1], 2*max_order+1)
+    lo, hi = np.abs(n - q), np.abs(n)
+    select = lo + hi <= max_order
+    n, q, lo, hi = n[select], q[select], lo[select], hi[select]
+
+    # Per axis: offsets, signs, orders and gains, broadcast to (A,A,A)
+    axes = []
+    for i in range(3):
+        shape = [1, 1, 1]
+        shape[i] = -1
+        axes.append( ( (2. * n * size[i]).reshape(shape),
+                       (1. - 2. * q).reshape(shape),
+                       (lo + hi).reshape(shape),
+                       (reflection[i,0]**lo * reflection[i,1]**hi).reshape(shape) ) )
+    order = axes[0][2] + axes[1][2] + axes[2][2]
+    gains = axes[0][3] * axes[1][3] * axes[2][3]
+    select = order <= max_order
+    if min_energy is not None:
+        select &= gains**2 >= min_energy
+
+    full = order.shape
+    offsets = np.stack([np.broadcast_to(a[0], full)[select] for a in axes], axis=-1)
+    mirrors = np.stack([np.broadcast_to(a[1], full)[select] for a in axes], axis=-1)
+    i = np.argsort(order[select], kind='mergesort')
+    return offsets[i], mirrors[i], gains[select][i]
+
+def get_image_sources(lattice, position, max_distance=None, center=None, radius=0.):
+    """Return the image sources for a source position.
+
+    Parameters
+    ----------
+    lattice : tuple
+        The image lattice of the room. See `get_image_lattice`.
+    position : array-like
+        The (3,) position of the source [m].
+    max_distance : float, optional
+        Image sources that are farther away than this from every point of a
+        sphere around `center` with radius `radius` are discarded [m].
+    center : array-like, optional
+        The (3,) center of the receiver region, e.g. of the room [m].
+    radius : float, optional
+        The radius of the receiver region [m].
+
+    Returns
+    -------
+    positions : ndarray
+        The (I,3) positions of the image sources [m].
+    gains : ndarray
+        The (I,) reflection factors of the image sources.
+    mirrors : ndarray
+        The (I,3) signs of the image coordinates. A ray from the image source
+        in direction `d` left the real source in direction `mirrors * d`.
+
+    """
+    offsets, mirrors, gains = lattice
+    positions = offsets + mirrors * np.asarray(position, dtype=float)
+    if max_distance is not None:
+        select = np.sqrt(np.sum((positions - center)**2, axis=-1)) - radius <= max_distance
+        positions, gains, mirrors = positions[select], gains[select], mirrors[select]
+    return positions, gains, mirrors
+
+def get_image_propagation(images, Minv, v, c):
+    """Return the propagation from image sources to receivers.
+
+    Parameters
+    ----------
+    images : tuple
+        The image sources. See `get_image_sources`.
+    Minv : ndarray
+        The (3,3) inverse rotation matrix of the real source.
+    v : ndarray
+        The (M,3) positions of the receivers [m].
+    c : float
+        The speed of sound [m/s].
+
+    Returns
+    -------
+    Dt, g, ltheta, lphi, theta, phi : ndarray
+        The (I,M) delays, attenuations and directions.
+        See `SimpleEnvironment.get_propagation`.
+
+    """
+    positions, gains, mirrors = images
+    # Receiver positions relative to the images, (I,M,3)
+    d = v[np.newaxis,:,:] - positions[:,np.newaxis,:]
+    # Direction of the rays at the real source in its coordinate system
+    ltheta, lphi, lr = objects.cartesian_to_spherical( np.einsum('ij,kmj->kmi', Minv, d * mirrors[:,np.newaxis,:]) )
+    Dt = lr / c
+    g = gains[:,np.newaxis] / lr
+    theta, phi, r = objects.cartesian_to_spherical(d)
+    return Dt, g, ltheta, lphi, theta, phi
+
+def _get_sample_spacing(t):
+    """Return the sample spacing of uniformly sampled times along the last axis."""
+    if t.shape[-1] < 2:
+        raise ValueError("Absorption filters need at least two samples.")
+    diff = np.diff(t, axis=-1)
+    dt = diff.flat[0]
+    if not np.allclose(diff, dt, rtol=1e-6, atol=0):
+        raise ValueError("Absorption filters need uniformly sampled times.")
+    return dt
+
+def evaluate_paths(spk, t, Dt, g, ltheta, lphi, medium):
+    """Return the summed signals of a speaker along several propagation paths.
+
+    Parameters
+    ----------
+    spk : Speaker
+        The emitting speaker.
+    t : ndarray
+        The (T,) or (M,T) times at which the signals should be evaluated [s].
+    Dt, g, ltheta, lphi : ndarray
+        The (...,M) delays, attenuations and directions of the paths.
+        See `SimpleEnvironment.get_propagation`.
+    medium : SimpleMedium
+        The medium. If it absorbs sound, every path is filtered with the
+        absorption filter of its length.
+
+    Returns
+    -------
+    p : ndarray
+        The (M,T) signals, summed over the leading axes of the paths.
+
+    Notes
+    -----
+    Paths in the same distance bucket of the medium share one filter, so
+    they are summed before they are filtered. The times must be uniformly
+    sampled in that case. The source is evaluated on an extended time range,
+    so the filters start up before the first sample and their delay is
+    compensated.
+
+    """
+    Dt, g, ltheta, lphi = [np.reshape(a, (-1, np.shape(a)[-1])) for a in (Dt, g, ltheta, lphi)]
+    if not medium.has_absorption():
+        p = spk.get_pressure_signal(t - Dt[...,np.newaxis], ltheta[...,np.newaxis], lphi[...,np.newaxis]) * g[...,np.newaxis]
+        return np.sum(p, axis=0)
+
+    dt = _get_sample_spacing(t)
+    L = medium.get_numtaps()
+    T = t.shape[-1]
+    t = t[...,:1] + (np.arange(T + L - 1) - (L - 1) // 2) * dt
+    p = spk.get_pressure_signal(t - Dt[...,np.newaxis], ltheta[...,np.newaxis], lphi[...,np.newaxis]) * g[...,np.newaxis]
+    r = Dt * medium.get_speed_of_sound()
+    buckets = medium.get_distance_buckets(r)
+    signal = np.zeros(p.shape[-2:-1] + (T,))
+    for b in np.unique(buckets):
+        select = buckets == b
+        rows = np.any(select, axis=0)
+        summed = np.einsum('pm,pmt->mt', select[:,rows].astype(float), p[:,rows])
+        flt = medium.get_absorption_filter(r[select][0], 1. / dt)
+        signal[rows] += flt.apply(summed)[...,L-1:]
+    return signal
+
+def get_ray_propagation(medium, position, Minv, v):
+    """Return the propagation from a source to receivers through a medium.
+
+    Parameters
+    ----------
+    medium : SimpleMedium
+        The medium, which provides the rays. See `SimpleMedium.get_rays`.
+    position : array-like
+        The (3,) position of the source [m].
+    Minv : ndarray
+        The (3,3) inverse rotation matrix of the source.
+    v : ndarray
+        The (M,3) positions of the receivers [m].
+
+    Returns
+    -------
+    Dt, g, ltheta, lphi, theta, phi : ndarray
+        The (M,) delays, attenuations and directions.
+        See `SimpleEnvironment.get_propagation`.
+
+    """
+    Dt, g, emission, arrival = medium.get_rays(position, v)
+    ltheta, lphi, r = objects.cartesian_to_spherical( objects._rotate(Minv, emission) )
+    theta, phi, r = objects.cartesian_to_spherical(arrival)
+    return Dt, g, ltheta, lphi, theta, phi
+
+# The number of (K,M,T) float arrays that are alive at the same time while
+# `_scan_chunk` evaluates a chunk: the delayed times, the source signal and its
+# weighted copy, plus a few temporaries within the sound source.
+_SCAN_TEMPORARIES = 6
+
+def _scan_chunk(args):
+    """Calculate the response of the receivers for a chunk of speaker positions.
+
+    This is a module level function, so it can be used with a process pool.
+    See `SimpleEnvironment.scan_source_positions`.
+
+    """
+    spk, positions, t, v, weights, background, medium, room = args
+    c = medium.get_speed_of_sound()
+    if room is None and not (medium.has_absorption() or medium.has_refraction()):
+        # Receiver positions relative to all candidate positions, (K,M,3)
+        d = v[np.newaxis,:,:] - positions[:,np.newaxis,:]
+        # Direction of the receivers in the speaker's coordinate system
+        ltheta, lphi, lr = objects.cartesian_to_spherical( np.einsum('ij,kmj->kmi', spk.get_inverse_rotation_matrix(), d) )
+        # Time delay and weakened signal due to spherical expansion
+        Dt = lr / c
+        td = t - Dt[...,np.newaxis]
+        p = spk.get_pressure_signal(td, ltheta[...,np.newaxis], lphi[...,np.newaxis])
+        del td
+        p = np.array(p, copy=not p.flags.writeable)
+        p /= lr[...,np.newaxis]
+        # Weighted sum over the receivers, (K,T)
+        p = np.einsum('m,kmt->kt', weights, p) + background
+        return np.std(p, axis=-1)
+
+    # Every candidate position has its own propagation paths
+    response = np.empty(len(positions))
+    for k, position in enumerate(positions):
+        if room is None:
+            paths = get_ray_propagation(medium, position, spk.get_inverse_rotation_matrix(), v)
+            Dt, g, ltheta, lphi, theta, phi = [x[np.newaxis] for x in paths]
+            chunk_size = 1
+        else:
+            lattice, culling, chunk_size = room
+            images = get_image_sources(lattice, position, **culling)
+            Dt, g, ltheta, lphi, theta, phi = get_image_propagation(images, spk.get_inverse_rotation_matrix(), v, c)
+        p = np.array(background)
+        for i in range(0, len(g), chunk_size):
+            chunk = slice(i, i + chunk_size)
+            p += np.dot(weights, evaluate_paths(spk, t, Dt[chunk], g[chunk], ltheta[chunk], lphi[chunk], medium))
+        response[k] = np.std(p)
+    return response
+
+def _detached_speaker(spk):
+    """Return a shallow copy of the speaker without links to environment or other speakers.
+
+    The copy can be sent to worker processes without pickling the whole scene.
+
+    """
+    src = copy.copy(spk.get_source())
+    src._speakers = []
+    src._cache = None
+    dummy = copy.copy(spk)
+    dummy._environment = None
+    dummy._source = src
+    return dummy
+
 class Environment():
     """Base class for environments
 
@@ -40,7 +369,12 @@ class Environment():
 
     """
     def __init__(self, objects=[]):
-        self._objects = []
+        # All objects, keyed by their identity
+        self._objects = OrderedDict()
+        # Objects grouped by the types that have been asked for
+        self._buckets = {}
+        # Immutable snapshots of the buckets, returned by get_objects
+        self._bucket_tuples = {}
         self.add_objects(objects)
 
     def add_objects(self, objects):
@@ -55,26 +389,45 @@ class Environment():
         for obj in objects:
             self.add_object(obj)
 
+    def has_object(self, obj):
+        """Return whether the object is a part of the environment."""
+        return id(obj) in self._objects
+
+    def _register(self, obj):
+        """Add the object to the registry and all matching type buckets."""
+        key = id(obj)
+        self._objects[key] = obj
+        for typ, bucket in self._buckets.items():
+            if isinstance(obj, typ):
+                bucket[key] = obj
+                self._bucket_tuples[typ] = tuple(bucket.values())
+
+    def _unregister(self, obj):
+        """Remove the object from the registry and all type buckets."""
+        key = id(obj)
+        del self._objects[key]
+        for typ, bucket in self._buckets.items():
+            if bucket.pop(key, None) is not None:
+                self._bucket_tuples[typ] = tuple(bucket.values())
+
     def add_object(self, obj):
         """Add an object to the environment.
         
         Raises a ValueError if the object is already a part of the environment.
         
         """
-        if obj in self._objects:
+        if self.has_object(obj):
             raise ValueError("The object is already a part of the environment.")
 
         # Add the object
-        self._objects.append(obj)
-        try:
-            obj.add_to_environment(self)
-        except ValueError:
-            # Catch ValueErrors so a mutual adding does not raise an error.
-            pass
-        except:
-            # The object could not be added. Reset.
-            self._objects.remove(obj)
-            raise
+        self._register(obj)
+        if obj.get_environment() is not self:
+            try:
+                obj.add_to_environment(self)
+            except:
+                # The object could not be added. Reset.
+                self._unregister(obj)
+                raise
         log.debug("%s now includes %s."%(self, obj))
 
     def remove_object(self, obj):
@@ -83,23 +436,32 @@ class Environment():
         Raises a ValueError if the object is not a part of the environment.
 
         """
-        if obj not in self._objects:
+        if not self.has_object(obj):
             raise ValueError("The object is no part of the environment.")
 
         # Remove the object
-        self._objects.remove(obj)
-        try:
+        self._unregister(obj)
+        if obj.get_environment() is self:
             obj.remove_from_environment(self)
-        except ValueError:
-            # Don't raise an error on mutual removal.
-            pass
         log.debug("%s no longer includes %s."%(self, obj))
 
     def get_objects(self, typ=objects.SimpleObject):
-        """Return a list of all objects in the environment of type typ."""
-        return [o for o in self._objects if isinstance(o, typ)]
+        """Return a tuple of all objects in the environment of type typ.
+
+        The objects are kept in buckets per requested type, which are updated
+        whenever objects are added or removed. Only the first request of a
+        type has to check all objects. The returned tuple is rebuilt on every
+        change, so repeated requests do not copy anything.
 
-    def get_plane_waves(self, t, x, y, z):
+        """
+        objs = self._bucket_tuples.get(typ)
+        if objs is None:
+            bucket = OrderedDict( (key, o) for key, o in self._objects.items() if isinstance(o, typ) )
+            self._buckets[typ] = bucket
+            objs = self._bucket_tuples[typ] = tuple(bucket.values())
+        return objs
+
+    def get_plane_waves(self, t, x, y=None, z=None):
         warnings.warn("Tried to get plane waves from the Environment base class.")
         return []
 
@@ -110,20 +472,97 @@ class Environment():
             signal += p
         return signal
 
+    def get_pressure_signals(self, t, x, y=None, z=None):
+        """Return the pressure signals at multiple positions.
+
+        Parameters
+        ----------
+        t : array-like
+            Times at which the signals should be evaluated [s].
+            Either of shape (T,) for all positions or of shape (M,T) with
+            individual times for every position.
+        x : array-like
+            The x-positions of the M receivers [m].
+            If `y` and `z` are not provided, `x` is interpreted as an array of
+            shape (M,3) containing the stacked x, y and z coordinates.
+        y : array-like, optional
+            The y-positions of the M receivers [m].
+        z : array-like, optional
+            The z-positions of the M receivers [m].
+
+        Returns
+        -------
+        p : ndarray
+            The pressure signals as (M,T) array.
+
+        """
+        v, shape, stacked = objects._as_points(x, y, z)
+        waves = self.get_plane_waves(t, v)
+        signal = np.zeros((len(v),) + np.shape(t)[-1:])
+        for tt, theta, phi, p in waves:
+            signal += p
+        return signal
+
+    def iter_pressure_blocks(self, sample_rate, block_size, x, y=None, z=None, n_samples=None, start=0.):
+        """Generate the pressure signals at multiple positions block by block.
+
+        Parameters
+        ----------
+        sample_rate : float
+            The sample rate [Hz].
+        block_size : int
+            The number of samples per block.
+        x, y, z : array-like
+            The positions of the M receivers [m].
+            See `get_pressure_signals`.
+        n_samples : int, optional
+            The total number of samples. If `None`, blocks are generated
+            indefinitely.
+        start : float, optional
+            The time of the first sample [s].
+
+        Yields
+        ------
+        t : ndarray
+            The (B,) sampling times of the block [s].
+        p : ndarray
+            The (M,B) pressure signals of the block.
+
+        Notes
+        -----
+        Only one block is held in memory at a time. Since the sources are
+        evaluated at the delayed times of every block, the propagation delays
+        carry over the block boundaries without any special treatment.
+
+        """
+        v, shape, stacked = objects._as_points(x, y, z)
+        for t in iter_time_blocks(sample_rate, block_size, n_samples, start):
+            yield t, self.get_pressure_signals(t, v)
+
 class SimpleEnvironment(Environment):
-    """Creates a very simple environment with a homogeneous material and point-like objects.
+    """Creates a very simple environment with point-like objects in a medium without boundaries.
 
     Parameters:
     -----------
     medium : SimpleMedium, optional
         The medium of the environment. Defaults to `mediums.SimpleAir()`.
+    propagation_cache_size : int, optional
+        The number of speaker-receiver geometries for which the propagation
+        delays, attenuations and directions are kept.
+    contribution_cache_bytes : int, optional
+        The memory budget in bytes for the cached pressure signals of the
+        individual speakers at the receivers. When the same times are
+        evaluated repeatedly, e.g. while single speakers are moved, only the
+        changed speakers are recalculated. 0 disables the cache.
     objects : iterable, optional
         An iterable of the objects that should be added to the environment.
 
     """
-    def __init__(self, medium=mediums.SimpleMedium(), **kwargs):
+    def __init__(self, medium=mediums.SimpleMedium(), propagation_cache_size=256, contribution_cache_bytes=16*2**20, **kwargs):
         Environment.__init__(self, **kwargs)
         self._medium = None
+        self._propagation_cache = caches.LRUCache(propagation_cache_size)
+        self._contribution_cache = caches.LRUCache(maxsize=None, max_bytes=contribution_cache_bytes)
         self.set_medium(medium)
 
     def set_medium(self, medium):
@@ -133,22 +572,447 @@ class SimpleEnvironment(Environment):
     def get_medium(self):
         return self._medium
 
-    def get_plane_waves(self, t, x, y, z):
-        """Return the local plane waves pressure signals."""
+    def get_version(self):
+        """Return a counter that changes whenever the environment itself changes.
+
+        It is part of the cache keys. The free field has nothing that can
+        change apart from the medium, which has its own version.
+
+        """
+        return 0
+
+    def get_propagation(self, spk, v):
+        """Return the propagation from a speaker to the receivers.
+
+        Parameters
+        ----------
+        spk : Speaker
+            The emitting speaker.
+        v : ndarray
+            The (M,3) positions of the receivers [m].
+
+        Returns
+        -------
+        Dt : ndarray
+            The (M,) time delays due to the distances to the speaker [s].
+        g : ndarray
+            The (M,) attenuation factors due to spherical expansion [1/m].
+        ltheta, lphi : ndarray
+            The (M,) directions of the receivers in the speaker's coordinate system [deg].
+        theta, phi : ndarray
+            The (M,) directions of the sound waves in global coordinates [deg].
+
+        Notes
+        -----
+        The rays are provided by the medium, see `get_ray_propagation`. In
+        homogeneous mediums they are straight lines.
+
+        The results are cached. The cache key contains the pose version of
+        the speaker, the receiver positions and the version of the medium,
+        so moving the speaker or changing the medium leads to a recalculation.
+
+        """
+        medium = self.get_medium()
+        key = (spk, spk.get_pose_version(), caches.array_key(v), medium, medium.get_version())
+        table = self._propagation_cache.get(key)
+        if table is None:
+            table = get_ray_propagation(medium, spk.get_position(), spk.get_inverse_rotation_matrix(), v)
+            for a in table:
+                a.setflags(write=False)
+            self._propagation_cache.put(key, table)
+        return table
+
+    def get_contribution(self, spk, t, v):
+        """Return the pressure signals of a single speaker at the receivers.
+
+        Parameters
+        ----------
+        spk : Speaker
+            The emitting speaker.
+        t : ndarray
+            The (T,) or (M,T) times at which the signals should be evaluated [s].
+        v : ndarray
+            The (M,3) positions of the receivers [m].
+
+        Returns
+        -------
+        p : ndarray
+            The (M,T) pressure signals of the speaker at the receivers.
+            Cached signals are read-only.
+
+        Notes
+        -----
+        If the contribution cache is enabled, the results are cached. The
+        cache key contains the pose and signal versions of the speaker and
+        its source, so only the contributions of speakers that actually
+        changed are recalculated. Without a cache, no keys are calculated.
+
+        """
+        if self._contribution_cache.get_max_bytes() == 0:
+            return self._evaluate_contribution(spk, t, v)
+        src = spk.get_source()
+        medium = self.get_medium()
+        key = (spk, spk.get_pose_version(), spk.get_signal_version(), src, src.get_version(),
+               caches.array_key(v), caches.array_key(t), medium, medium.get_version(), self.get_version())
+        p = self._contribution_cache.get(key)
+        if p is None:
+            p = self._evaluate_contribution(spk, t, v)
+            p.setflags(write=False)
+            self._contribution_cache.put(key, p, p.nbytes)
+        return p
+
+    def _evaluate_contribution(self, spk, t, v):
+        """Calculate the (M,T) pressure signals of a speaker without caching."""
+        Dt, g, ltheta, lphi, theta, phi = self.get_propagation(spk, v)
+        return evaluate_paths(spk, t, Dt, g, ltheta, lphi, self.get_medium())
+
+    def get_pressure_signals(self, t, x, y=None, z=None):
+        """Return the pressure signals at multiple positions.
+
+        See `Environment.get_pressure_signals`.
+
+        Speakers with analytic sources (see `SoundSource.get_phasors`) are
+        not evaluated per speaker-receiver pair. Instead, their delayed and
+        attenuated tones are added up as complex phasors for every receiver
+        and frequency, and each distinct frequency is synthesized only once
+        per receiver. The absorption of the medium is applied exactly to the
+        phasors, while all other signals are filtered, see `evaluate_paths`.
+
+        """
+        v, shape, stacked = objects._as_points(x, y, z)
+        t = np.asarray(t, dtype=float)
+        signal = np.zeros((len(v),) + t.shape[-1:])
+
+        medium = self.get_medium()
+        phasors = OrderedDict()
+        for spk in self.get_objects(speakers.Speaker):
+            Dt, g, ltheta, lphi, theta, phi = self.get_propagation(spk, v)
+            tones = spk.get_phasors(ltheta, lphi)
+            if tones is None:
+                signal += self.get_contribution(spk, t, v)
+                continue
+            for f, a in zip(*tones):
+                A = a * g * np.exp(-2j*np.pi*f*Dt)
+                if medium.has_absorption():
+                    # Exact attenuation of the tone
+                    A *= medium.get_attenuation(f, Dt * medium.get_speed_of_sound())
+                # Sum over the image sources, if there are any
+                A = np.sum(A.reshape((-1, len(v))), axis=0)
+                if f in phasors:
+                    phasors[f] += A
+                else:
+                    phasors[f] = A
+
+        # Im(A * exp(i*w*t)) = Re(A) * sin(w*t) + Im(A) * cos(w*t)
+        for f, A in phasors.items():
+            wt = 2*np.pi*f*t
+            signal += A.real[:,np.newaxis] * np.sin(wt) + A.imag[:,np.newaxis] * np.cos(wt)
+
+        return signal
+
+    def get_plane_waves(self, t, x, y=None, z=None):
+        """Return the local plane waves pressure signals.
+
+        The distances, delays and attenuations of all receivers are calculated
+        in one go for every speaker and cached as long as the geometry does
+        not change. The resulting signals of every speaker are cached as well.
+
+        """
+        v, shape, stacked = objects._as_points(x, y, z)
+        t = np.asarray(t, dtype=float)
 
         waves = []
-        dummy = objects.SimpleObject(x=x, y=y, z=z)
         for spk in self.get_objects(speakers.Speaker):
-            # Direction of the point in the speaker's coordinate system
-            ltheta, lphi, lr = objects.cartesian_to_spherical( *spk.global_to_local_position(x, y, z) )
-            # Time delay due to distance to speaker
-            Dt = lr / self.get_medium().get_speed_of_sound()
-            # Weakened signal due to spherical expansion in space
-            p = spk.get_pressure_signal(t - Dt, ltheta, lphi) / lr
-            # Direction of the sound wave in global coordinates
-            theta, phi, r = objects.cartesian_to_spherical( *(dummy.get_position() - spk.get_position()) )
+            Dt, g, ltheta, lphi, theta, phi = self.get_propagation(spk, v)
+            p = self.get_contribution(spk, t, v)
+            if not p.flags.writeable:
+                # Cached signals must not be handed out
+                p = p.copy()
             # The final wave
-            waves.append( (t, theta, phi, p) )
+            waves.append( (t, theta.reshape(shape).copy()[()], phi.reshape(shape).copy()[()], p.reshape(shape + p.shape[-1:])) )
+
+        return waves
+
+    def scan_source_positions(self, spk, positions, t, x, y=None, z=None, weights=None, max_bytes=32*2**20, processes=None):
+        """Calculate the response of receivers while a speaker is moved across candidate positions.
+
+        For every candidate position of the speaker, the signals at the
+        receivers are combined in a weighted sum. The standard deviation of
+        that sum over time is the response at that position.
+
+        Parameters
+        ----------
+        spk : Speaker
+            The speaker to be moved. It keeps its orientation and is not
+            actually moved in the environment.
+        positions : array-like
+            The (K,3) candidate positions of the speaker [m].
+        t : array-like
+            The (T,) or (M,T) times at which the receiver signals are evaluated [s].
+            Individual times per receiver can be used to apply steering delays.
+        x, y, z : array-like
+            The positions of the M receivers [m].
+            See `get_pressure_signals`.
+        weights : array-like, optional
+            The (M,) weights of the receivers in the sum. Defaults to `1/M`.
+        max_bytes : int, optional
+            The approximate memory budget for the signals and temporaries of
+            one chunk of candidate positions.
+        processes : int, optional
+            If given, the chunks are distributed over a pool with that many
+            worker processes.
+
+        Returns
+        -------
+        response : ndarray
+            The (K,) responses for the candidate positions.
+
+        Notes
+        -----
+        All other speakers are static. Their summed signals are calculated
+        once and added to the signals of every candidate position.
+
+        """
+        v, shape, stacked = objects._as_points(x, y, z)
+        positions = np.array(positions, dtype=float, ndmin=2)
+        t = np.asarray(t, dtype=float)
+        n_rec = len(v)
+        n_t = t.shape[-1]
+        if weights is None:
+            weights = np.ones(n_rec) / n_rec
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), (n_rec,))
+
+        # The static part of the weighted sum
+        background = np.zeros(n_t)
+        for other in self.get_objects(speakers.Speaker):
+            if other is not spk:
+                background += np.dot(weights, self.get_contribution(other, t, v))
+
+        # Chunks of candidate positions, the budget is shared by all temporaries
+        budget = max_bytes // _SCAN_TEMPORARIES
+        chunk_size = max(1, int(budget // (8 * n_rec * n_t)))
+        dummy = _detached_speaker(spk)
+        room = self._get_scan_room(n_rec * n_t, budget)
+        chunks = [ (dummy, positions[i:i+chunk_size], t, v, weights, background, self.get_medium(), room)
+                   for i in range(0, len(positions), chunk_size) ]
+
+        if processes is None:
+            results = [_scan_chunk(args) for args in chunks]
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_scan_chunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+
+        return np.concatenate(results)
+
+    def _get_scan_room(self, size, max_bytes):
+        """Return the description of the reflections for `_scan_chunk`.
+
+        The free field has no reflections.
+
+        """
+        return None
+
+class RoomEnvironment(SimpleEnvironment):
+    """A rectangular room with reflecting walls.
+
+    The reflections are modelled with image sources. Apart from that, the
+    room behaves like a `SimpleEnvironment`.
+
+    Parameters
+    ----------
+    size : array-like, optional
+        The (3,) dimensions of the room [m]. The room spans from the origin to
+        `size`.
+    absorption : float or array-like, optional
+        The energy absorption coefficients of the walls. Either a single value
+        for all walls, or six values for the walls at `x=0`, `x=size[0]`,
+        `y=0`, `y=size[1]`, `z=0` and `z=size[2]`.
+    max_order : int, optional
+        The maximum number of reflections.
+    max_delay : float, optional
+        Image sources whose sound can not reach the room within this delay
+        are discarded [s].
+    min_energy : float, optional
+        Image sources that have lost more energy than this factor in their
+        reflections are discarded.
+    image_cache_size : int, optional
+        The number of speaker poses for which the image sources are kept.
+    max_bytes : int, optional
+        The approximate memory budget for the signals of one chunk of image
+        sources.
+    **kwargs : optional
+        Passed to `SimpleEnvironment`.
+
+    Notes
+    -----
+    The image lattice relative to the source position only depends on the
+    room, so it is calculated once. The image sources of a speaker are
+    cached per pose of the speaker.
+
+    """
+    def __init__(self, size=(5., 4., 3.), absorption=0.1, max_order=3, max_delay=None, min_energy=None,
+                 image_cache_size=64, max_bytes=32*2**20, **kwargs):
+        self._room_version = 0
+        self._lattice = None
+        self._image_cache = caches.LRUCache(image_cache_size)
+        self._max_bytes = max_bytes
+        self.set_size(size)
+        self.set_absorption(absorption)
+        self.set_max_order(max_order)
+        self.set_max_delay(max_delay)
+        self.set_min_energy(min_energy)
+        SimpleEnvironment.__init__(self, **kwargs)
+
+    def set_medium(self, medium):
+        """Set the medium of the room, which must not refract sound."""
+        if medium.has_refraction():
+            raise ValueError("The image sources need a medium with straight rays.")
+        SimpleEnvironment.set_medium(self, medium)
+
+    def _room_changed(self):
+        """Invalidate the image sources after a change of the room."""
+        self._room_version += 1
+        self._lattice = None
+        self._image_cache.clear()
+
+    def get_room_version(self):
+        """Return a counter that is increased whenever the room changes."""
+        return self._room_version
+
+    def get_version(self):
+        return self._room_version
+
+    def set_size(self, size):
+        size = np.array(size, dtype=float)
+        if size.shape != (3,) or np.any(size <= 0):
+            raise ValueError("The size must consist of three positive values.")
+        self._size = size
+        self._room_changed()
+
+    def get_size(self):
+        return self._size.copy()
+
+    def set_absorption(self, absorption):
+        absorption = np.array(np.broadcast_to(np.asarray(absorption, dtype=float).ravel(), (6,)))
+        if np.any(absorption < 0) or np.any(absorption > 1):
+            raise ValueError("The absorption coefficients must be between 0 and 1.")
+        self._absorption = absorption
+        self._room_changed()
+
+    def get_absorption(self):
+        return self._absorption.copy()
+
+    def set_max_order(self, max_order):
+        self._max_order = int(max_order)
+        self._room_changed()
+
+    def get_max_order(self):
+        return self._max_order
+
+    def set_max_delay(self, max_delay):
+        self._max_delay = max_delay
+        self._room_changed()
+
+    def get_max_delay(self):
+        return self._max_delay
+
+    def set_min_energy(self, min_energy):
+        self._min_energy = min_energy
+        self._room_changed()
+
+    def get_min_energy(self):
+        return self._min_energy
+
+    def get_image_lattice(self):
+        """Return the image lattice of the room. See `get_image_lattice`."""
+        if self._lattice is None:
+            reflection = np.sqrt(1. - self._absorption).reshape((3,2))
+            self._lattice = get_image_lattice(self._size, reflection, self._max_order, self._min_energy)
+            for a in self._lattice:
+                a.setflags(write=False)
+        return self._lattice
+
+    def _get_culling(self):
+        """Return the keyword arguments of `get_image_sources`."""
+        if self._max_delay is None:
+            return {}
+        return {'max_distance': self._max_delay * self.get_medium().get_speed_of_sound(),
+                'center': self._size / 2., 'radius': np.sqrt(np.sum(self._size**2)) / 2.}
+
+    def get_image_sources(self, spk):
+        """Return the image sources of a speaker.
+
+        Returns
+        -------
+        positions, gains, mirrors : ndarray
+            See `get_image_sources`.
+
+        """
+        key = (spk, spk.get_pose_version(), self._room_version, self.get_medium().get_speed_of_sound())
+        images = self._image_cache.get(key)
+        if images is None:
+            images = get_image_sources(self.get_image_lattice(), spk.get_position(), **self._get_culling())
+            for a in images:
+                a.setflags(write=False)
+            self._image_cache.put(key, images)
+        return images
+
+    def get_propagation(self, spk, v):
+        """Return the propagation from the image sources of a speaker to the receivers.
+
+        See `SimpleEnvironment.get_propagation`. All returned arrays have the
+        shape (I,M), with the first image being the speaker itself.
+
+        """
+        medium = self.get_medium()
+        key = (spk, spk.get_pose_version(), self._room_version, caches.array_key(v), medium, medium.get_version())
+        table = self._propagation_cache.get(key)
+        if table is None:
+            c = medium.get_speed_of_sound()
+            table = get_image_propagation(self.get_image_sources(spk), spk.get_inverse_rotation_matrix(), v, c)
+            for a in table:
+                a.setflags(write=False)
+            self._propagation_cache.put(key, table)
+        return table
+
+    def _get_image_chunk_size(self, size):
+        return max(1, int(self._max_bytes // (8 * size)))
+
+    def _evaluate_contribution(self, spk, t, v):
+        """Calculate the (M,T) pressure signals of a speaker without caching.
+
+        The image sources are evaluated in chunks and summed up.
+
+        """
+        Dt, g, ltheta, lphi, theta, phi = self.get_propagation(spk, v)
+        p = np.zeros((len(v),) + t.shape[-1:])
+        n = self._get_image_chunk_size(p.size)
+        for i in range(0, len(g), n):
+            chunk = slice(i, i + n)
+            p += evaluate_paths(spk, t, Dt[chunk], g[chunk], ltheta[chunk], lphi[chunk], self.get_medium())
+        return p
+
+    def get_plane_waves(self, t, x, y=None, z=None):
+        """Return the local plane waves pressure signals.
+
+        Every image source of every speaker results in one wave.
+
+        """
+        v, shape, stacked = objects._as_points(x, y, z)
+        t = np.asarray(t, dtype=float)
+
+        waves = []
+        for spk in self.get_objects(speakers.Speaker):
+            Dt, g, ltheta, lphi, theta, phi = self.get_propagation(spk, v)
+            for i in range(len(g)):
+                p = evaluate_paths(spk, t, Dt[i], g[i], ltheta[i], lphi[i], self.get_medium())
+                waves.append( (t, theta[i].reshape(shape).copy()[()], phi[i].reshape(shape).copy()[()], p.reshape(shape + p.shape[-1:])) )
 
         return waves
 
+    def _get_scan_room(self, size, max_bytes):
+        return (self.get_image_lattice(), self._get_culling(), max(1, int(max_bytes // (8 * size))))
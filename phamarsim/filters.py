@@ -0,0 +1,189 @@
+# coding:utf-8
+"""Filters for Phamarsim
+
+Filters model the frequency response of microphones. They provide the methods
+
+>>> new_state(shape)
+>>> apply(x, state=None)
+
+`apply` filters the signals `x` along the last axis. `new_state` returns
+an array holding the filter state for signals with the leading shape
+`shape`. When a state is passed to `apply`, it is updated in place, so
+consecutive blocks of a stream are filtered seamlessly.
+
+Filters assume that the signals are sampled at the sample rate they were
+designed for.
+
+"""
+from __future__ import division
+import numpy as np
+import scipy.signal
+
+import logging
+log = logging.getLogger(__name__)
+
+import caches
+
+# Filters designed from parameters, shared between all users of the same design
+_designs = caches.LRUCache(maxsize=64)
+
+def _next_power_of_two(n):
+    return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+class FIRFilter():
+    """Finite impulse response filter applied with FFT overlap-add
+
+    Parameters
+    ----------
+    taps : array-like
+        The (L,) coefficients of the filter.
+
+    Notes
+    -----
+    The spectra of the taps are cached for the recently used FFT lengths, so
+    a filter shared by many channels and blocks transforms its taps only
+    once per block length.
+
+    """
+    def __init__(self, taps):
+        self._taps = np.array(taps, dtype=float, ndmin=1)
+        self._spectra = caches.LRUCache(maxsize=8)
+
+    @classmethod
+    def from_gains(cls, freqs, gains, sample_rate, numtaps=129):
+        """Design a linear phase filter from a tabulated magnitude response.
+
+        Parameters
+        ----------
+        freqs : array-like
+            The frequencies of the gains, from 0 to `sample_rate/2` [Hz].
+        gains : array-like
+            The desired linear gains at `freqs`.
+        sample_rate : float
+            The sample rate of the filtered signals [Hz].
+        numtaps : int, optional
+            The number of filter coefficients.
+
+        Notes
+        -----
+        Designs are cached, so identical parameters return the same filter.
+
+        """
+        key = ('fir', tuple(np.ravel(freqs)), tuple(np.ravel(gains)), sample_rate, numtaps)
+        flt = _designs.get(key)
+        if flt is None:
+            taps = scipy.signal.firwin2(numtaps, np.asarray(freqs, dtype=float) / (sample_rate/2), gains)
+            flt = cls(taps)
+            _designs.put(key, flt)
+        return flt
+
+    def get_taps(self):
+        return self._taps.copy()
+
+    def _get_spectrum(self, nfft):
+        H = self._spectra.get(nfft)
+        if H is None:
+            H = np.fft.rfft(self._taps, nfft)
+            self._spectra.put(nfft, H, H.nbytes)
+        return H
+
+    def new_state(self, shape=()):
+        """Return the initial state, i.e. the tail carried over to the next block."""
+        return np.zeros(tuple(shape) + (len(self._taps) - 1,))
+
+    def apply(self, x, state=None):
+        """Filter the signals `x` along the last axis.
+
+        Parameters
+        ----------
+        x : array-like
+            The signals to be filtered.
+        state : ndarray, optional
+            The state returned by `new_state`. It is updated in place.
+
+        Returns
+        -------
+        y : ndarray
+            The filtered signals with the same shape as `x`.
+
+        """
+        x = np.asarray(x, dtype=float)
+        B = x.shape[-1]
+        L = len(self._taps)
+        nfft = _next_power_of_two(B + L - 1)
+        y = np.fft.irfft(np.fft.rfft(x, nfft) * self._get_spectrum(nfft), nfft)[...,:B+L-1]
+        if state is not None:
+            # Overlap-add the tail of the previous block and keep the new one
+            y[...,:L-1] += state
+            state[...] = y[...,B:]
+        return y[...,:B]
+
+class IIRFilter():
+    """Infinite impulse response filter made of second order sections
+
+    Parameters
+    ----------
+    sos : array-like
+        The (n_sections, 6) second order sections, see `scipy.signal.sosfilt`.
+
+    """
+    def __init__(self, sos):
+        self._sos = np.array(sos, dtype=float, ndmin=2)
+
+    @classmethod
+    def butter(cls, order, cutoff, sample_rate, btype='lowpass'):
+        """Design a Butterworth filter.
+
+        Parameters
+        ----------
+        order : int
+            The order of the filter.
+        cutoff : float or tuple
+            The cutoff frequency, or the two edges of band filters [Hz].
+        sample_rate : float
+            The sample rate of the filtered signals [Hz].
+        btype : {'lowpass', 'highpass', 'bandpass', 'bandstop'}, optional
+            The type of the filter.
+
+        Notes
+        -----
+        Designs are cached, so identical parameters return the same filter.
+
+        """
+        key = ('butter', order, tuple(np.ravel(cutoff)), sample_rate, btype)
+        flt = _designs.get(key)
+        if flt is None:
+            Wn = np.asarray(cutoff, dtype=float) / (sample_rate/2)
+            flt = cls(scipy.signal.butter(order, Wn, btype=btype, output='sos'))
+            _designs.put(key, flt)
+        return flt
+
+    def get_sos(self):
+        return self._sos.copy()
+
+    def new_state(self, shape=()):
+        """Return the initial state of the sections."""
+        return np.zeros((len(self._sos),) + tuple(shape) + (2,))
+
+    def apply(self, x, state=None):
+        """Filter the signals `x` along the last axis.
+
+        Parameters
+        ----------
+        x : array-like
+            The signals to be filtered.
+        state : ndarray, optional
+            The state returned by `new_state`. It is updated in place.
+
+        Returns
+        -------
+        y : ndarray
+            The filtered signals with the same shape as `x`.
+
+        """
+        x = np.asarray(x, dtype=float)
+        if state is None:
+            return scipy.signal.sosfilt(self._sos, x, axis=-1)
+        y, zf = scipy.signal.sosfilt(self._sos, x, axis=-1, zi=state)
+        state[...] = zf
+        return y
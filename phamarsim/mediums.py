@@ -1,10 +1,38 @@
 # coding:utf-8
-"""Mediums for Phamarsim"""
+"""Mediums for Phamarsim
+
+Mediums provide the speed of sound. Mediums that attenuate sound beyond
+the spherical expansion additionally provide the frequency and distance
+dependent attenuation
+
+>>> get_attenuation(freq, distance)
+
+and the equivalent filters for sampled signals
+
+>>> get_absorption_filter(distance, sample_rate)
+
+The filters are shared by all distances with the same index
+`get_distance_buckets(distance)` and have `get_numtaps()` coefficients.
+Environments only apply them if `has_absorption()` is true.
+
+The propagation from a source to receivers is provided by
+
+>>> get_rays(position, v)
+
+which returns the delays, the attenuations due to spreading, and the
+directions in which the sound leaves the source and arrives at the
+receivers. In homogeneous mediums, these are straight lines. Mediums with
+`has_refraction()` bend the rays.
+
+"""
 
 from __future__ import division
 import numpy as np
 import scipy as sc
 
+import caches
+import filters
+
 class SimpleMedium():
     """Base class for simple mediums.
 
@@ -19,14 +47,85 @@ class SimpleMedium():
     
     """
     def __init__(self, c=331.3):
+        self._version = 0
         self.set_speed_of_sound(c)
 
+    def _changed(self):
+        """Mark all results that depend on the medium as outdated."""
+        self._version += 1
+
+    def get_version(self):
+        """Return a counter that is increased whenever the medium changes."""
+        return self._version
+
     def set_speed_of_sound(self, c):
         self._speed_of_sound = c
+        self._changed()
     def get_speed_of_sound(self):
         """Returns the speed of sound in the medium."""
         return self._speed_of_sound
-    
+
+    def has_absorption(self):
+        """Return whether the medium absorbs sound. SimpleMediums do not."""
+        return False
+
+    def has_refraction(self):
+        """Return whether the rays are bent. SimpleMediums are homogeneous."""
+        return False
+
+    def get_rays(self, position, v):
+        """Return the propagation from a source to receivers.
+
+        Parameters
+        ----------
+        position : array-like
+            The (3,) position of the source [m].
+        v : ndarray
+            The (M,3) positions of the receivers [m].
+
+        Returns
+        -------
+        Dt : ndarray
+            The (M,) travel times [s].
+        g : ndarray
+            The (M,) attenuation factors due to the spreading of the sound [1/m].
+        emission : ndarray
+            The (M,3) unit vectors in which the rays leave the source.
+        arrival : ndarray
+            The (M,3) unit vectors in which the rays propagate at the receivers.
+
+        """
+        d = v - np.asarray(position, dtype=float)
+        r = np.sqrt(np.sum(d**2, axis=-1))
+        u = d / r[:,np.newaxis]
+        return r / self.get_speed_of_sound(), 1. / r, u, u
+
+    def get_attenuation(self, freq, distance):
+        """Return the amplitude factor due to absorption.
+
+        Parameters
+        ----------
+        freq : float or array-like
+            The frequency [Hz].
+        distance : float or array-like
+            The travelled distance [m].
+
+        Returns
+        -------
+        a : float or ndarray
+            The factor by which the amplitude is reduced, in addition to the
+            spherical expansion.
+
+        """
+        return np.ones(np.broadcast(freq, distance).shape)[()]
+
+    def get_absorption_filter(self, distance, sample_rate):
+        """Return a filter that applies the absorption to sampled signals.
+
+        Mediums without absorption return `None`.
+        """
+        return None
+
 
 class SimpleAir(SimpleMedium):
     """Creates a simple medium "dry air".
@@ -60,3 +159,451 @@ class SimpleAir(SimpleMedium):
         
         """
         self.set_speed_of_sound(331.3 * np.sqrt(1 + temp/273.15))
+
+class AbsorbingAir(SimpleAir):
+    """Creates air with frequency dependent absorption.
+
+    Parameters
+    ----------
+    temp : float, optional
+        The temperature in °C.
+    humidity : float, optional
+        The relative humidity in %.
+    pressure : float, optional
+        The atmospheric pressure in kPa.
+    bucket_width : float, optional
+        The distances are rounded to multiples of this for the absorption
+        filters [m].
+    numtaps : int, optional
+        The (odd) number of coefficients of the absorption filters.
+    filter_cache_size : int, optional
+        The number of distance buckets for which the filters are kept.
+
+    Notes
+    -----
+    The absorption coefficient follows ISO 9613-1, with the relaxation
+    frequencies of oxygen and nitrogen calculated from temperature,
+    humidity and pressure.
+
+    The absorption filters are linear phase FIR filters, which are designed
+    for the center of every distance bucket and sample rate and then cached.
+    They delay the signals by `(numtaps-1)/2` samples, which must be
+    compensated by the user.
+
+    """
+    def __init__(self, temp=20.0, humidity=50.0, pressure=101.325, bucket_width=1.0, numtaps=63, filter_cache_size=256, **kwargs):
+        if numtaps % 2 != 1:
+            raise ValueError("The number of taps must be odd.")
+        self._filters = caches.LRUCache(filter_cache_size)
+        self._humidity = humidity
+        self._pressure = pressure
+        self._bucket_width = bucket_width
+        self._numtaps = numtaps
+        SimpleAir.__init__(self, temp=temp, **kwargs)
+
+    def _changed(self):
+        SimpleAir._changed(self)
+        self._filters.clear()
+
+    def set_temperature(self, temp):
+        self._temperature = temp
+        SimpleAir.set_temperature(self, temp)
+
+    def get_temperature(self):
+        return self._temperature
+
+    def set_humidity(self, humidity):
+        """Set the relative humidity in %."""
+        self._humidity = humidity
+        self._changed()
+
+    def get_humidity(self):
+        return self._humidity
+
+    def set_pressure(self, pressure):
+        """Set the atmospheric pressure in kPa."""
+        self._pressure = pressure
+        self._changed()
+
+    def get_pressure(self):
+        return self._pressure
+
+    def get_bucket_width(self):
+        return self._bucket_width
+
+    def get_numtaps(self):
+        return self._numtaps
+
+    def has_absorption(self):
+        return True
+
+    def get_absorption_coefficient(self, freq):
+        """Return the absorption coefficient in dB/m according to ISO 9613-1.
+
+        Parameters
+        ----------
+        freq : float or array-like
+            The frequency [Hz].
+
+        """
+        f = np.asarray(freq, dtype=float)
+        T = self._temperature + 273.15
+        T0 = 293.15
+        pr = self._pressure / 101.325
+        # Molar concentration of water vapour in %
+        C = -6.8346 * (273.16 / T)**1.261 + 4.6151
+        h = self._humidity * 10.**C / pr
+        # Relaxation frequencies of oxygen and nitrogen
+        frO = pr * (24. + 4.04e4 * h * (0.02 + h) / (0.391 + h))
+        frN = pr * (T / T0)**-0.5 * (9. + 280. * h * np.exp(-4.170 * ((T / T0)**(-1./3.) - 1.)))
+        alpha = 8.686 * f**2 * ( 1.84e-11 / pr * (T / T0)**0.5
+                                 + (T / T0)**-2.5 * ( 0.01275 * np.exp(-2239.1 / T) / (frO + f**2 / frO)
+                                                    + 0.1068 * np.exp(-3352.0 / T) / (frN + f**2 / frN) ) )
+        return alpha[()]
+
+    def get_attenuation(self, freq, distance):
+        return 10.**(-self.get_absorption_coefficient(freq) * np.asarray(distance) / 20.)
+
+    def get_distance_buckets(self, distance):
+        """Return the indices of the distance buckets of the distances."""
+        return np.floor(np.asarray(distance) / self._bucket_width + 0.5).astype(int)
+
+    def get_absorption_filter(self, distance, sample_rate):
+        """Return the absorption filter for the bucket of a distance.
+
+        Parameters
+        ----------
+        distance : float
+            The travelled distance [m].
+        sample_rate : float
+            The sample rate of the filtered signals [Hz]. It is rounded to
+            nine significant digits, so rates derived from the spacing of
+            sampling times share their filter.
+
+        Returns
+        -------
+        filter : FIRFilter
+            The linear phase filter of the distance bucket.
+
+        """
+        sample_rate = float('%.9g' % sample_rate)
+        bucket = int(self.get_distance_buckets(distance))
+        key = (sample_rate, bucket)
+        flt = self._filters.get(key)
+        if flt is None:
+            freqs = np.linspace(0., sample_rate / 2., self._numtaps + 1)
+            gains = self.get_attenuation(freqs, bucket * self._bucket_width)
+            flt = filters.FIRFilter.from_gains(freqs, gains, sample_rate, self._numtaps)
+            self._filters.put(key, flt)
+        return flt
+
+def trace_rays(speed, gradient, source_height, ranges, heights, reference_speed, n_rays=361, max_angle=89., substeps=8):
+    """Trace rays through a horizontally layered medium and tabulate the results.
+
+    Parameters
+    ----------
+    speed, gradient : callable
+        Return the effective speed of sound [m/s] and its vertical gradient
+        [1/s] at an array of heights [m].
+    source_height : float
+        The height of the source [m].
+    ranges : array-like
+        The (R,) equally spaced horizontal distances of the table, starting at 0 [m].
+    heights : array-like
+        The (H,) equally spaced heights of the table [m].
+    reference_speed : float
+        The travel times are stored relative to the direct distance
+        divided by this speed [m/s].
+    n_rays : int, optional
+        The number of rays launched between `-max_angle` and `max_angle`.
+    max_angle : float, optional
+        The maximum elevation of the launched rays [deg].
+    substeps : int, optional
+        The number of integration steps between two ranges of the table.
+
+    Returns
+    -------
+    tau, amp, elev0, elev : ndarray
+        The (R,H) tables of the additional travel time [s], the attenuation factor
+        relative to `1/d` for the direct distance `d`, and the deviations of
+        the launch and arrival elevations from the direction of the straight
+        line [deg]. Points that are not reached by any ray have an
+        attenuation of 0.
+
+    Notes
+    -----
+    All rays are integrated simultaneously along the range with the
+    midpoint method, using `dz/dr = tan(e)`, `de/dr = -c'/c` and
+    `dtau/dr = 1/(c cos(e))`. Between two neighbouring rays, the table
+    values are interpolated linearly in height. The attenuation follows
+    from the widening of the ray tube, `|dz/de0|`. Where several pairs of
+    rays cover a point, the first arrival is used. The ground at the bottom
+    of the table reflects the rays rigidly; only neighbouring rays with the
+    same number of reflections are paired, unless the other one of them is
+    about to be reflected too, which closes the gap above the ground.
+
+    The travel time and the directions are stored relative to the straight
+    line from the source, so tables of homogeneous mediums contain only
+    constant values and the interpolation is accurate close to the source.
+
+    """
+    ranges = np.asarray(ranges, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    c0 = reference_speed
+    e0 = np.linspace(-max_angle, max_angle, n_rays) * np.pi / 180.
+
+    dz = heights - source_height
+    d = np.sqrt(ranges[:,np.newaxis]**2 + dz**2)
+    line = np.arctan2(dz, ranges[:,np.newaxis])
+    tau = np.zeros(d.shape)
+    amp = np.zeros(d.shape)
+    elev0 = np.zeros(d.shape)
+    elev = np.zeros(d.shape)
+
+    # Vertical rays at range 0
+    amp[0] = 1.
+    z = np.linspace(source_height, heights, 65)
+    tau[0] = np.trapz(1. / speed(z.ravel()).reshape(z.shape), z, axis=0) * np.sign(dz) - np.abs(dz) / c0
+
+    def derivatives(z, e):
+        c = speed(z)
+        return np.tan(e), -gradient(z) / c, 1. / (c * np.cos(e))
+
+    # Rays are followed beyond the top of the table, so that pairs of rays
+    # still bracket the heights close to it
+    high = 2*heights[-1] - heights[0]
+    z = np.full(n_rays, float(source_height))
+    e = e0.copy()
+    t = np.zeros(n_rays)
+    alive = np.ones(n_rays, dtype=bool)
+    bounces = np.zeros(n_rays, dtype=int)
+    h = (ranges[1] - ranges[0]) / substeps
+    for j in range(1, len(ranges)):
+        for k in range(substeps):
+            dz1, de1, dt1 = derivatives(z, e)
+            dz2, de2, dt2 = derivatives(z + .5*h*dz1, e + .5*h*de1)
+            z, e, t = z + h*dz2, e + h*de2, t + h*dt2
+            # Reflection at the ground
+            ground = z < heights[0]
+            z[ground] = 2*heights[0] - z[ground]
+            e[ground] = -e[ground]
+            bounces[ground] += 1
+            alive &= (z <= high) & (np.abs(e) < np.pi/2)
+
+        # Pairs of neighbouring rays. If one of them has been reflected once
+        # more while the other one is still descending towards the ground,
+        # the reflected one is mirrored back, so the pair covers the heights
+        # just above the ground. Otherwise the gap between them is a shadow.
+        za, zb = z[:-1].copy(), z[1:].copy()
+        mirror = 2*heights[0]
+        first = (bounces[:-1] == bounces[1:] + 1) & (e[1:] < 0)
+        second = (bounces[1:] == bounces[:-1] + 1) & (e[:-1] < 0)
+        ea, eb = e[:-1].copy(), e[1:].copy()
+        za[first], ea[first] = mirror - za[first], -ea[first]
+        zb[second], eb[second] = mirror - zb[second], -eb[second]
+        pair = alive[:-1] & alive[1:] & ((bounces[:-1] == bounces[1:]) | first | second)
+        # Interpolation weights of the table heights, (P,H)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = (heights - za[:,np.newaxis]) / (zb - za)[:,np.newaxis]
+        inside = pair[:,np.newaxis] & (w >= 0) & (w <= 1)
+        if not np.any(inside):
+            continue
+        ti = t[:-1,np.newaxis] + w * (t[1:] - t[:-1])[:,np.newaxis]
+        ti[~inside] = np.inf
+        best = np.argmin(ti, axis=0)
+        cols = np.flatnonzero(np.any(inside, axis=0))
+        p = best[cols]
+        wc = w[p, cols]
+        ei = ea[p] + wc * (eb[p] - ea[p])
+        e0i = e0[p] + wc * (e0[p+1] - e0[p])
+        spread = np.abs((zb[p] - za[p]) / (e0[p+1] - e0[p]))
+        g = np.sqrt(np.cos(e0i) / (ranges[j] * spread * np.cos(ei)))
+        tau[j,cols] = ti[p, cols] - d[j,cols] / c0
+        amp[j,cols] = g * d[j,cols]
+        elev0[j,cols] = (e0i - line[j,cols]) * 180. / np.pi
+        elev[j,cols] = (ei - line[j,cols]) * 180. / np.pi
+
+    return tau, amp, elev0, elev
+
+class LayeredAir(SimpleMedium):
+    """Creates air with vertical temperature and wind profiles.
+
+    Parameters
+    ----------
+    heights : array-like, optional
+        The (K,) heights at which the profiles are given [m]. The profiles are
+        linear in between and constant beyond.
+    temps : array-like, optional
+        The (K,) temperatures in °C.
+    wind_speeds : array-like, optional
+        The (K,) horizontal wind speeds [m/s].
+    wind_direction : float, optional
+        The azimuth into which the wind blows, measured from the x-axis [deg].
+    max_range, max_height : float, optional
+        The extent of the ray tables [m]. The ground is at height 0.
+    n_range, n_height : int, optional
+        The number of grid points of the ray tables in range and height.
+    n_rays : int, optional
+        The number of traced rays per table.
+    azimuth_resolution : float, optional
+        The width of the azimuth buckets for which separate tables are traced
+        if there is wind [deg].
+    height_resolution : float, optional
+        The source heights are rounded to multiples of this for the tables [m].
+    table_cache_size : int, optional
+        The number of ray tables that are kept.
+
+    Notes
+    -----
+    The wind is included with the effective speed of sound
+    `c(z) + u(z) cos(azimuth - wind_direction)`. The ray tables are traced
+    with `trace_rays` once per source height and azimuth bucket, and then
+    interpolated bilinearly for every source-receiver pair. Reflections at
+    the ground are only used where no direct ray arrives, see `trace_rays`.
+    The change of the impedance with height is neglected.
+    `get_speed_of_sound` returns the speed of sound at the ground.
+
+    """
+    def __init__(self, heights=(0., 100.), temps=(20., 20.), wind_speeds=(0., 0.), wind_direction=0.,
+                 max_range=1000., max_height=200., n_range=201, n_height=101, n_rays=361,
+                 azimuth_resolution=5., height_resolution=1., table_cache_size=64):
+        self._tables = caches.LRUCache(table_cache_size)
+        self._ranges = np.linspace(0., max_range, n_range)
+        self._heights = np.linspace(0., max_height, n_height)
+        self._n_rays = n_rays
+        self._azimuth_resolution = azimuth_resolution
+        self._height_resolution = height_resolution
+        self._wind_direction = wind_direction
+        SimpleMedium.__init__(self)
+        self.set_profiles(heights, temps, wind_speeds)
+
+    def _changed(self):
+        SimpleMedium._changed(self)
+        self._tables.clear()
+
+    def set_profiles(self, heights, temps, wind_speeds=0.):
+        """Set the temperature and wind profiles.
+
+        Parameters
+        ----------
+        heights : array-like
+            The (K,) increasing heights of the profile points [m].
+        temps : array-like
+            The (K,) temperatures in °C.
+        wind_speeds : array-like, optional
+            The (K,) horizontal wind speeds [m/s].
+
+        """
+        heights = np.array(heights, dtype=float, ndmin=1)
+        if np.any(np.diff(heights) <= 0):
+            raise ValueError("The heights must be increasing.")
+        self._profile_heights = heights
+        self._temps = np.array(np.broadcast_to(np.asarray(temps, dtype=float), heights.shape))
+        self._wind_speeds = np.array(np.broadcast_to(np.asarray(wind_speeds, dtype=float), heights.shape))
+        self.set_speed_of_sound(self.get_speed_of_sound_at(0.))
+
+    def get_profiles(self):
+        """Return the heights, temperatures and wind speeds of the profiles."""
+        return self._profile_heights.copy(), self._temps.copy(), self._wind_speeds.copy()
+
+    def set_wind_direction(self, wind_direction):
+        self._wind_direction = wind_direction
+        self._changed()
+
+    def get_wind_direction(self):
+        return self._wind_direction
+
+    def has_refraction(self):
+        return True
+
+    def get_speed_of_sound_at(self, z):
+        """Return the speed of sound without wind at the heights `z` [m/s]."""
+        temp = np.interp(z, self._profile_heights, self._temps)
+        return 331.3 * np.sqrt(1 + temp/273.15)
+
+    def get_effective_speed_of_sound(self, z, azimuth):
+        """Return the effective speed of sound for sound travelling in direction `azimuth` [m/s]."""
+        u = np.interp(z, self._profile_heights, self._wind_speeds)
+        return self.get_speed_of_sound_at(z) + u * np.cos((azimuth - self._wind_direction) * np.pi / 180.)
+
+    def _get_azimuth_buckets(self, azimuth):
+        if not np.any(self._wind_speeds):
+            return np.zeros(np.shape(azimuth), dtype=int)
+        n = int(round(360. / self._azimuth_resolution))
+        return np.floor(np.asarray(azimuth) / 360. * n + 0.5).astype(int) % n
+
+    def get_ray_table(self, source_height, azimuth=0.):
+        """Return the ray table for a source height and azimuth.
+
+        Returns
+        -------
+        tau, amp, elev0, elev : ndarray
+            The (R,H) tables, see `trace_rays`.
+
+        Notes
+        -----
+        The tables are cached per bucket of source height and azimuth.
+
+        """
+        hb = int(np.floor(source_height / self._height_resolution + 0.5))
+        ab = int(self._get_azimuth_buckets(azimuth))
+        key = (hb, ab)
+        table = self._tables.get(key)
+        if table is None:
+            h = hb * self._height_resolution
+            if not self._heights[0] <= h <= self._heights[-1]:
+                raise ValueError("The source is outside of the height range of the ray tables.")
+            a = ab * self._azimuth_resolution
+            # Effective speed of sound and its piecewise constant gradient
+            zp = self._profile_heights
+            cp = self.get_effective_speed_of_sound(zp, a)
+            slopes = np.append(np.append(0., np.diff(cp) / np.diff(zp)), 0.)
+            speed = lambda z: np.interp(z, zp, cp)
+            gradient = lambda z: slopes[np.searchsorted(zp, z)]
+            table = trace_rays(speed, gradient, h, self._ranges, self._heights, self.get_speed_of_sound(), self._n_rays)
+            for t in table:
+                t.setflags(write=False)
+            self._tables.put(key, table)
+        return table
+
+    def get_rays(self, position, v):
+        """Return the propagation from a source to receivers.
+
+        See `SimpleMedium.get_rays`. The rays are interpolated from the ray
+        tables of the source. Receivers in a shadow zone get an attenuation
+        of 0 and the travel time of the straight line.
+
+        """
+        position = np.asarray(position, dtype=float)
+        d = v - position
+        r = np.sqrt(d[:,0]**2 + d[:,1]**2)
+        dist = np.sqrt(r**2 + d[:,2]**2)
+        azimuth = np.arctan2(d[:,1], d[:,0]) * 180. / np.pi
+        line = np.arctan2(d[:,2], r) * 180. / np.pi
+        if np.any(r > self._ranges[-1]) or np.any(v[:,2] < self._heights[0]) or np.any(v[:,2] > self._heights[-1]):
+            raise ValueError("The receivers are outside of the ray tables.")
+
+        # Bilinear interpolation weights
+        fr = r / (self._ranges[1] - self._ranges[0])
+        fh = (v[:,2] - self._heights[0]) / (self._heights[1] - self._heights[0])
+        i = np.minimum(fr.astype(int), len(self._ranges) - 2)
+        k = np.minimum(fh.astype(int), len(self._heights) - 2)
+        wr, wh = fr - i, fh - k
+        weights = ((1-wr)*(1-wh), (1-wr)*wh, wr*(1-wh), wr*wh)
+        corners = ((i, k), (i, k+1), (i+1, k), (i+1, k+1))
+
+        tau, amp, elev0, elev = [np.zeros(len(v)) for n in range(4)]
+        buckets = self._get_azimuth_buckets(azimuth)
+        for b in np.unique(buckets):
+            select = buckets == b
+            tables = self.get_ray_table(position[2], azimuth[select][0])
+            for out, table in zip((tau, amp, elev0, elev), tables):
+                out[select] = sum(w[select] * table[ii[select], kk[select]] for w, (ii, kk) in zip(weights, corners))
+
+        Dt = tau + dist / self.get_speed_of_sound()
+        e0 = (line + elev0) * np.pi / 180.
+        e1 = (line + elev) * np.pi / 180.
+        a = azimuth * np.pi / 180.
+        emission = np.stack((np.cos(e0)*np.cos(a), np.cos(e0)*np.sin(a), np.sin(e0)), axis=-1)
+        arrival = np.stack((np.cos(e1)*np.cos(a), np.cos(e1)*np.sin(a), np.sin(e1)), axis=-1)
+        return Dt, amp / dist, emission, arrival
@@ -8,6 +8,9 @@ They must provide a method
 >>> get_voltage_signal(t),
 
 which produces an ndarray of the voltages at the specified times.
+Subclasses of `Microphone` implement `_get_voltage_signal(t)` instead, so
+the base class can apply the frequency response of the microphone (see
+`Microphone.set_frequency_response`).
 
 """
 
@@ -18,6 +21,10 @@ import logging
 log = logging.getLogger(__name__)
 
 import objects
+import environments
+import directivities
+import filters
+import caches
 
 class Microphone(objects.SimpleObject):
     """Base class for microphones
@@ -31,24 +38,43 @@ class Microphone(objects.SimpleObject):
         This is only a general amplification factor and can be modulated by
         the microphones spatial or temporal characterisitcs.
         Unit: V/mPa
+    response : filter, optional
+        The frequency response of the microphone, e.g. a `filters.FIRFilter`
+        or `filters.IIRFilter`. Defaults to `None`, i.e. a flat response.
+    noise_level : float, optional
+        The RMS voltage of the white self-noise of every channel [V].
+        Defaults to 0, i.e. no self-noise. See `set_self_noise`.
+    noise_seed : int, optional
+        The seed of the self-noise.
+    noise_sample_rate : float, optional
+        The sample rate of the self-noise [Hz]. Defaults to the sample rate
+        of the digitizer, or to the spacing of the requested times.
     kwargs : dictionary
         Will be passed to the `SimpleObject` constructor.
     
     """
-    def __init__(self, digitizer=None, amplification=1.0, **kwargs):
+    def __init__(self, digitizer=None, amplification=1.0, response=None,
+                 noise_level=0.0, noise_seed=0, noise_sample_rate=None, **kwargs):
         objects.SimpleObject.__init__(self, **kwargs)
         self._digitizer = None
         self._amplification = amplification
+        self._response = response
+        self._noise_blocks = caches.LRUCache(maxsize=None, max_bytes=8*2**20)
+        self.set_self_noise(noise_level, noise_seed, noise_sample_rate)
         if digitizer is not None:
             self.connect_to_digitizer(digitizer)
     
-    def get_voltage_signal(self, t):
+    def get_voltage_signal(self, t, state=None):
         """Return the voltage signal at the specified times.
         
         Parameters
         ----------
         t : array-like
             Times at which the signal signal should be evaluated [s].
+        state : ndarray, optional
+            The filter state returned by `new_filter_state`. It carries the
+            state of the frequency response over consecutive blocks and is
+            updated in place. Without it, the filter starts from rest.
 
         Returns
         -------
@@ -57,12 +83,164 @@ class Microphone(objects.SimpleObject):
 
         Notes
         -----
+        The frequency response is applied along the last axis of `t`, which
+        must be sampled at the sample rate the filter was designed for.
+
+        """
+        U = self._get_voltage_signal(t)
+        if self._response is not None:
+            U = self._response.apply(U, state)
+        return U
+
+    def _get_voltage_signal(self, t):
+        """Return the unfiltered voltage signal.
+
         This simple microphone is isotropic with the same gain in all directions.
-        
+
         """
         x,y,z = self.get_position()
-        return self.get_environment().get_pressure_signal(t, x,y,z) * self.get_amplification()
+        U = self.get_environment().get_pressure_signal(t, x,y,z) * self.get_amplification()
+        return self._add_self_noise(t, U)
+
+    def set_self_noise(self, level, seed=0, sample_rate=None):
+        """Set the self-noise of the microphone.
+
+        Parameters
+        ----------
+        level : float
+            The RMS voltage of the white noise of every channel [V].
+        seed : int, optional
+            The seed of the noise.
+        sample_rate : float, optional
+            The sample rate of the noise [Hz]. Defaults to the sample rate of
+            the connected digitizer. Without digitizer, the spacing of the
+            requested times is used, which then must be uniformly sampled.
+
+        Notes
+        -----
+        Every channel is divided into blocks of `noise_block_size` samples,
+        counted from time 0. Each block is drawn from its own random state,
+        seeded with the seed, the channel and the block index. So the noise
+        at a certain time is always the same, no matter how the signal is
+        split into blocks, and different channels are uncorrelated.
+
+        """
+        self._noise_level = level
+        self._noise_seed = seed
+        self._noise_sample_rate = sample_rate
+        self._noise_blocks.clear()
+
+    def get_self_noise(self):
+        """Return the level, seed and sample rate of the self-noise."""
+        return self._noise_level, self._noise_seed, self._noise_sample_rate
+
+    noise_block_size = 4096
+
+    def _get_noise_block(self, channel, b):
+        """Return the unscaled noise samples of block `b` of a channel."""
+        key = (channel, b)
+        block = self._noise_blocks.get(key)
+        if block is None:
+            b = int(b)
+            rng = np.random.RandomState([self._noise_seed & 0xffffffff, channel & 0xffffffff,
+                                         b & 0xffffffff, (b >> 32) & 0xffffffff])
+            block = rng.standard_normal(self.noise_block_size)
+            self._noise_blocks.put(key, block, block.nbytes)
+        return block
+
+    def get_self_noise_signal(self, t):
+        """Return the self-noise at the specified times.
+
+        Parameters
+        ----------
+        t : array-like
+            The (T,) times, or times with individual rows per channel [s].
+
+        Returns
+        -------
+        U : ndarray
+            The noise voltages with the channel shape followed by (T,) [V].
+
+        """
+        t = np.asarray(t, dtype=float)
+        shape = self.get_channel_shape() + t.shape[-1:]
+        if self._noise_level == 0:
+            return np.zeros(shape)
+        sample_rate = self._noise_sample_rate
+        if sample_rate is None and self._digitizer is not None:
+            sample_rate = self._digitizer.get_sample_rate()
+        if sample_rate is None:
+            if t.shape[-1] < 2:
+                raise ValueError("The noise sample rate is needed for single samples.")
+            sample_rate = 1. / np.mean(np.diff(t, axis=-1))
+        n = np.broadcast_to(np.rint(t * sample_rate).astype(np.int64), shape).reshape((-1,) + t.shape[-1:])
+        B = self.noise_block_size
+        noise = np.empty(n.shape)
+        for c, nc in enumerate(n):
+            first, last = nc.min() // B, nc.max() // B
+            chunk = np.concatenate([self._get_noise_block(c, b) for b in range(first, last + 1)])
+            noise[c] = chunk[nc - first*B]
+        return noise.reshape(shape) * self._noise_level
+
+    def _add_self_noise(self, t, U):
+        """Add the self-noise to the unfiltered voltages `U`."""
+        if self._noise_level == 0:
+            return U
+        return U + self.get_self_noise_signal(t)
     
+    def iter_voltage_blocks(self, sample_rate, block_size, n_samples=None, start=0.):
+        """Generate the voltage signal block by block.
+
+        Parameters
+        ----------
+        sample_rate : float
+            The sample rate [Hz].
+        block_size : int
+            The number of samples per block.
+        n_samples : int, optional
+            The total number of samples. If `None`, blocks are generated
+            indefinitely.
+        start : float, optional
+            The time of the first sample [s].
+
+        Yields
+        ------
+        t : ndarray
+            The sampling times of the block [s].
+        U : ndarray
+            The voltage signal of the block [V].
+
+        """
+        state = self.new_filter_state()
+        for t in environments.iter_time_blocks(sample_rate, block_size, n_samples, start):
+            yield t, self.get_voltage_signal(t, state)
+
+    def set_frequency_response(self, response):
+        """Set the frequency response filter of the microphone.
+
+        The same filter object can be shared by many microphones. Designs
+        and FFTs of the filter are then only calculated once.
+
+        """
+        self._response = response
+
+    def get_frequency_response(self):
+        return self._response
+
+    def get_channel_shape(self):
+        """Return the shape of the voltage signal without the time axis."""
+        return ()
+
+    def new_filter_state(self):
+        """Return a fresh state of the frequency response for streaming.
+
+        Returns `None` if the microphone has a flat response.
+
+        """
+        if self._response is None:
+            return None
+        return self._response.new_state(self.get_channel_shape())
+
     def set_amplification(self, amplification):
         self._amplification = amplification
 
@@ -125,3 +303,242 @@ class Microphone(objects.SimpleObject):
 
     def get_digitizer(self):
         return self._digitizer
+
+def get_arrival_directions(theta, phi, Minv):
+    """Return the directions incoming waves arrive from in local coordinates.
+
+    Parameters
+    ----------
+    theta : array-like
+        The polar angles of the propagation directions of the waves in
+        global coordinates [deg].
+    phi : array-like
+        The azimuthal angles of the propagation directions of the waves in
+        global coordinates [deg].
+    Minv : ndarray
+        The (3,3) or (...,3,3) matrices rotating global into local
+        coordinates. They are broadcast against the directions.
+
+    Returns
+    -------
+    theta, phi : ndarray
+        The polar and azimuthal angles the waves arrive from in local
+        coordinates [deg].
+
+    """
+    # Waves arrive from the direction opposite to their propagation
+    v = -objects.spherical_to_cartesian(theta, phi)
+    v = np.matmul(Minv, v[...,np.newaxis])[...,0]
+    theta, phi, r = objects.cartesian_to_spherical(v)
+    return theta, phi
+
+class DirectionalMicrophone(Microphone):
+    """Microphone with a direction dependent gain
+
+    Parameters
+    ----------
+    directivity : Directivity, optional
+        The gain pattern of the microphone relative to its orientation.
+        Defaults to `directivities.cardioid()`.
+    kwargs : dictionary
+        Will be passed to the `Microphone` constructor.
+
+    Notes
+    -----
+    Every incoming wave is weighted by the gain for its arrival direction.
+    The directions and gains of all waves are calculated at once.
+
+    """
+    def __init__(self, directivity=None, **kwargs):
+        Microphone.__init__(self, **kwargs)
+        if directivity is None:
+            directivity = directivities.cardioid()
+        self.set_directivity(directivity)
+
+    def set_directivity(self, directivity):
+        self._directivity = directivity
+
+    def get_directivity(self):
+        return self._directivity
+
+    def _get_voltage_signal(self, t):
+        """Return the unfiltered voltage signal."""
+        t = np.asarray(t, dtype=float)
+        waves = self.get_environment().get_plane_waves(t, self.get_position())
+        if len(waves) == 0:
+            return self._add_self_noise(t, np.zeros(t.shape))
+        theta = np.array([w[1] for w in waves])
+        phi = np.array([w[2] for w in waves])
+        p = np.array([w[3] for w in waves])
+        # Gains for all waves at once
+        gains = self.get_directivity().get_gain(*get_arrival_directions(theta, phi, self._inverse_rotation))
+        return self._add_self_noise(t, np.dot(gains, p) * self.get_amplification())
+
+class MicrophoneArray(Microphone):
+    """Array of microphones that are evaluated together
+
+    The positions, orientations and gains of all elements are stored as
+    contiguous arrays, and the voltage signals of all elements are calculated
+    with a single call to the environment.
+
+    Parameters
+    ----------
+    positions : array-like, optional
+        The (N,3) positions of the elements in the array's local coordinates [m].
+        Defaults to a single element at the origin.
+    orientations : array-like, optional
+        The (N,3) orientations `theta, phi, alpha` of the elements relative to
+        the array [deg]. Defaults to the orientation of the array.
+    gains : array-like, optional
+        The (N,) gains of the elements. They are applied on top of the general
+        amplification of the array. Defaults to 1.
+    directivity : Directivity, optional
+        The gain pattern shared by all elements, relative to their
+        orientations. Defaults to `None`, i.e. isotropic elements.
+    kwargs : dictionary
+        Will be passed to the `Microphone` constructor.
+
+    Notes
+    -----
+    The array object itself is placed in the environment, the elements are
+    not. Moving or rotating the array moves all of its elements.
+
+    Isotropic arrays only need the summed pressure signals at the elements.
+    Directional arrays weight every incoming wave by the gain for its arrival
+    direction. The directions and gains of all waves at all elements are
+    calculated at once.
+
+    """
+    def __init__(self, positions=None, orientations=None, gains=None, directivity=None, **kwargs):
+        Microphone.__init__(self, **kwargs)
+        if positions is None:
+            positions = np.zeros((1,3))
+        self.set_elements(positions, orientations, gains)
+        self.set_directivity(directivity)
+
+    def set_directivity(self, directivity):
+        self._directivity = directivity
+
+    def get_directivity(self):
+        return self._directivity
+
+    def set_elements(self, positions, orientations=None, gains=None):
+        """Set the elements of the array.
+
+        Parameters
+        ----------
+        positions : array-like
+            The (N,3) positions of the elements in the array's local coordinates [m].
+        orientations : array-like, optional
+            The (N,3) orientations `theta, phi, alpha` of the elements
+            relative to the array [deg]. Defaults to 0.
+        gains : array-like, optional
+            The (N,) gains of the elements. Defaults to 1.
+
+        """
+        positions = np.array(positions, dtype=float, ndmin=2)
+        if positions.ndim != 2 or positions.shape[1] != 3:
+            raise ValueError("The element positions must have the shape (N,3).")
+        n = len(positions)
+        if orientations is None:
+            orientations = np.zeros((n,3))
+        if gains is None:
+            gains = np.ones(n)
+        orientations = np.ascontiguousarray(np.broadcast_to(orientations, (n,3)), dtype=float)
+        gains = np.ascontiguousarray(np.broadcast_to(gains, (n,)), dtype=float)
+
+        self._element_positions = np.ascontiguousarray(positions)
+        self._element_orientations = orientations
+        self._element_gains = gains
+        self._global_positions = None
+        self._element_rotations = None
+
+    def set_element_gains(self, gains):
+        """Set the gains of the elements."""
+        self._element_gains = np.ascontiguousarray(np.broadcast_to(gains, (len(self),)), dtype=float)
+
+    def get_element_gains(self):
+        """Return the (N,) gains of the elements."""
+        return self._element_gains.copy()
+
+    def get_element_orientations(self):
+        """Return the (N,3) orientations of the elements relative to the array [deg]."""
+        return self._element_orientations.copy()
+
+    def get_local_element_positions(self):
+        """Return the (N,3) positions of the elements in the array's local coordinates [m]."""
+        return self._element_positions.copy()
+
+    def _get_element_positions(self):
+        """Return the read-only positions cached for the current pose."""
+        version = self.get_pose_version()
+        if self._global_positions is None or self._global_positions[0] != version:
+            positions = np.array(self.local_to_global_position(self._element_positions))
+            # Frozen, so environments can recognize them cheaply, see `caches.array_key`
+            positions.setflags(write=False)
+            self._global_positions = (version, positions)
+        return self._global_positions[1]
+
+    def get_element_positions(self):
+        """Return the (N,3) positions of the elements in global coordinates [m]."""
+        return self._get_element_positions().copy()
+
+    def get_element_inverse_rotation_matrices(self):
+        """Return the (N,3,3) matrices rotating global into the elements' local coordinates."""
+        version = self.get_pose_version()
+        if self._element_rotations is None or self._element_rotations[0] != version:
+            M, Minv = objects.rotation_matrices(*self._element_orientations.T)
+            self._element_rotations = (version, np.matmul(Minv, self._inverse_rotation))
+        return self._element_rotations[1].copy()
+
+    def __len__(self):
+        return len(self._element_positions)
+
+    def get_channel_shape(self):
+        """Return the shape of the voltage signals without the time axis."""
+        return (len(self),)
+
+    def get_voltage_signal(self, t, state=None):
+        """Return the voltage signals of all elements at the specified times.
+
+        Parameters
+        ----------
+        t : array-like
+            Times at which the signals should be evaluated [s].
+            Either of shape (T,) for all elements or of shape (N,T) with
+            individual times for every element.
+        state : ndarray, optional
+            The filter state returned by `new_filter_state`.
+            See `Microphone.get_voltage_signal`.
+
+        Returns
+        -------
+        U : ndarray
+            The voltage signals as (N,T) array [V].
+
+        Notes
+        -----
+        The frequency response is shared by all elements and applied to all
+        channels at once.
+
+        """
+        return Microphone.get_voltage_signal(self, t, state)
+
+    def _get_voltage_signal(self, t):
+        """Return the unfiltered voltage signals of all elements."""
+        if self._directivity is None:
+            p = self.get_environment().get_pressure_signals(t, self._get_element_positions())
+        else:
+            t = np.asarray(t, dtype=float)
+            waves = self.get_environment().get_plane_waves(t, self._get_element_positions())
+            if len(waves) == 0:
+                return self._add_self_noise(t, np.zeros((len(self),) + t.shape[-1:]))
+            theta = np.array([w[1] for w in waves])
+            phi = np.array([w[2] for w in waves])
+            p = np.array([w[3] for w in waves])
+            # Gains for all waves and elements at once
+            Minv = self.get_element_inverse_rotation_matrices()
+            gains = self._directivity.get_gain(*get_arrival_directions(theta, phi, Minv))
+            p = np.einsum('wn,wnt->nt', gains, p)
+        p *= (self._element_gains * self.get_amplification())[:,np.newaxis]
+        return self._add_self_noise(t, p)
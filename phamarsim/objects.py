@@ -9,34 +9,183 @@ import warnings
 import logging
 log = logging.getLogger(__name__)
 
-def cartesian_to_spherical(x, y, z):
+def _as_points(x, y=None, z=None):
+    """Bring coordinates into the shape (N,3).
+
+    Either `x` is an array-like of shape (...,3) and `y` and `z` are `None`,
+    or `x, y, z` are broadcastable array-likes.
+
+    Returns
+    -------
+    v : ndarray
+        The coordinates as (N,3) array.
+    shape : tuple
+        The shape of the input points, i.e. without the coordinate axis.
+    stacked : bool
+        Whether the points were passed as single (...,3) array.
+
+    """
+    if y is None and z is None:
+        v = np.asarray(x, dtype=float)
+        if v.shape[-1:] != (3,):
+            raise ValueError("Stacked coordinates must have the shape (...,3).")
+        return v.reshape(-1,3), v.shape[:-1], True
+
+    x, y, z = np.broadcast_arrays(x, y, z)
+    shape = x.shape
+    v = np.empty(x.shape + (3,), dtype=float)
+    v[...,0] = x
+    v[...,1] = y
+    v[...,2] = z
+    return v.reshape(-1,3), shape, False
+
+def _from_points(v, shape, stacked):
+    """Reverse `_as_points`.
+
+    Stacked input yields a (...,3) array, everything else a (3,...) array,
+    which can be unpacked into `x, y, z`.
+
+    """
+    if stacked:
+        return v.reshape(shape + (3,))
+    return v.T.reshape((3,) + shape)
+
+def _rotate(M, v):
+    """Apply the rotation matrix `M` to the (N,3) points `v`.
+
+    The product is written out element-wise, so every point is transformed
+    with exactly the same floating point operations, regardless of the number
+    of points.
+
+    """
+    return v[:,0:1] * M[:,0] + v[:,1:2] * M[:,1] + v[:,2:3] * M[:,2]
+
+def cartesian_to_spherical(x, y=None, z=None):
     """Convert a set of cartesian coordinates to spherical ones.
     
     Parameters
     ----------
-    x : float
+    x : float or array-like
         The x-position [m].
-    y : float
+        If `y` and `z` are not provided, `x` is interpreted as an array of
+        shape (...,3) containing the stacked x, y and z coordinates.
+    y : float or array-like, optional
         The y-position [m].
-    z : float
+    z : float or array-like, optional
         The z-position [m].
 
     Returns
     -------
-    theta : float
+    theta : float or ndarray
         The polar angle as measured from the z-axis [deg].
-    phi : float
+    phi : float or ndarray
         The azimuthal angle as measured from the x-axis [deg].
-    r : float
+    r : float or ndarray
         The distance of the coordinates from the center of the coordinate system [m].
 
     """
+    if y is None and z is None:
+        v = np.asarray(x, dtype=float)
+        x, y, z = v[...,0], v[...,1], v[...,2]
+
     r = np.sqrt( x**2 + y**2 + z**2 )
     theta = np.arccos(z/r) * 180. / np.pi
     phi = np.arctan2(y, x) * 180. / np.pi
 
     return theta, phi, r
 
+def spherical_to_cartesian(theta, phi, r=1.):
+    """Convert a set of spherical coordinates to stacked cartesian ones.
+
+    Parameters
+    ----------
+    theta : float or array-like
+        The polar angle as measured from the z-axis [deg].
+    phi : float or array-like
+        The azimuthal angle as measured from the x-axis [deg].
+    r : float or array-like, optional
+        The distance from the center of the coordinate system [m].
+
+    Returns
+    -------
+    v : ndarray
+        The cartesian coordinates as array of shape (...,3) [m].
+
+    """
+    theta, phi, r = np.broadcast_arrays(np.pi * np.asarray(theta) / 180., np.pi * np.asarray(phi) / 180., r)
+    st = np.sin(theta)
+    return np.stack((r * st * np.cos(phi), r * st * np.sin(phi), r * np.cos(theta)), axis=-1)
+
+def rotation_matrices(theta, phi, alpha):
+    """Return the rotation matrices for the given orientations.
+
+    Parameters
+    ----------
+    theta : float or array-like
+        The polar angle as measured from the z-axis [deg].
+    phi : float or array-like
+        The azimuthal angle as measured from the x-axis [deg].
+    alpha : float or array-like
+        The rotation around the local z-axis [deg].
+
+    Returns
+    -------
+    M : ndarray
+        The matrices of shape (...,3,3) that rotate local into global coordinates.
+    Minv : ndarray
+        The inverse matrices of shape (...,3,3) that rotate global into local coordinates.
+
+    Notes
+    -----
+    The rotation is a rotation around the z-axis by alpha, followed by a
+    rotation around the y-axis by theta and a rotation around the z-axis by
+    phi.
+
+    """
+    theta, phi, alpha = np.broadcast_arrays(theta, phi, alpha)
+
+    # Shortcuts for sine and cosine of the angles:
+    st = np.sin(np.pi * theta/180)
+    ct = np.cos(np.pi * theta/180)
+    sp = np.sin(np.pi * phi/180)
+    cp = np.cos(np.pi * phi/180)
+    sa = np.sin(np.pi * alpha/180)
+    ca = np.cos(np.pi * alpha/180)
+    one = np.ones_like(st)
+    zero = np.zeros_like(st)
+
+    def matrix(rows):
+        return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
+
+    # The rotation matrices:
+    # Rotation around the z-axis by alpha
+    M1 = matrix([[  ca,  -sa, zero],
+                 [  sa,   ca, zero],
+                 [zero, zero,  one]])
+    # Rotation around the y-axis by theta
+    M2 = matrix([[  ct, zero,   st],
+                 [zero,  one, zero],
+                 [ -st, zero,   ct]])
+    # Rotation around the z-axis by phi
+    M3 = matrix([[  cp,  -sp, zero],
+                 [  sp,   cp, zero],
+                 [zero, zero,  one]])
+    M = np.matmul(np.matmul(M3, M2), M1)
+
+    # The inverse rotation matrices:
+    M1 = matrix([[  ca,   sa, zero],
+                 [ -sa,   ca, zero],
+                 [zero, zero,  one]])
+    M2 = matrix([[  ct, zero,  -st],
+                 [zero,  one, zero],
+                 [  st, zero,   ct]])
+    M3 = matrix([[  cp,   sp, zero],
+                 [ -sp,   cp, zero],
+                 [zero, zero,  one]])
+    Minv = np.matmul(np.matmul(M1, M2), M3)
+
+    return M, Minv
+
 class SimpleObject():
     """Simple point-like objects with a position and orientation in an environment
 
@@ -65,6 +214,9 @@ class SimpleObject():
         self._theta = 0.
         self._phi = 0.
         self._alpha = 0.
+        self._pose_version = 0
+        self._update_position()
+        self._update_rotation()
         self.set_position(x,y,z)
         self.set_orientation(theta,phi,alpha)
         self._environment = None
@@ -84,12 +236,15 @@ class SimpleObject():
             The new z-position of the object [m].
 
         """
+        old = (self._x, self._y, self._z)
         if x is not None:
             self._x = x
         if y is not None:
             self._y = y
         if z is not None:
             self._z = z
+        if (self._x, self._y, self._z) != old:
+            self._update_position()
 
     def set_orientation(self, theta=None, phi=None, alpha=None):
         """Set the orientation of the object.
@@ -104,13 +259,43 @@ class SimpleObject():
             The objects rotation around its own z-axis.
 
         """
+        old = (self._theta, self._phi, self._alpha)
         if theta is not None:
             self._theta = theta
         if phi is not None:
             self._phi = phi
         if alpha is not None:
             self._alpha = alpha
-        
+        if (self._theta, self._phi, self._alpha) != old:
+            self._update_rotation()
+
+    def _update_position(self):
+        """Rebuild the cached position vector after the position changed."""
+        self._position = np.array( (self._x, self._y, self._z), dtype=float )
+        self._pose_version += 1
+
+    def _update_rotation(self):
+        """Rebuild the cached rotation matrices after the orientation changed."""
+        self._rotation, self._inverse_rotation = rotation_matrices(self._theta, self._phi, self._alpha)
+        self._pose_version += 1
+
+    def get_pose_version(self):
+        """Return a counter that is increased whenever the pose of the object changes.
+
+        Caches that depend on the position or orientation of the object can
+        store this number and compare it later to notice geometry changes.
+
+        """
+        return self._pose_version
+
+    def get_rotation_matrix(self):
+        """Return the (3,3) matrix that rotates local into global coordinates."""
+        return self._rotation.copy()
+
+    def get_inverse_rotation_matrix(self):
+        """Return the (3,3) matrix that rotates global into local coordinates."""
+        return self._inverse_rotation.copy()
+
     def get_position(self):
         """Get the position of the object.
 
@@ -124,7 +309,7 @@ class SimpleObject():
             The z-position of the object [m].
 
         """
-        return np.array( (self._x, self._y, self._z) )
+        return self._position.copy()
 
     def get_orientation(self):
         """Get the orientation of the object.
@@ -141,125 +326,79 @@ class SimpleObject():
         """
         return self._theta, self._phi, self._alpha
     
-    def local_to_global_position(self, x, y, z):
+    def local_to_global_position(self, x, y=None, z=None):
         """Convert the local coordinates `x, y, z` to global coordinates.
 
         Parameters
         ----------
-        x : float
+        x : float or array-like
             The x-position in local coordinates [m].
-        y : float
+            If `y` and `z` are not provided, `x` is interpreted as an array of
+            shape (...,3) containing the stacked x, y and z coordinates.
+        y : float or array-like, optional
             The y-position in local coordinates [m].
-        z : float
+        z : float or array-like, optional
             The z-position in local coordinates [m].
 
         Returns
         ----------
-        x1 : float
+        x1 : float or ndarray
             The x-position in global coordinates [m].
-        y1 : float
+        y1 : float or ndarray
             The y-position in global coordinates [m].
-        z1 : float
+        z1 : float or ndarray
             The z-position in global coordinates [m].
+
+        Notes
+        -----
+        Stacked input of shape (...,3) returns an array of the same shape.
+        Otherwise an array of shape (3,...) is returned, which can be unpacked
+        into `x1, y1, z1`.
         
         """
-        # Get objects position and orientation.
-        x0, y0, z0 = self.get_position()
-        theta, phi, alpha = self.get_orientation()
-
-        # Shortcuts for sine and cosine of the angles:
-        st = np.sin(np.pi * theta/180)
-        ct = np.cos(np.pi * theta/180)
-        sp = np.sin(np.pi * phi/180)
-        cp = np.cos(np.pi * phi/180)
-        sa = np.sin(np.pi * alpha/180)
-        ca = np.cos(np.pi * alpha/180)
-        
-        # Coordinates as vectors:
-        v = np.matrix([[x], [y], [z]])
-        v0 = np.matrix([[x0], [y0], [z0]])
-
-        # The rotation matrices:
-        # Rotation around the z-axis by alpha
-        M1 = np.matrix([[ ca, -sa,  0.],
-                        [ sa,  ca,  0.],
-                        [ 0.,  0.,  1.]])
-        # Rotation around the y-axis by theta
-        M2 = np.matrix([[ ct,  0.,  st],
-                        [ 0.,  1.,  0.],
-                        [-st,  0.,  ct]])
-        # Rotation around the z-axis by phi
-        M3 = np.matrix([[ cp, -sp,  0.],
-                        [ sp,  cp,  0.],
-                        [ 0.,  0.,  1.]])
-
-        # Apply rotation and translation.
-        v1 = v0 + M3*M2*M1 * v
-        
-        # Return flattened array of coordinates.
-        return v1.A1
+        v, shape, stacked = _as_points(x, y, z)
+
+        # Apply cached rotation and translation.
+        v1 = self._position + _rotate(self._rotation, v)
+
+        return _from_points(v1, shape, stacked)
     
-    def global_to_local_position(self, x, y, z):
+    def global_to_local_position(self, x, y=None, z=None):
         """Convert the global coordinates `x, y, z` to local coordinates.
 
         Parameters
         ----------
-        x : float
+        x : float or array-like
             The x-position in global coordinates [m].
-        y : float
+            If `y` and `z` are not provided, `x` is interpreted as an array of
+            shape (...,3) containing the stacked x, y and z coordinates.
+        y : float or array-like, optional
             The y-position in global coordinates [m].
-        z : float
+        z : float or array-like, optional
             The z-position in global coordinates [m].
 
         Returns
         ----------
-        x1 : float
+        x1 : float or ndarray
             The x-position in local coordinates [m].
-        y1 : float
+        y1 : float or ndarray
             The y-position in local coordinates [m].
-        z1 : float
+        z1 : float or ndarray
             The z-position in local coordinates [m].
+
+        Notes
+        -----
+        Stacked input of shape (...,3) returns an array of the same shape.
+        Otherwise an array of shape (3,...) is returned, which can be unpacked
+        into `x1, y1, z1`.
         
         """
-        # Get objects position and orientation.
-        x0, y0, z0 = self.get_position()
-        theta, phi, alpha = self.get_orientation()
-
-        # Shortcuts for sine and cosine of the angles:
-        st = np.sin(np.pi * theta/180)
-        ct = np.cos(np.pi * theta/180)
-        sp = np.sin(np.pi * phi/180)
-        cp = np.cos(np.pi * phi/180)
-        sa = np.sin(np.pi * alpha/180)
-        ca = np.cos(np.pi * alpha/180)
-
-        # Coordinates as vectors:
-        v = np.matrix([[x],
-                       [y],
-                       [z]])
-        v0 = np.matrix([[x0],
-                        [y0],
-                        [z0]])
-
-        # The inverse rotation matrices:
-        # Rotation around the z-axis by alpha
-        M1 = np.matrix([[ ca,  sa,  0.],
-                        [-sa,  ca,  0.],
-                        [ 0.,  0.,  1.]])
-        # Rotation around the y-axis by theta
-        M2 = np.matrix([[ ct,  0., -st],
-                        [ 0.,  1.,  0.],
-                        [ st,  0.,  ct]])
-        # Rotation around the z-axis by phi
-        M3 = np.matrix([[ cp,  sp,  0.],
-                        [-sp,  cp,  0.],
-                        [ 0.,  0.,  1.]])
-
-        # Apply rotation and translation in reverse.
-        v1 = M1*M2*M3 * (v - v0)
-        
-        # Return flattened array of coordinates.
-        return v1.A1
+        v, shape, stacked = _as_points(x, y, z)
+
+        # Apply cached rotation and translation in reverse.
+        v1 = _rotate(self._inverse_rotation, v - self._position)
+
+        return _from_points(v1, shape, stacked)
 
 
     def get_environment(self):
@@ -282,7 +421,7 @@ class SimpleObject():
         If the object is already part of the environment, a ValueError will be raised.
 
         """
-        if self._environment == environment:
+        if self._environment is environment:
             raise ValueError("The object is already part of the environment.")
 
         # Remove object from previous environment
@@ -291,29 +430,23 @@ class SimpleObject():
         
         # Add to new environment
         self._environment = environment
-        try:
-            environment.add_object(self)
-        except ValueError:
-            # Catch ValueErrors so a mutual addition does not raise an Error.
-            pass
-        except:
-            # The environment was not able to add the object. Reset and raise Error.
-            self._environment = None
-            raise
+        if not environment.has_object(self):
+            try:
+                environment.add_object(self)
+            except:
+                # The environment was not able to add the object. Reset and raise Error.
+                self._environment = None
+                raise
         log.debug("%s is now part of %s."%(self, environment))
     
     def remove_from_environment(self, environment):
         """Remove the object from an environment.
         
         Raises ValueError if the object is not part of the environment."""
-        if self._environment != environment:
+        if self._environment is not environment:
             raise ValueError("The object is not part of the environment.")
         
         self._environment = None
-        try:
+        if environment.has_object(self):
             environment.remove_object(self)
-        except ValueError:
-            # Catch ValueErrors so a mutual removal does not raise an Error.
-            pass
         log.debug("%s is no longer a part of %s."%(self, environment))
-
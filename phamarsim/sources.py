@@ -1,35 +1,136 @@
 # coding:utf-8
 """Sound sources for Phamarsim
 
-Sound sources must define the method
+Sound sources must provide the method
 
 >>> get_sound_signal(t)
 
 which returns the signal of the source for every point in time t [s].
+Subclasses of `SoundSource` implement `_get_sound_signal(t)` instead, so
+the results can be memoized by the base class (see `SoundSource.enable_cache`).
 
 The unit of the signal is 1 and will be translated to soundwaves by a speaker.
 It should be centered at 0 and the amplitude should be <= 1.
 
+Analytic sources that consist of pure tones can also define the method
+
+>>> get_phasors()
+
+which returns the frequencies [Hz] and complex amplitudes of the tones, so
+that the signal is the imaginary part of `sum(a * exp(2j*pi*f*t))`.
+Environments can use this to combine delayed tones without evaluating the
+signal for every propagation path.
+
 """
 from __future__ import division
 import numpy as np
+import os
+import struct
 
 import warnings
 import logging
 log = logging.getLogger(__name__)
 
 import speakers
+import caches
 
 class SoundSource():
     """Base class for sound sources"""
 
     def __init__(self):
         self._speakers = []
+        self._version = 0
+        self._cache = None
+
+    def get_version(self):
+        """Return a counter that is increased whenever the signal of the source changes.
+
+        Caches that depend on the signal can store this number and compare
+        it later to notice changes.
+
+        """
+        return self._version
+
+    def _signal_changed(self):
+        """Notify the source that its signal parameters have changed.
+
+        This also clears the signal cache.
+
+        """
+        self._version += 1
+        if self._cache is not None:
+            self._cache.clear()
+
+    def enable_cache(self, max_bytes=16*2**20):
+        """Memoize the results of `get_sound_signal`.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The memory budget of the cache in bytes. The least recently used
+            signals are removed when it is exceeded.
+
+        Notes
+        -----
+        Signals are identified by the time grid they are evaluated on, i.e. the
+        shape, start and step of `t`, together with a digest of the actual
+        times. Changing the parameters of the source clears the cache.
+
+        The returned arrays are shared between calls and thus read-only.
+
+        """
+        self._cache = caches.LRUCache(maxsize=None, max_bytes=max_bytes)
+
+    def disable_cache(self):
+        """Stop memoizing the results of `get_sound_signal`."""
+        self._cache = None
+
+    def get_cache_info(self):
+        """Return the statistics of the signal cache.
 
-    def get_sound_signal(self, t): 
-        warnigns.warn("Tried to get a sound signal from the SoundSource base class.")
+        Returns
+        -------
+        info : dict
+            The number of `hits` and `misses`, the number of `entries`, their
+            size in bytes `nbytes` and the memory budget `max_bytes`.
+            `None` if the cache is disabled.
+
+        """
+        if self._cache is None:
+            return None
+        hits, misses = self._cache.get_stats()
+        return dict(hits=hits, misses=misses, entries=len(self._cache),
+                    nbytes=self._cache.get_nbytes(), max_bytes=self._cache.get_max_bytes())
+
+    def get_sound_signal(self, t):
+        """Return the signal of the source at the times t [s]."""
+        if self._cache is None:
+            return self._get_sound_signal(t)
+
+        t = np.asarray(t, dtype=float)
+        flat = t.ravel()
+        start = flat[0] if flat.size else 0.
+        step = flat[1] - flat[0] if flat.size > 1 else 0.
+        key = (start, step) + caches.array_key(t)
+        signal = self._cache.get(key)
+        if signal is None:
+            signal = np.asarray(self._get_sound_signal(t))
+            signal.setflags(write=False)
+            self._cache.put(key, signal, signal.nbytes)
+        return signal
+
+    def _get_sound_signal(self, t):
+        warnings.warn("Tried to get a sound signal from the SoundSource base class.")
         return  t * 0.0
 
+    def get_phasors(self):
+        """Return the frequencies and complex amplitudes of the signal.
+
+        Returns `None`, since general sources are not a sum of pure tones.
+
+        """
+        return None
+
     def connect_speaker(self, speaker):
         """Connect a speaker to the sound source.
 
@@ -105,19 +206,525 @@ class SineSource(SoundSource):
 
     def set_frequency(self, freq):
         self._frequency = freq
+        self._signal_changed()
     def get_frequency(self):
         return self._frequency
 
     def set_phase(self, phi):
         self._phase = phi
+        self._signal_changed()
     def get_phase(self):
         return self._phase
 
     def set_amplitude(self, amp):
         self._amplitude = amp
+        self._signal_changed()
     def get_amplitude(self):
         return self._amplitude
 
-    def get_sound_signal(self, t):
+    def _get_sound_signal(self, t):
         return self.get_amplitude() * np.sin(2*np.pi*self.get_frequency()*t + self._phase)
 
+    def get_phasors(self):
+        """Return the frequency and complex amplitude of the sine.
+
+        Returns
+        -------
+        freqs : ndarray
+            The frequency of the sine as (1,) array [Hz].
+        amps : ndarray
+            The complex amplitude `amp * exp(1j*phi)` as (1,) array.
+
+        """
+        freqs = np.array([self.get_frequency()], dtype=float)
+        amps = np.array([self.get_amplitude() * np.exp(1j*self.get_phase())])
+        return freqs, amps
+
+
+_interpolation_tables = {}
+
+def get_interpolation_table(kind='sinc', taps=16, resolution=512):
+    """Return a table of interpolation weights for fractional sample positions.
+
+    Parameters
+    ----------
+    kind : {'sinc', 'lagrange'}, optional
+        The interpolation kernel. 'sinc' is a Kaiser windowed sinc, 'lagrange'
+        a Lagrange polynomial of order `taps-1`.
+    taps : int, optional
+        The number of samples that contribute to every interpolated value.
+        Must be even.
+    resolution : int, optional
+        The number of fractional positions between two samples.
+
+    Returns
+    -------
+    offsets : ndarray
+        The (taps,) sample offsets relative to the sample before the
+        interpolated position.
+    table : ndarray
+        The (resolution+1, taps) weights. Row `i` holds the weights for the
+        fractional position `i/resolution`.
+
+    Notes
+    -----
+    Tables are calculated once and shared between all sources.
+
+    """
+    key = (kind, taps, resolution)
+    if key in _interpolation_tables:
+        return _interpolation_tables[key]
+
+    if taps % 2:
+        raise ValueError("The number of taps must be even.")
+    offsets = np.arange(-taps//2 + 1, taps//2 + 1)
+    frac = np.arange(resolution + 1) / resolution
+    # Distance of every tap from the interpolated position
+    x = offsets[np.newaxis,:] - frac[:,np.newaxis]
+
+    if kind == 'sinc':
+        beta = 8.6
+        half = taps / 2
+        window = np.i0(beta * np.sqrt(np.clip(1 - (x/half)**2, 0, 1))) / np.i0(beta)
+        table = np.sinc(x) * window
+        # Normalize to unity DC gain
+        table /= np.sum(table, axis=1)[:,np.newaxis]
+    elif kind == 'lagrange':
+        table = np.ones_like(x)
+        for j in offsets:
+            for k, o in enumerate(offsets):
+                if o != j:
+                    table[:,k] *= (frac - j) / (o - j)
+    else:
+        raise ValueError("Unknown interpolation kind: %s"%(kind,))
+
+    _interpolation_tables[key] = (offsets, table)
+    return offsets, table
+
+def _open_wav(filename):
+    """Memory map the sample data of a PCM or float WAV file.
+
+    Returns
+    -------
+    data : memmap
+        The (N,) or (N, channels) sample data.
+    sample_rate : float
+        The sample rate of the file [Hz].
+
+    """
+    with open(filename, 'rb') as f:
+        riff, size, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError("%s is not a WAV file."%(filename,))
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("%s has no data chunk."%(filename,))
+            chunk, chunk_size = struct.unpack('<4sI', header)
+            if chunk == b'fmt ':
+                raw = f.read(chunk_size)
+                tag, channels, sample_rate, byte_rate, align, bits = struct.unpack('<HHIIHH', raw[:16])
+                if tag == 0xFFFE:
+                    # WAVE_FORMAT_EXTENSIBLE, the real format is in the sub format GUID
+                    tag = struct.unpack('<H', raw[24:26])[0]
+                fmt = (tag, channels, sample_rate, bits)
+            elif chunk == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+    if fmt is None:
+        raise ValueError("%s has no format chunk."%(filename,))
+    tag, channels, sample_rate, bits = fmt
+    dtypes = { (1, 8): 'u1', (1, 16): '<i2', (1, 32): '<i4', (3, 32): '<f4', (3, 64): '<f8' }
+    if (tag, bits) not in dtypes:
+        raise ValueError("Unsupported WAV format %d with %d bits."%(tag, bits))
+    dtype = np.dtype(dtypes[(tag, bits)])
+    n = chunk_size // (dtype.itemsize * channels)
+    shape = (n,) if channels == 1 else (n, channels)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape), sample_rate
+
+class InterpolatingSource(SoundSource):
+    """Base class for sources defined by samples on a regular time grid
+
+    Subclasses provide the samples through the method `_read(lo, hi)`,
+    which returns the normalized samples with the indices `lo` to `hi-1`.
+
+    Parameters
+    ----------
+    sample_rate : float
+        The sample rate [Hz].
+    amp : float, optional
+        The amplitude by which the normalized samples are multiplied.
+    start : float, optional
+        The time of the sample with index 0 [s].
+    interpolation : {'sinc', 'lagrange'}, optional
+        The interpolation kernel for times between samples.
+        See `get_interpolation_table`.
+    taps : int, optional
+        The length of the interpolation kernel.
+    resolution : int, optional
+        The number of tabulated fractional positions between two samples.
+
+    Notes
+    -----
+    The signal is interpolated with tabulated weights, which are applied
+    to the whole time vector at once, one tap at a time.
+
+    """
+    def __init__(self, sample_rate, amp=1.0, start=0.0, interpolation='sinc', taps=16, resolution=512):
+        SoundSource.__init__(self)
+        self._sample_rate = sample_rate
+        self._start = start
+        self._offsets, self._table = get_interpolation_table(interpolation, taps, resolution)
+        self._resolution = resolution
+        self.set_amplitude(amp)
+
+    def set_amplitude(self, amp):
+        self._amplitude = amp
+        self._signal_changed()
+    def get_amplitude(self):
+        return self._amplitude
+
+    def get_sample_rate(self):
+        return self._sample_rate
+
+    def _read(self, lo, hi):
+        warnings.warn("Tried to read samples from the InterpolatingSource base class.")
+        return np.zeros(hi - lo)
+
+    def _get_sound_signal(self, t):
+        t = np.asarray(t, dtype=float)
+        pos = (t - self._start) * self._sample_rate
+        n = np.floor(pos)
+        row = np.rint((pos - n) * self._resolution).astype(int)
+        n = n.astype(np.int64)
+
+        signal = np.zeros(t.shape)
+        if signal.size == 0:
+            return signal
+
+        # Read only the range of samples that is needed
+        lo = int(n.min()) + self._offsets[0]
+        hi = int(n.max()) + self._offsets[-1] + 1
+        chunk = self._read(lo, hi)
+        for k, o in enumerate(self._offsets):
+            signal += self._table[row,k] * chunk[n + (o - lo)]
+
+        return self.get_amplitude() * signal
+
+class SampledSource(InterpolatingSource):
+    """Sound source playing back recorded samples
+
+    Parameters
+    ----------
+    data : array-like
+        The (N,) samples. Can be a memory map, in which case only the samples
+        needed for a requested time range are read. Other sequences than
+        arrays are converted to floats.
+    sample_rate : float
+        The sample rate of the data [Hz].
+    loop : bool, optional
+        Whether the samples should be repeated indefinitely. Otherwise the
+        signal is 0 outside of the recording.
+    kwargs : dictionary
+        Will be passed to the `InterpolatingSource` constructor.
+
+    Notes
+    -----
+    Integer samples are normalized to the range [-1, 1).
+
+    """
+    def __init__(self, data, sample_rate, loop=False, **kwargs):
+        if not isinstance(data, np.ndarray):
+            data = np.asarray(data, dtype=float)
+        self._data = data
+        self._loop = loop
+
+        # Normalization of integer data
+        dtype = np.dtype(data.dtype)
+        self._zero = 0.
+        self._scale = 1.
+        if dtype.kind == 'u':
+            self._zero = 2.**(8*dtype.itemsize - 1)
+            self._scale = 1. / self._zero
+        elif dtype.kind == 'i':
+            self._scale = 1. / 2.**(8*dtype.itemsize - 1)
+
+        InterpolatingSource.__init__(self, sample_rate, **kwargs)
+
+    @classmethod
+    def from_file(cls, filename, sample_rate=None, dtype='<f4', offset=0, channel=0, **kwargs):
+        """Create a source from a sample file without loading it into memory.
+
+        Parameters
+        ----------
+        filename : str
+            The file to be read. WAV ('.wav') and NumPy ('.npy') files are
+            recognized by their extension, everything else is read as raw
+            samples.
+        sample_rate : float, optional
+            The sample rate [Hz]. Mandatory for raw and NumPy files, taken
+            from the header for WAV files.
+        dtype : data-type, optional
+            The data type of raw files.
+        offset : int, optional
+            The number of header bytes to skip in raw files.
+        channel : int, optional
+            The channel to be used for multi channel files.
+        kwargs : dictionary
+            Will be passed to the `SampledSource` constructor.
+
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == '.wav':
+            data, rate = _open_wav(filename)
+            if sample_rate is None:
+                sample_rate = rate
+        elif ext == '.npy':
+            data = np.load(filename, mmap_mode='r')
+        else:
+            data = np.memmap(filename, dtype=dtype, mode='r', offset=offset)
+
+        if sample_rate is None:
+            raise ValueError("The sample rate must be provided.")
+        if data.ndim == 2:
+            data = data[:,channel]
+        return cls(data, sample_rate, **kwargs)
+
+    def get_duration(self):
+        """Return the duration of the recording [s]."""
+        return len(self._data) / self._sample_rate
+
+    def _read(self, lo, hi):
+        """Read the normalized samples `lo` to `hi-1`.
+
+        Outside of the recording, the samples are 0 or repeated, depending
+        on whether the source loops.
+
+        """
+        n = len(self._data)
+        if self._loop:
+            if lo >= 0 and hi <= n:
+                raw = self._data[lo:hi]
+            else:
+                raw = self._data[np.arange(lo, hi) % n]
+            return (np.asarray(raw, dtype=float) - self._zero) * self._scale
+
+        chunk = np.zeros(hi - lo)
+        a, b = max(lo, 0), min(hi, n)
+        if a < b:
+            chunk[a-lo:b-lo] = (np.asarray(self._data[a:b], dtype=float) - self._zero) * self._scale
+        return chunk
+
+class WhiteNoiseSource(InterpolatingSource):
+    """Reproducible white gaussian noise
+
+    Parameters
+    ----------
+    sample_rate : float
+        The sample rate of the noise [Hz]. The noise is white up to half
+        the sample rate.
+    amp : float, optional
+        The standard deviation of the noise samples.
+    seed : int, optional
+        The seed of the noise.
+    block_size : int, optional
+        The number of samples generated at once.
+    kwargs : dictionary
+        Will be passed to the `InterpolatingSource` constructor.
+
+    Notes
+    -----
+    The noise is generated in blocks of samples. Every block has its own
+    random number generator, seeded with the `seed` and the block index.
+    Only the blocks covering a requested time window are generated, so late
+    windows are as cheap as early ones and every window is reproducible.
+
+    """
+    def __init__(self, sample_rate, seed=0, block_size=4096, **kwargs):
+        self._seed = seed
+        self._block_size = block_size
+        self._blocks = caches.LRUCache(maxsize=16)
+        InterpolatingSource.__init__(self, sample_rate, **kwargs)
+
+    def set_seed(self, seed):
+        self._seed = seed
+        self._blocks.clear()
+        self._signal_changed()
+    def get_seed(self):
+        return self._seed
+
+    def _get_block(self, b):
+        """Return the samples of block `b`."""
+        block = self._blocks.get(b)
+        if block is None:
+            b = int(b)
+            rng = np.random.RandomState([self._seed & 0xffffffff, b & 0xffffffff, (b >> 32) & 0xffffffff])
+            block = rng.standard_normal(self._block_size)
+            self._blocks.put(b, block)
+        return block
+
+    def _read(self, lo, hi):
+        """Generate the samples `lo` to `hi-1`."""
+        B = self._block_size
+        first, last = lo // B, (hi - 1) // B
+        chunk = np.concatenate([self._get_block(b) for b in range(first, last + 1)])
+        return chunk[lo - first*B:hi - first*B]
+
+class ChirpSource(SoundSource):
+    """Frequency sweep
+
+    Parameters
+    ----------
+    f0 : float, optional
+        The start frequency [Hz].
+    f1 : float, optional
+        The end frequency [Hz].
+    duration : float, optional
+        The duration of the sweep [s].
+    amp : float, optional
+        The amplitude of the signal.
+    phi : float, optional
+        The phase of the signal at the start of the sweep [rad].
+    method : {'linear', 'exponential'}, optional
+        Whether the frequency changes linearly or exponentially with time.
+        Exponential sweeps need positive frequencies.
+    repeat : bool, optional
+        Whether the sweep is repeated every `duration`. Otherwise the
+        signal is 0 outside of the sweep.
+
+    Notes
+    -----
+    The sweep starts at t = 0.
+
+    """
+    def __init__(self, f0=100.0, f1=10000.0, duration=1.0, amp=1.0, phi=0.0, method='linear', repeat=True):
+        SoundSource.__init__(self)
+        if method not in ('linear', 'exponential'):
+            raise ValueError("Unknown chirp method: %s"%(method,))
+        self._duration = duration
+        self._method = method
+        self.set_frequencies(f0, f1)
+        self._repeat = repeat
+        self.set_amplitude(amp)
+        self.set_phase(phi)
+
+    def set_frequencies(self, f0, f1):
+        if self._method == 'exponential' and not (f0 > 0 and f1 > 0):
+            raise ValueError("Exponential sweeps need positive frequencies.")
+        self._f0 = f0
+        self._f1 = f1
+        self._signal_changed()
+    def get_frequencies(self):
+        return self._f0, self._f1
+
+    def set_phase(self, phi):
+        self._phase = phi
+        self._signal_changed()
+    def get_phase(self):
+        return self._phase
+
+    def set_amplitude(self, amp):
+        self._amplitude = amp
+        self._signal_changed()
+    def get_amplitude(self):
+        return self._amplitude
+
+    def _get_sound_signal(self, t):
+        t = np.asarray(t, dtype=float)
+        D = self._duration
+        f0, f1 = self._f0, self._f1
+        if self._repeat:
+            tau = np.mod(t, D)
+        else:
+            tau = t
+
+        if self._method == 'linear' or f0 == f1:
+            phase = 2*np.pi * (f0*tau + (f1 - f0) * tau**2 / (2*D))
+        else:
+            k = np.log(f1 / f0)
+            phase = 2*np.pi * f0 * D / k * np.expm1(k * tau / D)
+
+        signal = self.get_amplitude() * np.sin(phase + self._phase)
+        if not self._repeat:
+            signal = np.where((tau >= 0) & (tau < D), signal, 0.)
+        return signal
+
+class MultiToneSource(SoundSource):
+    """Sum of sine waves
+
+    Parameters
+    ----------
+    freqs : array-like
+        The (F,) frequencies of the tones [Hz].
+    amps : array-like, optional
+        The (F,) amplitudes of the tones.
+    phis : array-like, optional
+        The (F,) phases of the tones [rad].
+
+    Notes
+    -----
+    The signal will be
+
+        signal = sum(amps * sin(2*pi*freqs*t + phis)).
+
+    All tones are evaluated together as an outer product of times and
+    frequencies.
+
+    """
+    def __init__(self, freqs, amps=1.0, phis=0.0):
+        SoundSource.__init__(self)
+        self.set_tones(freqs, amps, phis)
+
+    def set_tones(self, freqs, amps=1.0, phis=0.0):
+        """Set the frequencies, amplitudes and phases of the tones."""
+        freqs = np.array(freqs, dtype=float, ndmin=1)
+        self._frequencies = freqs
+        self._amplitudes = np.broadcast_to(np.asarray(amps, dtype=float), freqs.shape).copy()
+        self._phases = np.broadcast_to(np.asarray(phis, dtype=float), freqs.shape).copy()
+        self._signal_changed()
+
+    def get_frequencies(self):
+        return self._frequencies.copy()
+
+    def get_amplitudes(self):
+        return self._amplitudes.copy()
+
+    def get_phases(self):
+        return self._phases.copy()
+
+    def _get_sound_signal(self, t):
+        t = np.asarray(t, dtype=float)
+        return np.dot(np.sin(2*np.pi * t[...,np.newaxis] * self._frequencies + self._phases), self._amplitudes)
+
+    def get_phasors(self):
+        """Return the frequencies and complex amplitudes of the tones."""
+        return self._frequencies.copy(), self._amplitudes * np.exp(1j*self._phases)
+
+class HarmonicSource(MultiToneSource):
+    """Tone with harmonic overtones
+
+    Parameters
+    ----------
+    freq : float, optional
+        The fundamental frequency [Hz].
+    amps : array-like, optional
+        The amplitudes of the fundamental and the overtones. The number of
+        values determines the number of harmonics.
+    phis : array-like, optional
+        The phases of the harmonics [rad].
+
+    """
+    def __init__(self, freq=440.0, amps=(1.0, 0.5, 0.25), phis=0.0):
+        amps = np.array(amps, dtype=float, ndmin=1)
+        self._fundamental = freq
+        MultiToneSource.__init__(self, freq * np.arange(1, len(amps)+1), amps, phis)
+
+    def set_fundamental(self, freq):
+        self._fundamental = freq
+        self.set_tones(freq * np.arange(1, len(self._amplitudes)+1), self._amplitudes, self._phases)
+    def get_fundamental(self):
+        return self._fundamental
@@ -21,6 +21,16 @@ theta and phi, albeit ignoring the time delay.
 
 According to Wikipedia, a normal conversation has a sound pressure of 2~20 mPa.
 
+Speakers whose signal is the source signal scaled by a direction dependent
+gain can also provide the method
+
+>>> get_phasors(theta, phi)
+
+which returns the frequencies and complex amplitudes of analytic sources,
+already multiplied with the gain in the given directions. It returns `None`
+if the source is not analytic. Speakers overriding `get_pressure_signal`
+must override `get_phasors` accordingly.
+
 """
 
 from __future__ import division
@@ -30,6 +40,7 @@ import logging
 log = logging.getLogger(__name__)
 
 import objects
+import directivities
 
 class Speaker(objects.SimpleObject):
     """Base class for speakers
@@ -49,6 +60,7 @@ class Speaker(objects.SimpleObject):
         objects.SimpleObject.__init__(self, **kwargs)
         self._source = None
         self._amplification = amplification
+        self._signal_version = 0
         if src is not None:
             self.connect_to_source(src)
     
@@ -76,14 +88,74 @@ class Speaker(objects.SimpleObject):
         theta and phi.
         
         """
-        return self.get_source().get_sound_signal(t) * self.get_amplification()
-    
+        return self.get_source().get_sound_signal(t) * self.get_gain(theta, phi)
+
+    def get_gain(self, theta=0.0, phi=0.0):
+        """Return the gain of the speaker in the specified direction.
+
+        Parameters
+        ----------
+        theta : array-like
+            The polar angle of the outgoing wave as measurde from the speaker's z-axis [deg].
+        phi : array-like
+            The azimuthal angle of outgoing wave as measured from the speaker's x-axis [deg].
+
+        Returns
+        -------
+        gain : float or ndarray
+            The gain in the specified direction [mPa * m].
+
+        Notes
+        -----
+        This simple speaker is isotropic, so the gain is just the amplification.
+
+        """
+        return self.get_amplification()
+
+    def get_phasors(self, theta=0.0, phi=0.0):
+        """Return the tones of an analytic source as emitted in the specified directions.
+
+        Parameters
+        ----------
+        theta : array-like
+            The polar angle of the outgoing wave as measurde from the speaker's z-axis [deg].
+        phi : array-like
+            The azimuthal angle of outgoing wave as measured from the speaker's x-axis [deg].
+
+        Returns
+        -------
+        freqs : ndarray
+            The (F,) frequencies of the tones [Hz].
+        amps : ndarray
+            The complex amplitudes of the tones of shape (F,) plus the
+            broadcast shape of `theta` and `phi`.
+
+        Returns `None` if the source does not provide phasors.
+
+        """
+        phasors = self.get_source().get_phasors()
+        if phasors is None:
+            return None
+        freqs, amps = phasors
+        gain = np.asarray(self.get_gain(theta, phi))
+        return freqs, amps.reshape(amps.shape + (1,)*gain.ndim) * gain
+
     def set_amplification(self, amplification):
         self._amplification = amplification
+        self._signal_version += 1
 
     def get_amplification(self):
         return self._amplification
 
+    def get_signal_version(self):
+        """Return a counter that is increased whenever the emitted signal changes.
+
+        This covers changes of the amplification and of the connected source,
+        but not changes within the source itself. See `SoundSource.get_version`.
+
+        """
+        return self._signal_version
+
     def connect_to_source(self, src):
         """Connect the speaker to a sound source.
 
@@ -110,6 +182,7 @@ class Speaker(objects.SimpleObject):
 
         # Connect new source
         self._source = src
+        self._signal_version += 1
         try:
             src.connect_speaker(self)
         except ValueError:
@@ -131,6 +204,7 @@ class Speaker(objects.SimpleObject):
             raise ValueError("The source is not connected to the speaker.")
 
         self._source = None
+        self._signal_version += 1
         try:
             src.disconnect_speaker(self)
         except ValueError:
@@ -140,3 +214,46 @@ class Speaker(objects.SimpleObject):
 
     def get_source(self):
         return self._source
+
+class DirectionalSpeaker(Speaker):
+    """Speaker with a direction dependent gain
+
+    Parameters
+    ----------
+    directivity : Directivity, optional
+        The gain pattern of the speaker relative to its orientation.
+        Defaults to `directivities.omni()`.
+    kwargs : dictionary
+        Will be passed to the `Speaker` constructor.
+
+    """
+    def __init__(self, directivity=None, **kwargs):
+        Speaker.__init__(self, **kwargs)
+        if directivity is None:
+            directivity = directivities.omni()
+        self.set_directivity(directivity)
+
+    def set_directivity(self, directivity):
+        self._directivity = directivity
+        self._signal_version += 1
+
+    def get_directivity(self):
+        return self._directivity
+
+    def get_gain(self, theta=0.0, phi=0.0):
+        """Return the gain of the speaker in the specified direction.
+
+        Parameters
+        ----------
+        theta : array-like
+            The polar angle of the outgoing wave as measurde from the speaker's z-axis [deg].
+        phi : array-like
+            The azimuthal angle of outgoing wave as measured from the speaker's x-axis [deg].
+
+        Returns
+        -------
+        gain : ndarray
+            The amplification times the directivity in the specified directions [mPa * m].
+
+        """
+        return self.get_amplification() * self.get_directivity().get_gain(theta, phi)
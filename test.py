@@ -17,13 +17,9 @@ S = pa.sources.SineSource(4400)
 Sp = pa.speakers.Speaker(S)
 E.add_object(Sp)
 
-mics = []
-for x in np.linspace(-.1, .1, 15):
-    mic = pa.microphones.Microphone()
-    mic.set_position(x, 0, 0)
-    mics.append(mic)
-
-E.add_objects(mics)
+mx = np.linspace(-.1, .1, 15)
+mics = pa.microphones.MicrophoneArray(positions=np.stack((mx, 0*mx, 0*mx), axis=-1))
+E.add_object(mics)
 
 integration_time = 0.1
 sample_frequency = 50000
@@ -35,43 +31,28 @@ YY = np.repeat(Y, len(X))
 
 (x0, y0, z0) = (0.5, 1.2, 0.0)
 r0 = np.sqrt(x0**2 + y0**2 + z0**2)
-dts = []
 c = M.get_speed_of_sound()
-for mic in mics:
-    x,y,z = mic.get_position()
-    Dx = x0-x
-    Dy = y0-y
-    Dz = z0-z
-    r = np.sqrt(Dx**2 + Dy**2 + Dz**2)
-    dr = r - r0
-    dts.append(dr / c)
+x, y, z = mics.get_element_positions().T
+Dx = x0-x
+Dy = y0-y
+Dz = z0-z
+r = np.sqrt(Dx**2 + Dy**2 + Dz**2)
+dr = r - r0
+dts = dr / c
 
 print dts
 
-PP = []
-PN = []
-XX = [x0] + list(XX)
-YY = [y0] + list(YY)
-XY = zip(XX, YY)
-ref = None
-refn = None
-for x, y in XY:
-    Sp.set_position(x,y,0)
-    # Calculate the signal
-    p = np.zeros_like(t)
-    for mic, dt in zip(mics, dts):
-        p += mic.get_voltage_signal(t+dt)
-    p /= len(mics)
-    p = np.std(p)
-    pn = p * np.sqrt(x**2 + y**2)
-    if ref is None:
-        print 'ref', x, y, p, pn
-        ref = p
-        refn = pn
-    p /= ref
-    pn /= refn
-    PP.append(p)
-    PN.append(pn)
+XX = np.array([x0] + list(XX))
+YY = np.array([y0] + list(YY))
+# Calculate the signal for all speaker positions
+weights = mics.get_element_gains() * mics.get_amplification() / len(mics)
+PP = E.scan_source_positions(Sp, np.stack((XX, YY, 0*XX), axis=-1),
+                             t[np.newaxis,:] + dts[:,np.newaxis],
+                             mics.get_element_positions(), weights=weights)
+PN = PP * np.sqrt(XX**2 + YY**2)
+print 'ref', XX[0], YY[0], PP[0], PN[0]
+PP /= PP[0]
+PN /= PN[0]
 
 fig, ax = plt.subplots()
 ax.set_title("Direkt")
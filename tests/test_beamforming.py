@@ -0,0 +1,140 @@
+# coding:utf-8
+"""Tests for the beamforming of Phamarsim"""
+
+from __future__ import division
+import unittest
+import warnings
+import numpy as np
+
+import phamarsim as pa
+
+SAMPLE_RATE = 20000.
+
+def make_array(n=24):
+    """Return the (n,3) positions of a spiral array in the plane z=0."""
+    k = np.arange(n)
+    r = 0.5 * np.sqrt((k + 0.5) / n)
+    phi = k * np.pi * (3. - np.sqrt(5.))
+    return np.stack((r * np.cos(phi), r * np.sin(phi), 0. * r), axis=-1)
+
+def make_grid():
+    """Return a (441,3) grid in the plane z=1 with a spacing of 5 cm."""
+    x = np.linspace(-0.5, 0.5, 21)
+    X, Y = np.meshgrid(x, x, indexing='ij')
+    return np.stack((X.ravel(), Y.ravel(), np.ones(X.size)), axis=-1)
+
+def simulate(sources, n_samples=8192):
+    """Return the (M,T) signals of the spiral array for (source, position) pairs."""
+    env = pa.environments.SimpleEnvironment()
+    for src, position in sources:
+        env.add_object(pa.speakers.Speaker(src, x=position[0], y=position[1], z=position[2]))
+    array = pa.microphones.MicrophoneArray(make_array())
+    env.add_object(array)
+    return array.get_voltage_signal(np.arange(n_samples) / SAMPLE_RATE)
+
+def grid_index(position):
+    """Return the index of the grid point closest to a position."""
+    return np.argmin(np.sum((make_grid() - position)**2, axis=-1))
+
+def find_peaks(B, n):
+    """Return the indices of the n largest local maxima of a map on the grid."""
+    B = B.reshape(21, 21)
+    padded = np.pad(B, 1, mode='constant', constant_values=-np.inf)
+    neighbours = np.max([padded[1+i:22+i,1+j:22+j] for i in (-1, 0, 1) for j in (-1, 0, 1) if i or j], axis=0)
+    maxima = np.flatnonzero(B.ravel() > neighbours.ravel())
+    return maxima[np.argsort(B.ravel()[maxima])[::-1][:n]]
+
+class DelayAndSumTest(unittest.TestCase):
+    def setUp(self):
+        self.freq = 100 * SAMPLE_RATE / 1024
+        self.position = np.array([0.2, -0.1, 1.])
+        self.data = simulate([(pa.sources.SineSource(self.freq), self.position)])
+
+    def test_spectra(self):
+        data = np.sin(2*np.pi*self.freq * np.arange(4096) / SAMPLE_RATE)[np.newaxis] * [[1.], [0.5]]
+        freqs, X = pa.beamforming.get_channel_spectra(data, SAMPLE_RATE, block_size=1024)
+        self.assertEqual(X.shape, (513, 2, 4))
+        np.testing.assert_allclose(np.abs(X[100]), [[1.]*4, [0.5]*4], rtol=1e-6)
+        self.assertEqual(freqs[100], self.freq)
+
+    def test_peak_at_source(self):
+        bf = pa.beamforming.DelayAndSumBeamformer(make_array(), make_grid())
+        B = bf.get_map(self.data, SAMPLE_RATE, fmin=self.freq - 1., fmax=self.freq + 1., block_size=1024)
+        self.assertEqual(np.argmax(B), grid_index(self.position))
+        # The aligned channels average their amplitudes
+        r = np.linalg.norm(make_array() - self.position, axis=-1)
+        self.assertAlmostEqual(np.max(B), np.mean(1. / r)**2, delta=1e-6)
+
+    def test_chunks(self):
+        grid = make_grid()
+        whole = pa.beamforming.DelayAndSumBeamformer(make_array(), grid)
+        chunked = pa.beamforming.DelayAndSumBeamformer(make_array(), grid, max_bytes=16 * 24 * 50)
+        freqs, X = pa.beamforming.get_channel_spectra(self.data, SAMPLE_RATE, block_size=1024)
+        np.testing.assert_allclose(chunked.get_map_from_spectra(freqs, X, 1500., 2500.),
+                                   whole.get_map_from_spectra(freqs, X, 1500., 2500.), rtol=1e-12)
+
+class TwoSourceTestCase(unittest.TestCase):
+    """Two incoherent noise sources on the grid"""
+    def setUp(self):
+        self.positions = [np.array([0.2, -0.1, 1.]), np.array([-0.25, 0.3, 1.])]
+        self.data = simulate([(pa.sources.WhiteNoiseSource(SAMPLE_RATE, seed=1), self.positions[0]),
+                              (pa.sources.WhiteNoiseSource(SAMPLE_RATE, amp=0.7, seed=2), self.positions[1])],
+                             n_samples=2**15)
+        self.steering = pa.beamforming.SteeringTable(make_array(), make_grid())
+        self.csm = pa.beamforming.CrossSpectralMatrix(self.data, SAMPLE_RATE, block_size=256)
+
+class CSMTest(TwoSourceTestCase):
+    def test_matrix(self):
+        freq = 16 * SAMPLE_RATE / 256
+        data = np.sin(2*np.pi*freq * np.arange(4096) / SAMPLE_RATE)[np.newaxis] * [[1.], [0.5]]
+        freqs, C = pa.beamforming.CrossSpectralMatrix(data, SAMPLE_RATE, block_size=256).get_band(freq, freq)
+        np.testing.assert_allclose(C[0], [[1., 0.5], [0.5, 0.25]], rtol=1e-4)
+        self.assertIs(self.csm.get_band(1000., 2000.), self.csm.get_band(1000., 2000.))
+
+    def test_steering_table(self):
+        h = self.steering.get(1000., slice(10, 20))
+        distances = pa.beamforming.get_distances(make_array(), make_grid()[10:20])
+        np.testing.assert_allclose(h, pa.beamforming.get_steering_vectors(distances, 1000.))
+        self.assertEqual(self.steering.get_shape(), (441, 24))
+
+    def test_matches_delay_and_sum(self):
+        bf = pa.beamforming.CSMBeamformer(self.steering)
+        das = pa.beamforming.DelayAndSumBeamformer(make_array(), make_grid())
+        freqs, X = pa.beamforming.get_channel_spectra(self.data, SAMPLE_RATE, block_size=256, overlap=0.5)
+        np.testing.assert_allclose(bf.get_map(self.csm, 1500., 2500.),
+                                   das.get_map_from_spectra(freqs, X, 1500., 2500.), rtol=1e-9)
+
+    def test_clean_sc(self):
+        bf = pa.beamforming.CSMBeamformer(self.steering, diagonal_removal=True)
+        B = bf.get_clean_sc_map(self.csm, 1500., 2500.)
+        peaks = np.argsort(B)[::-1][:2]
+        self.assertEqual(sorted(peaks), sorted(grid_index(p) for p in self.positions))
+        # Most of the power is concentrated at the sources
+        self.assertGreater(np.sum(B[peaks]), 0.8 * np.sum(B))
+
+    def test_base_class(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            B = pa.beamforming.CSMEstimator(self.steering).get_map(self.csm)
+        self.assertEqual(len(caught), 1)
+        np.testing.assert_array_equal(B, np.zeros(441))
+
+class HighResolutionTest(TwoSourceTestCase):
+    def test_mvdr(self):
+        bf = pa.beamforming.MVDRBeamformer(self.steering, diagonal_loading=1e-3)
+        B = bf.get_map(self.csm, 1500., 2500.)
+        peaks = find_peaks(B, 2)
+        self.assertEqual(sorted(peaks), sorted(grid_index(p) for p in self.positions))
+        das = pa.beamforming.CSMBeamformer(self.steering).get_map(self.csm, 1500., 2500.)
+        # The main lobes are narrower than those of delay-and-sum
+        self.assertLess(np.sum(B > 0.5 * np.max(B)), np.sum(das > 0.5 * np.max(das)))
+
+    def test_music(self):
+        est = pa.beamforming.MUSICEstimator(self.steering, n_sources=2, diagonal_loading=1e-6)
+        self.assertEqual(est.get_number_of_sources(), 2)
+        B = est.get_map(self.csm, 1500., 2500.)
+        peaks = find_peaks(B, 2)
+        self.assertEqual(sorted(peaks), sorted(grid_index(p) for p in self.positions))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# coding:utf-8
+"""Tests for the caches of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class LRUCacheTest(unittest.TestCase):
+    def test_maxsize(self):
+        cache = pa.caches.LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.get_stats(), (3, 1))
+
+    def test_max_bytes(self):
+        cache = pa.caches.LRUCache(maxsize=None, max_bytes=100)
+        cache.put('a', 1, 60)
+        cache.put('b', 2, 30)
+        cache.put('c', 3, 30)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_nbytes(), 60)
+        cache.put('d', 4, 200)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.pop('b'), 2)
+        self.assertEqual(cache.get_nbytes(), 30)
+        cache.clear()
+        self.assertEqual((len(cache), cache.get_nbytes()), (0, 0))
+
+class ArrayKeyTest(unittest.TestCase):
+    def test_content(self):
+        key = pa.caches.array_key
+        a = np.linspace(0., 1., 1000)
+        self.assertEqual(key(a), key(a.copy()))
+        b = a.copy()
+        b[500] += 1e-12
+        self.assertNotEqual(key(a), key(b))
+        self.assertNotEqual(key(a), key(a.reshape(10, 100)))
+        self.assertNotEqual(key(a), key(a.astype(np.float32)))
+        self.assertEqual(key(a[::2]), key(a[::2].copy()))
+        self.assertLess(len(key(a)[-1]), 100)
+
+    def test_frozen_arrays(self):
+        key = pa.caches.array_key
+        a = np.arange(100.)
+        a.setflags(write=False)
+        self.assertEqual(key(a), key(a))
+        self.assertEqual(key(a), key(np.arange(100.)))
+        b = np.arange(100.)
+        k = key(b)
+        b[0] = 5.
+        self.assertNotEqual(key(b), k)
+
+if __name__ == '__main__':
+    unittest.main()
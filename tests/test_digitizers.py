@@ -0,0 +1,136 @@
+# coding:utf-8
+"""Tests for the digitizers of Phamarsim"""
+
+from __future__ import division
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class DigitizerTest(unittest.TestCase):
+    def setUp(self):
+        self.env = pa.environments.SimpleEnvironment()
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        self.env.add_object(pa.speakers.Speaker(src, x=1., y=1., z=0.))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_digitizer(self):
+        mics = [pa.microphones.Microphone(x=0.), pa.microphones.Microphone(x=0.2)]
+        self.env.add_objects(mics)
+        return pa.digitizers.Digitizer(sample_rate=20000., block_size=64, full_scale=0.1, microphones=mics)
+
+    def test_quantization(self):
+        mic = pa.microphones.Microphone(x=0.)
+        array = pa.microphones.MicrophoneArray(np.array([[0.2, 0., 0.], [0., 0.2, 0.]]))
+        self.env.add_objects([mic, array])
+        dig = pa.digitizers.Digitizer(sample_rate=20000., block_size=64, bits=12, full_scale=0.02,
+                                      microphones=[mic, array])
+        self.assertEqual(dig.get_number_of_channels(), 3)
+        self.assertEqual(dig.get_dtype(), np.int16)
+        t = dig.get_sample_times()
+        block = dig.read_block()
+        self.assertEqual(block.shape, (3, 64))
+        U = np.vstack((mic.get_voltage_signal(t), array.get_voltage_signal(t)))
+        np.testing.assert_array_equal(block, np.clip(np.rint(U * 2048 / 0.02), -2048, 2047))
+        np.testing.assert_allclose(dig.get_sample_times(), t + 64 / 20000., rtol=1e-12)
+        self.assertEqual(pa.digitizers.Digitizer(bits=24).get_dtype(), np.int32)
+
+    def test_clock(self):
+        mic = pa.microphones.Microphone(x=0.)
+        self.env.add_object(mic)
+        dig = pa.digitizers.Digitizer(sample_rate=20000., block_size=128, full_scale=1.,
+                                      clock_offset=1e-3, microphones=[mic])
+        dig.reset(start=0.01)
+        t = (0.01 + np.arange(128) / 20000.) + 1e-3
+        np.testing.assert_array_equal(dig.read_block()[0], np.rint(mic.get_voltage_signal(t) * 2**15))
+        jittery = pa.digitizers.Digitizer(sample_rate=20000., block_size=128, full_scale=1.,
+                                          jitter=1e-5, seed=2, microphones=[mic])
+        first = jittery.read_block().copy()
+        jittery.reset()
+        np.testing.assert_array_equal(jittery.read_block(), first)
+        dig.reset(start=-1e-3)
+        self.assertFalse(np.array_equal(first, dig.read_block()))
+
+    def test_record_file(self):
+        dig = self.make_digitizer()
+        filename = os.path.join(self.tmpdir, 'a.npy')
+        data = dig.record(filename, 256)
+        self.assertEqual(data.shape, (256, 2))
+        loaded = np.load(filename)
+        self.assertEqual(loaded.dtype, dig.get_dtype())
+        np.testing.assert_array_equal(loaded, data)
+        ref = self.make_digitizer()
+        np.testing.assert_array_equal(loaded.T, np.hstack([ref.read_block().copy() for i in range(4)]))
+        self.assertTrue(np.any(loaded != 0))
+
+    def test_record_partial_block(self):
+        dig = self.make_digitizer()
+        data = dig.record(os.path.join(self.tmpdir, 'a.npy'), 100)
+        block = dig.read_block().copy()
+        ref = self.make_digitizer()
+        expected = np.hstack([ref.read_block().copy() for i in range(3)])
+        np.testing.assert_array_equal(data.T, expected[:,:100])
+        np.testing.assert_array_equal(block, expected[:,100:164])
+
+    def test_record_self_noise(self):
+        mic = pa.microphones.MicrophoneArray(np.zeros((2,3)), noise_level=0.01)
+        pa.environments.SimpleEnvironment().add_object(mic)
+        dig = pa.digitizers.Digitizer(sample_rate=20000., block_size=64, full_scale=0.1, microphones=[mic])
+        data = dig.record(os.path.join(self.tmpdir, 'a.npy'), 129)
+        mic.disconnect_from_digitizer(dig)
+        mic.set_self_noise(0.01, sample_rate=20000.)
+        U = mic.get_voltage_signal(np.arange(129) / 20000.)
+        np.testing.assert_array_equal(data.T, np.rint(U * 2**15 / 0.1))
+
+    def test_channel_gains_follow_microphones(self):
+        a = pa.microphones.Microphone()
+        b = pa.microphones.MicrophoneArray(np.zeros((2,3)))
+        c = pa.microphones.Microphone()
+        dig = pa.digitizers.Digitizer(microphones=[a, b])
+        dig.set_channel_gains([1., 2., 3.])
+        dig.connect_microphone(c)
+        np.testing.assert_array_equal(dig.get_channel_gains(), [1., 2., 3., 1.])
+        dig.disconnect_microphone(a)
+        np.testing.assert_array_equal(dig.get_channel_gains(), [2., 3., 1.])
+        del a
+        d = pa.microphones.Microphone()
+        dig.connect_microphone(d)
+        np.testing.assert_array_equal(dig.get_channel_gains(), [2., 3., 1., 1.])
+
+    def test_realtime_pacing(self):
+        dig = self.make_digitizer()
+        self.assertIsNone(dig.get_realtime_stats())
+        start = time.time()
+        blocks = [block.copy() for block in dig.iter_realtime_blocks(n_blocks=5)]
+        self.assertGreaterEqual(time.time() - start, 5 * 64 / 20000. - 1e-3)
+        ref = self.make_digitizer()
+        np.testing.assert_array_equal(np.hstack(blocks), np.hstack([ref.read_block().copy() for i in range(5)]))
+        stats = dig.get_realtime_stats()
+        self.assertEqual(stats['blocks'], 5)
+        self.assertGreaterEqual(stats['max_latency'], stats['mean_latency'])
+
+    def test_realtime_close_early(self):
+        taps = np.hanning(31) / np.sum(np.hanning(31))
+        def make_digitizer():
+            mic = pa.microphones.Microphone(x=0., response=pa.filters.FIRFilter(taps))
+            self.env.add_object(mic)
+            return pa.digitizers.Digitizer(sample_rate=20000., block_size=200, full_scale=0.1,
+                                           jitter=1e-6, microphones=[mic])
+        dig = make_digitizer()
+        blocks = dig.iter_realtime_blocks(queue_size=4)
+        delivered = [next(blocks).copy() for i in range(3)]
+        blocks.close()
+        block = dig.read_block().copy()
+        expected = make_digitizer().record(os.path.join(self.tmpdir, 'a.npy'), 800).T
+        np.testing.assert_array_equal(np.hstack(delivered), expected[:,:600])
+        np.testing.assert_array_equal(block, expected[:,600:])
+
+if __name__ == '__main__':
+    unittest.main()
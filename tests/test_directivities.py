@@ -0,0 +1,45 @@
+# coding:utf-8
+"""Tests for the directivities and directional speakers of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class DirectivityTest(unittest.TestCase):
+    def test_interpolation(self):
+        func = lambda theta, phi: 1. + 0.3 * np.cos(np.pi*theta/180) * np.sin(np.pi*phi/180)
+        directivity = pa.directivities.Directivity.from_function(func, 91, 181)
+        theta, phi = pa.directivities.Directivity.get_grid(91, 181)
+        np.testing.assert_allclose(directivity.get_gain(theta, phi), func(theta, phi), atol=1e-12)
+        theta = np.random.RandomState(0).uniform(0., 180., (20, 30))
+        phi = np.random.RandomState(1).uniform(-180., 180., (20, 30))
+        gain = directivity.get_gain(theta, phi)
+        self.assertEqual(gain.shape, (20, 30))
+        np.testing.assert_allclose(gain, func(theta, phi), atol=1e-3)
+        np.testing.assert_allclose(directivity.get_gain(theta, phi + 360.), gain, atol=1e-12)
+
+    def test_patterns(self):
+        theta = np.array([0., 90., 180.])
+        np.testing.assert_allclose(pa.directivities.cardioid().get_gain(theta, 0.), [1., 0.5, 0.], atol=1e-12)
+        np.testing.assert_allclose(pa.directivities.omni().get_gain(theta, 0.), 1.)
+        piston = pa.directivities.piston(0.1, 5000.)
+        self.assertAlmostEqual(piston.get_gain(0., 0.), 1.)
+        self.assertLess(piston.get_gain(90., 0.), 0.5)
+
+class DirectionalSpeakerTest(unittest.TestCase):
+    def test_gain_in_environment(self):
+        env = pa.environments.SimpleEnvironment()
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        spk = pa.speakers.DirectionalSpeaker(pa.directivities.cardioid(), src=src, amplification=2.,
+                                             theta=90., phi=0.)
+        env.add_object(spk)
+        t = np.arange(512) / 20000.
+        v = np.array([[1., 0., 0.], [0., 1., 0.], [-1., 0., 0.]])
+        p = env.get_pressure_signals(t, v)
+        delayed = src.get_sound_signal(t - 1. / env.get_medium().get_speed_of_sound())
+        np.testing.assert_allclose(p, 2. * np.array([1., 0.5, 0.])[:,np.newaxis] * delayed, atol=1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,322 @@
+# coding:utf-8
+"""Tests for the environments of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class EnvironmentTest(unittest.TestCase):
+    def test_get_objects(self):
+        env = pa.environments.SimpleEnvironment()
+        spk = pa.speakers.Speaker()
+        mic = pa.microphones.Microphone()
+        env.add_objects([spk, mic])
+        speakers = env.get_objects(pa.speakers.Speaker)
+        self.assertEqual(speakers, (spk,))
+        self.assertIs(env.get_objects(pa.speakers.Speaker), speakers)
+        other = pa.speakers.Speaker()
+        env.add_object(other)
+        self.assertEqual(env.get_objects(pa.speakers.Speaker), (spk, other))
+        self.assertEqual(speakers, (spk,))
+        env.remove_object(spk)
+        self.assertEqual(env.get_objects(pa.speakers.Speaker), (other,))
+        self.assertEqual(env.get_objects(), (mic, other))
+
+    def test_registry(self):
+        env = pa.environments.SimpleEnvironment()
+        mic = pa.microphones.Microphone()
+        array = pa.microphones.MicrophoneArray()
+        env.add_objects([mic, array])
+        self.assertTrue(env.has_object(array))
+        self.assertIs(array.get_environment(), env)
+        self.assertRaises(ValueError, env.add_object, mic)
+        self.assertEqual(env.get_objects(pa.microphones.Microphone), (mic, array))
+        self.assertEqual(env.get_objects(pa.microphones.MicrophoneArray), (array,))
+        env.remove_object(array)
+        self.assertFalse(env.has_object(array))
+        self.assertRaises(ValueError, env.remove_object, array)
+        self.assertEqual(env.get_objects(pa.microphones.MicrophoneArray), ())
+        other = pa.environments.SimpleEnvironment()
+        other.add_object(mic)
+        self.assertFalse(env.has_object(mic))
+        self.assertEqual(env.get_objects(), ())
+
+    def test_scan_matches_moved_speaker(self):
+        env = pa.environments.SimpleEnvironment()
+        spk = pa.speakers.Speaker(pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05))
+        other = pa.speakers.Speaker(pa.sources.SineSource(700.), x=-1., y=1.)
+        env.add_objects([spk, other])
+        t = np.arange(256) / 20000.
+        v = np.array([[0., 0., 0.], [0.2, 0., 0.], [0., 0.2, 0.]])
+        weights = np.array([0.5, 0.3, 0.2])
+        positions = np.array([[1., 0., 0.], [0.5, 1., 0.2], [2., -1., 0.]])
+        response = env.scan_source_positions(spk, positions, t, v, weights=weights)
+        for k, position in enumerate(positions):
+            spk.set_position(*position)
+            expected = np.std(np.dot(weights, env.get_pressure_signals(t, v)))
+            self.assertAlmostEqual(response[k], expected, places=10)
+        parallel = env.scan_source_positions(spk, positions, t, v, weights=weights, processes=2)
+        np.testing.assert_allclose(parallel, response, rtol=1e-12)
+
+    def test_scan_chunks(self):
+        env = pa.environments.SimpleEnvironment()
+        spk = pa.speakers.Speaker(pa.sources.SineSource(1000.))
+        env.add_object(spk)
+        t = np.arange(256) / 20000.
+        v = np.array([[0., 0., 0.], [0.2, 0., 0.], [0., 0.2, 0.]])
+        positions = np.random.RandomState(0).uniform(1., 3., (20, 3))
+        whole = env.scan_source_positions(spk, positions, t, v)
+        chunked = env.scan_source_positions(spk, positions, t, v, max_bytes=8*3*256*6*4)
+        np.testing.assert_allclose(chunked, whole, rtol=1e-12)
+
+    def test_moving_speaker_recomputes_only_its_contribution(self):
+        env = pa.environments.SimpleEnvironment()
+        moving = pa.speakers.Speaker(pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05), x=1.)
+        fixed = pa.speakers.Speaker(pa.sources.WhiteNoiseSource(20000., seed=2), y=1.)
+        env.add_objects([moving, fixed])
+        t = np.arange(512) / 20000.
+        v = np.array([[0., 0., 0.], [0.2, 0., 0.]])
+        env.get_pressure_signals(t, v)
+        self.assertEqual(env._contribution_cache.get_stats(), (0, 2))
+        moving.set_position(2., 0., 0.)
+        p = env.get_pressure_signals(t, v)
+        self.assertEqual(env._contribution_cache.get_stats(), (1, 3))
+        fresh = pa.environments.SimpleEnvironment(contribution_cache_bytes=0)
+        fresh.add_objects([pa.speakers.Speaker(moving.get_source(), x=2.),
+                           pa.speakers.Speaker(fixed.get_source(), y=1.)])
+        np.testing.assert_allclose(p, fresh.get_pressure_signals(t, v), rtol=0, atol=1e-12)
+
+    def test_contribution_cache_follows_signals(self):
+        env = pa.environments.SimpleEnvironment()
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        env.add_object(pa.speakers.Speaker(src, x=1.))
+        t = np.arange(512) / 20000.
+        v = np.zeros((1,3))
+        before = env.get_pressure_signals(t, v)
+        src.set_amplitude(2.)
+        np.testing.assert_allclose(env.get_pressure_signals(t, v), 2. * before)
+        waves = env.get_plane_waves(t, v)
+        waves[0][3][...] = 0.
+        np.testing.assert_allclose(env.get_pressure_signals(t, v), 2. * before)
+
+def mirror_images(size, reflection, position, max_order):
+    """Return the image sources from the closed form of Allen and Berkley."""
+    images = {}
+    n = range(-max_order, max_order + 1)
+    for q in np.ndindex(2, 2, 2):
+        q = np.array(q)
+        for m in np.ndindex(len(n), len(n), len(n)):
+            m = np.array(n)[list(m)]
+            if np.sum(np.abs(m - q) + np.abs(m)) > max_order:
+                continue
+            x = (1 - 2 * q) * position + 2 * m * size
+            gain = np.prod(reflection[:,0]**np.abs(m - q) * reflection[:,1]**np.abs(m))
+            images[tuple(np.round(x, 9))] = gain
+    return images
+
+class ImageSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.size = np.array([5., 4., 3.])
+        self.reflection = np.array([[0.9, 0.8], [0.7, 0.6], [0.5, 0.4]])
+        self.position = np.array([1., 1.5, 1.])
+
+    def test_number_of_images(self):
+        for max_order, count in enumerate([1, 7, 25, 63]):
+            offsets, mirrors, gains = pa.environments.get_image_lattice(self.size, self.reflection, max_order)
+            self.assertEqual(len(gains), count)
+
+    def test_matches_mirroring(self):
+        lattice = pa.environments.get_image_lattice(self.size, self.reflection, 3)
+        positions, gains, mirrors = pa.environments.get_image_sources(lattice, self.position)
+        np.testing.assert_array_equal(positions[0], self.position)
+        self.assertEqual(gains[0], 1.)
+        expected = mirror_images(self.size, self.reflection, self.position, 3)
+        self.assertEqual(len(expected), len(gains))
+        for x, g in zip(positions, gains):
+            self.assertAlmostEqual(expected[tuple(np.round(x, 9))], g)
+
+    def test_min_energy(self):
+        offsets, mirrors, gains = pa.environments.get_image_lattice(self.size, self.reflection, 3, min_energy=0.1)
+        self.assertTrue(np.all(gains**2 >= 0.1))
+        full = pa.environments.get_image_lattice(self.size, self.reflection, 3)[2]
+        self.assertEqual(len(gains), np.sum(full**2 >= 0.1))
+
+    def test_first_order_room(self):
+        room = pa.environments.RoomEnvironment(size=self.size, absorption=0.19, max_order=1)
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        room.add_object(pa.speakers.Speaker(src, x=1., y=1.5, z=1.))
+        t = np.arange(512) / 20000.
+        v = np.array([[2., 2., 1.5]])
+        images = np.array([[1., 1.5, 1.], [-1., 1.5, 1.], [9., 1.5, 1.], [1., -1.5, 1.],
+                           [1., 6.5, 1.], [1., 1.5, -1.], [1., 1.5, 5.]])
+        r = np.linalg.norm(images - v, axis=-1)
+        gains = np.array([1.] + [0.9] * 6) / r
+        c = room.get_medium().get_speed_of_sound()
+        expected = np.sum(gains[:,np.newaxis] * src.get_sound_signal(t - r[:,np.newaxis] / c), axis=0)
+        np.testing.assert_allclose(room.get_pressure_signals(t, v)[0], expected, atol=1e-10)
+
+class RoomEnvironmentTest(unittest.TestCase):
+    def setUp(self):
+        self.t = np.arange(512) / 20000.
+        self.v = np.array([[2., 2., 1.5], [3., 1., 1.]])
+
+    def make_room(self, **kwargs):
+        room = pa.environments.RoomEnvironment(size=(5., 4., 3.), max_order=2,
+                                               contribution_cache_bytes=2**24, **kwargs)
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        room.add_object(pa.speakers.Speaker(src, x=1., y=1.5, z=1.))
+        return room
+
+    def test_room_change_invalidates_contributions(self):
+        room = self.make_room(absorption=0.1)
+        before = room.get_pressure_signals(self.t, self.v)
+        room.set_absorption(0.9)
+        after = room.get_pressure_signals(self.t, self.v)
+        self.assertGreater(np.max(np.abs(after - before)), 1e-3)
+        fresh = self.make_room(absorption=0.9).get_pressure_signals(self.t, self.v)
+        np.testing.assert_allclose(after, fresh, rtol=0, atol=1e-12)
+
+    def test_room_size_change_invalidates_contributions(self):
+        room = self.make_room()
+        before = room.get_pressure_signals(self.t, self.v)
+        room.set_size((6., 4., 3.))
+        after = room.get_pressure_signals(self.t, self.v)
+        self.assertGreater(np.max(np.abs(after - before)), 1e-3)
+
+    def test_max_delay(self):
+        room = self.make_room(max_delay=0.01)
+        spk = room.get_objects(pa.speakers.Speaker)[0]
+        kept = room.get_image_sources(spk)[0]
+        room.set_max_delay(None)
+        positions = room.get_image_sources(spk)[0]
+        self.assertEqual(len(positions), 25)
+        self.assertLess(len(kept), 25)
+        # No culled image source can reach any point of the room in time
+        culled = np.array([x for x in positions if not np.any(np.all(kept == x, axis=-1))])
+        self.assertEqual(len(culled), 25 - len(kept))
+        distance = np.linalg.norm(culled - np.clip(culled, 0., room.get_size()), axis=-1)
+        self.assertTrue(np.all(distance > 0.01 * room.get_medium().get_speed_of_sound()))
+
+    def test_invalid_room(self):
+        room = self.make_room()
+        self.assertRaises(ValueError, room.set_size, (5., 0., 3.))
+        self.assertRaises(ValueError, room.set_size, (5., 4.))
+        self.assertRaises(ValueError, room.set_absorption, 1.5)
+        self.assertRaises(ValueError, room.set_absorption, [0.1] * 5 + [-0.1])
+
+class MultiReceiverTest(unittest.TestCase):
+    def setUp(self):
+        self.env = pa.environments.SimpleEnvironment(contribution_cache_bytes=0)
+        self.src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        self.env.add_object(pa.speakers.Speaker(self.src, x=1., y=0.5, z=0.2))
+        self.t = np.arange(512) / 20000.
+        self.v = np.array([[0., 0., 0.], [0.3, 0., 0.], [0., -0.4, 0.1], [2., 1., 0.]])
+
+    def test_matches_single_receivers(self):
+        p = self.env.get_pressure_signals(self.t, self.v)
+        self.assertEqual(p.shape, (4, len(self.t)))
+        for m, (x, y, z) in enumerate(self.v):
+            np.testing.assert_allclose(p[m], self.env.get_pressure_signal(self.t, x, y, z), rtol=1e-12, atol=1e-15)
+
+    def test_spherical_spreading(self):
+        p = self.env.get_pressure_signals(self.t, self.v)
+        r = np.linalg.norm(self.v - [1., 0.5, 0.2], axis=-1)
+        c = self.env.get_medium().get_speed_of_sound()
+        expected = self.src.get_sound_signal(self.t - r[:,np.newaxis] / c) / r[:,np.newaxis]
+        np.testing.assert_allclose(p, expected, rtol=1e-10, atol=1e-12)
+
+    def test_individual_times(self):
+        t = self.t + np.arange(4)[:,np.newaxis] * 1e-3
+        p = self.env.get_pressure_signals(t, self.v)
+        for m in range(4):
+            np.testing.assert_allclose(p[m], self.env.get_pressure_signals(t[m], self.v[m:m+1])[0], rtol=1e-12, atol=1e-15)
+
+    def test_separate_coordinates(self):
+        x, y, z = self.v.T
+        waves = self.env.get_plane_waves(self.t, x, y, z)
+        self.assertEqual(len(waves), 1)
+        t, theta, phi, p = waves[0]
+        self.assertEqual(theta.shape, (4,))
+        np.testing.assert_allclose(p, self.env.get_pressure_signals(self.t, self.v), rtol=1e-12)
+
+class PhasorTest(unittest.TestCase):
+    def test_matches_direct_path(self):
+        env = pa.environments.SimpleEnvironment(pa.mediums.SimpleAir(20.))
+        env.add_objects([pa.speakers.Speaker(pa.sources.SineSource(1000., amp=2., phi=0.3), x=1., y=0.5),
+                         pa.speakers.Speaker(pa.sources.SineSource(1000.), x=-1., z=0.5),
+                         pa.speakers.Speaker(pa.sources.HarmonicSource(440.), y=2.)])
+        t = np.arange(512) / 20000.
+        v = np.array([[0., 0., 0.], [0.3, 0., 0.], [0., 0.2, 0.1]])
+        direct = sum(wave[3] for wave in env.get_plane_waves(t, v))
+        np.testing.assert_allclose(env.get_pressure_signals(t, v), direct, rtol=0, atol=1e-12)
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.env = pa.environments.SimpleEnvironment()
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        self.env.add_object(pa.speakers.Speaker(src, x=1., y=0.5))
+        self.v = np.array([[0., 0., 0.], [0.3, 0., 0.]])
+
+    def test_time_blocks(self):
+        blocks = list(pa.environments.iter_time_blocks(1000., 64, n_samples=150, start=0.5))
+        self.assertEqual([len(t) for t in blocks], [64, 64, 22])
+        np.testing.assert_array_equal(np.hstack(blocks), 0.5 + np.arange(150) / 1000.)
+
+    def test_pressure_blocks(self):
+        blocks = list(self.env.iter_pressure_blocks(20000., 100, self.v, n_samples=1050))
+        t = np.hstack([b[0] for b in blocks])
+        p = np.hstack([b[1] for b in blocks])
+        np.testing.assert_allclose(p, self.env.get_pressure_signals(t, self.v), rtol=1e-12, atol=1e-15)
+
+    def test_voltage_blocks(self):
+        taps = np.hanning(31) / np.sum(np.hanning(31))
+        mic = pa.microphones.Microphone(response=pa.filters.FIRFilter(taps))
+        self.env.add_object(mic)
+        blocks = list(mic.iter_voltage_blocks(20000., 100, n_samples=1050))
+        t = np.hstack([b[0] for b in blocks])
+        U = np.hstack([b[1] for b in blocks])
+        np.testing.assert_allclose(U, mic.get_voltage_signal(t), rtol=1e-9, atol=1e-12)
+
+class PropagationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.env = pa.environments.SimpleEnvironment(pa.mediums.SimpleAir(20.))
+        self.spk = pa.speakers.Speaker(pa.sources.SineSource(1000.), x=1., theta=90.)
+        self.env.add_object(self.spk)
+        self.v = np.array([[0., 0., 0.], [1., 2., 0.]])
+
+    def test_values(self):
+        Dt, g, ltheta, lphi, theta, phi = self.env.get_propagation(self.spk, self.v)
+        c = self.env.get_medium().get_speed_of_sound()
+        np.testing.assert_allclose(Dt, [1. / c, 2. / c])
+        np.testing.assert_allclose(g, [1., 0.5])
+        np.testing.assert_allclose(theta, [90., 90.])
+        np.testing.assert_allclose(phi, [180., 90.])
+
+    def test_cached_until_changed(self):
+        table = self.env.get_propagation(self.spk, self.v)
+        self.assertIs(self.env.get_propagation(self.spk, self.v.copy()), table)
+        self.assertFalse(table[0].flags.writeable)
+        self.spk.set_position(x=2.)
+        moved = self.env.get_propagation(self.spk, self.v)
+        self.assertIsNot(moved, table)
+        np.testing.assert_allclose(moved[1], [0.5, 1. / np.sqrt(5.)])
+        self.env.get_medium().set_temperature(0.)
+        cold = self.env.get_propagation(self.spk, self.v)
+        np.testing.assert_allclose(cold[0], [2. / 331.3, np.sqrt(5.) / 331.3])
+
+class AbsorptionTest(unittest.TestCase):
+    def test_streaming_designs_once_per_bucket(self):
+        medium = pa.mediums.AbsorbingAir(bucket_width=1.)
+        env = pa.environments.SimpleEnvironment(medium)
+        src = pa.sources.WhiteNoiseSource(44100., seed=1)
+        env.add_objects([pa.speakers.Speaker(src, x=2.5), pa.speakers.Speaker(src, x=4.5)])
+        designs = pa.filters._designs.get_stats()[1]
+        for t, p in env.iter_pressure_blocks(44100., 256, np.zeros((2,3)), n_samples=256*50, start=0.1):
+            pass
+        self.assertEqual(medium._filters.get_stats()[1], 2)
+        self.assertLessEqual(pa.filters._designs.get_stats()[1] - designs, 2)
+
+if __name__ == '__main__':
+    unittest.main()
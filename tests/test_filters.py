@@ -0,0 +1,57 @@
+# coding:utf-8
+"""Tests for the filters of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class FIRFilterTest(unittest.TestCase):
+    def test_spectra_are_bounded(self):
+        taps = np.hanning(15)
+        flt = pa.filters.FIRFilter(taps)
+        x = np.random.RandomState(0).standard_normal(2**12)
+        for B in [2**k for k in range(12)]:
+            np.testing.assert_allclose(flt.apply(x[:B]), np.convolve(x[:B], taps)[:B], atol=1e-12)
+        self.assertLessEqual(len(flt._spectra), 8)
+
+def stream(flt, x, sizes):
+    """Filter `x` in blocks of the given sizes."""
+    state = flt.new_state(x.shape[:-1])
+    blocks = []
+    i = 0
+    for B in sizes:
+        blocks.append(flt.apply(x[...,i:i+B], state))
+        i += B
+    return np.concatenate(blocks, axis=-1)
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.x = np.random.RandomState(0).standard_normal((3, 1000))
+        self.sizes = [100, 1, 37, 256, 300, 306]
+
+    def test_fir(self):
+        flt = pa.filters.FIRFilter.from_gains([0., 2000., 4000., 10000.], [1., 1., 0.2, 0.], 20000., numtaps=65)
+        whole = flt.apply(self.x)
+        np.testing.assert_allclose(whole[0], np.convolve(self.x[0], flt.get_taps())[:1000], atol=1e-12)
+        np.testing.assert_allclose(stream(flt, self.x, self.sizes), whole, atol=1e-12)
+
+    def test_iir(self):
+        flt = pa.filters.IIRFilter.butter(4, 1000., 20000.)
+        self.assertIs(pa.filters.IIRFilter.butter(4, 1000., 20000.), flt)
+        np.testing.assert_allclose(stream(flt, self.x, self.sizes), flt.apply(self.x), atol=1e-12)
+
+    def test_microphone_response(self):
+        env = pa.environments.SimpleEnvironment()
+        env.add_object(pa.speakers.Speaker(pa.sources.WhiteNoiseSource(20000., seed=1), x=1.))
+        flt = pa.filters.IIRFilter.butter(2, (500., 3000.), 20000., btype='bandpass')
+        mic = pa.microphones.Microphone(response=flt)
+        env.add_object(mic)
+        t = np.arange(1000) / 20000.
+        raw = pa.microphones.Microphone()
+        env.add_object(raw)
+        np.testing.assert_allclose(mic.get_voltage_signal(t), flt.apply(raw.get_voltage_signal(t)), atol=1e-12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# coding:utf-8
+"""Tests for the mediums of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class AbsorbingAirTest(unittest.TestCase):
+    def setUp(self):
+        self.medium = pa.mediums.AbsorbingAir(temp=20., humidity=70.)
+
+    def test_reference_values(self):
+        # ISO 9613-2, table 2, in dB/km at the exact octave midband frequencies
+        freqs = 1000. * 10.**(np.arange(-4, 4) * 0.3)
+        table = [(10., 70., [0.1, 0.4, 1.0, 1.9, 3.7, 9.7, 32.8, 117.]),
+                 (20., 70., [0.1, 0.3, 1.1, 2.8, 5.0, 9.0, 22.9, 76.6]),
+                 (15., 80., [0.1, 0.3, 1.1, 2.4, 4.1, 8.3, 23.7, 82.8])]
+        for temp, humidity, alpha in table:
+            medium = pa.mediums.AbsorbingAir(temp=temp, humidity=humidity)
+            np.testing.assert_allclose(medium.get_absorption_coefficient(freqs) * 1000, alpha, rtol=0.005, atol=0.05)
+
+    def test_attenuation(self):
+        alpha = self.medium.get_absorption_coefficient(4000.)
+        self.assertAlmostEqual(self.medium.get_attenuation(4000., 50.), 10.**(-alpha * 50. / 20.))
+        self.assertEqual(self.medium.get_attenuation(4000., 0.), 1.)
+        self.medium.set_humidity(20.)
+        self.assertNotAlmostEqual(self.medium.get_absorption_coefficient(4000.), alpha)
+
+    def test_filter_response(self):
+        flt = self.medium.get_absorption_filter(99.7, 44100.)
+        H = np.abs(np.fft.rfft(flt.get_taps(), 4096))
+        freqs = np.fft.rfftfreq(4096, 1. / 44100.)
+        select = freqs <= 16000.
+        np.testing.assert_allclose(H[select], self.medium.get_attenuation(freqs[select], 100.), atol=0.03)
+        # The filter is linear phase
+        np.testing.assert_allclose(flt.get_taps(), flt.get_taps()[::-1])
+
+    def test_filters_are_shared(self):
+        flt = self.medium.get_absorption_filter(10.2, 44100.)
+        self.assertIs(self.medium.get_absorption_filter(9.8, 44100.), flt)
+        self.assertIs(self.medium.get_absorption_filter(10.2, 44100. * (1 + 1e-12)), flt)
+        self.assertIsNot(self.medium.get_absorption_filter(11.2, 44100.), flt)
+        self.medium.set_temperature(10.)
+        self.assertIsNot(self.medium.get_absorption_filter(10.2, 44100.), flt)
+
+    def test_phasors_match_filtered_path(self):
+        env = pa.environments.SimpleEnvironment(self.medium)
+        spk = pa.speakers.Speaker(pa.sources.SineSource(8000.), x=100.)
+        env.add_object(spk)
+        t = 0.5 + np.arange(1024) / 44100.
+        v = np.zeros((1,3))
+        phasor = env.get_pressure_signals(t, v)
+        Dt, g, ltheta, lphi, theta, phi = env.get_propagation(spk, v)
+        filtered = pa.environments.evaluate_paths(spk, t, Dt, g, ltheta, lphi, self.medium)
+        self.assertLess(np.max(np.abs(filtered - phasor)), 0.01 * np.max(np.abs(phasor)))
+        # The tone is attenuated by the absorption
+        self.assertAlmostEqual(np.max(np.abs(phasor)) * 100., self.medium.get_attenuation(8000., 100.), places=3)
+
+class LayeredAirTest(unittest.TestCase):
+    def setUp(self):
+        self.position = np.array([10., 20., 5.])
+        rng = np.random.RandomState(0)
+        self.v = np.column_stack((rng.uniform(-600., 600., 20), rng.uniform(-600., 600., 20),
+                                  rng.uniform(0.5, 150., 20)))
+
+    def test_matches_homogeneous_rays(self):
+        medium = pa.mediums.LayeredAir()
+        Dt, g, emission, arrival = medium.get_rays(self.position, self.v)
+        Dt0, g0, emission0, arrival0 = pa.mediums.SimpleAir(temp=20.).get_rays(self.position, self.v)
+        np.testing.assert_allclose(Dt, Dt0, rtol=1e-5)
+        np.testing.assert_allclose(g, g0, rtol=5e-3)
+        np.testing.assert_allclose(emission, emission0, atol=1e-4)
+        np.testing.assert_allclose(arrival, arrival0, atol=1e-4)
+
+    def test_matches_homogeneous_environment(self):
+        src = pa.sources.ChirpSource(f0=100., f1=2000., duration=0.05)
+        t = 0.3 + np.arange(512) / 20000.
+        v = np.array([[50., 0., 2.], [30., 40., 20.]])
+        signals = []
+        for medium in (pa.mediums.LayeredAir(), pa.mediums.SimpleAir(temp=20.)):
+            env = pa.environments.SimpleEnvironment(medium)
+            env.add_object(pa.speakers.Speaker(src, z=5.))
+            signals.append(env.get_pressure_signals(t, v))
+        np.testing.assert_allclose(signals[0], signals[1], atol=0.02 * np.max(np.abs(signals[1])))
+
+    def test_linear_gradient(self):
+        # A linear wind profile gives a linear effective speed of sound, for
+        # which the travel time of the ray is known in closed form
+        medium = pa.mediums.LayeredAir(heights=(0., 200.), wind_speeds=(0., 10.))
+        Dt, g, emission, arrival = medium.get_rays(self.position, self.v)
+        d = self.v - self.position
+        azimuth = np.arctan2(d[:,1], d[:,0]) * 180. / np.pi
+        c1 = medium.get_effective_speed_of_sound(self.position[2], azimuth)
+        c2 = medium.get_effective_speed_of_sound(self.v[:,2], azimuth)
+        k = 10. / 200. * np.cos(azimuth * np.pi / 180.)
+        expected = np.arccosh(1 + k**2 * np.sum(d**2, axis=-1) / (2 * c1 * c2)) / np.abs(k)
+        self.assertTrue(np.all(g > 0))
+        np.testing.assert_allclose(Dt, expected, rtol=1e-3)
+
+    def test_shadow_zone(self):
+        # The speed of sound decreases with height, so the rays bend upwards
+        medium = pa.mediums.LayeredAir(heights=(0., 100.), temps=(20., -10.))
+        Dt, g, emission, arrival = medium.get_rays(np.array([0., 0., 2.]), np.array([[20., 0., 2.], [900., 0., 1.]]))
+        self.assertGreater(g[0], 0.)
+        self.assertEqual(g[1], 0.)
+        self.assertAlmostEqual(Dt[1], np.hypot(900., 1.) / medium.get_speed_of_sound())
+        # The ray to the receiver at the same height leaves the source
+        # downwards and arrives from below
+        self.assertLess(emission[0,2], 0.)
+        self.assertGreater(arrival[0,2], 0.)
+
+    def test_ray_tables_are_shared(self):
+        medium = pa.mediums.LayeredAir(heights=(0., 100.), temps=(20., 10.))
+        table = medium.get_ray_table(5.2)
+        self.assertIs(medium.get_ray_table(4.9), table)
+        self.assertIs(medium.get_ray_table(5.2, azimuth=90.), table)
+        medium.set_profiles((0., 100.), (20., 15.))
+        self.assertIsNot(medium.get_ray_table(5.2), table)
+        self.assertRaises(ValueError, medium.get_ray_table, 300.)
+
+if __name__ == '__main__':
+    unittest.main()
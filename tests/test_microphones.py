@@ -0,0 +1,112 @@
+# coding:utf-8
+"""Tests for the microphones of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class MicrophoneArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.t = np.arange(512) / 20000.
+        self.env = pa.environments.SimpleEnvironment()
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        self.env.add_object(pa.speakers.Speaker(src, x=1., y=0.5, z=0.2))
+        self.positions = np.array([[0., 0., 0.], [0.1, 0., 0.], [0., 0.1, 0.05]])
+
+    def test_matches_single_microphones(self):
+        gains = np.array([1., 0.5, 2.])
+        array = pa.microphones.MicrophoneArray(self.positions, gains=gains, amplification=3.,
+                                               x=0.2, theta=90., phi=30.)
+        self.env.add_object(array)
+        U = array.get_voltage_signal(self.t)
+        self.assertEqual(U.shape, (3, len(self.t)))
+        for k, v in enumerate(array.get_element_positions()):
+            mic = pa.microphones.Microphone(amplification=3. * gains[k], x=v[0], y=v[1], z=v[2])
+            self.env.add_object(mic)
+            np.testing.assert_allclose(U[k], mic.get_voltage_signal(self.t), rtol=1e-10, atol=1e-12)
+
+    def test_elements_follow_the_array(self):
+        array = pa.microphones.MicrophoneArray(self.positions)
+        self.env.add_object(array)
+        before = array.get_voltage_signal(self.t)
+        array.set_position(x=0.5)
+        np.testing.assert_allclose(array.get_element_positions(), self.positions + [0.5, 0., 0.])
+        self.assertFalse(np.allclose(array.get_voltage_signal(self.t), before))
+
+class DirectionalMicrophoneTest(unittest.TestCase):
+    def setUp(self):
+        self.t = np.arange(512) / 20000.
+        self.env = pa.environments.SimpleEnvironment()
+        self.front = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        self.side = pa.sources.WhiteNoiseSource(20000., seed=1)
+        self.env.add_objects([pa.speakers.Speaker(self.front, x=1.),
+                              pa.speakers.Speaker(self.side, y=2.),
+                              pa.speakers.Speaker(pa.sources.SineSource(300.), x=-1.5)])
+
+    def test_gains_per_wave(self):
+        mic = pa.microphones.DirectionalMicrophone(theta=90., phi=0.)
+        self.env.add_object(mic)
+        c = self.env.get_medium().get_speed_of_sound()
+        expected = self.front.get_sound_signal(self.t - 1. / c) + 0.5 * self.side.get_sound_signal(self.t - 2. / c) / 2.
+        np.testing.assert_allclose(mic.get_voltage_signal(self.t), expected, atol=1e-10)
+
+    def test_array_matches_single_microphones(self):
+        positions = np.array([[0., 0., 0.], [0.1, 0., 0.], [0., 0.1, 0.]])
+        orientations = np.array([[90., 0., 0.], [90., 90., 0.], [0., 0., 0.]])
+        array = pa.microphones.MicrophoneArray(positions, orientations, directivity=pa.directivities.cardioid(0.3),
+                                               x=0.2, theta=0., phi=0., alpha=0.)
+        self.env.add_object(array)
+        U = array.get_voltage_signal(self.t)
+        for k, v in enumerate(array.get_element_positions()):
+            theta, phi, alpha = orientations[k]
+            mic = pa.microphones.DirectionalMicrophone(pa.directivities.cardioid(0.3), x=v[0], y=v[1], z=v[2],
+                                                       theta=theta, phi=phi, alpha=alpha)
+            self.env.add_object(mic)
+            np.testing.assert_allclose(U[k], mic.get_voltage_signal(self.t), rtol=1e-10, atol=1e-12)
+
+class SelfNoiseTest(unittest.TestCase):
+    def setUp(self):
+        self.t = np.arange(20000) / 20000.
+        self.env = pa.environments.SimpleEnvironment()
+
+    def make_array(self, **kwargs):
+        positions = np.array([[0., 0., 0.], [0.1, 0., 0.], [0., 0.1, 0.]])
+        mic = pa.microphones.MicrophoneArray(positions, **kwargs)
+        self.env.add_object(mic)
+        return mic
+
+    def test_level(self):
+        mic = self.make_array(noise_level=0.01, noise_seed=3)
+        U = mic.get_voltage_signal(self.t)
+        self.assertEqual(U.shape, (3, len(self.t)))
+        rms = np.sqrt(np.mean(U**2, axis=-1))
+        np.testing.assert_allclose(rms, 0.01, rtol=0.05)
+        # The channels are uncorrelated
+        self.assertLess(abs(np.corrcoef(U)[0,1]), 0.05)
+
+    def test_reproducible(self):
+        mic = self.make_array(noise_level=0.01, noise_seed=3)
+        U = mic.get_voltage_signal(self.t)
+        parts = [mic.get_voltage_signal(self.t[i:i+1000]) for i in range(0, len(self.t), 1000)]
+        np.testing.assert_array_equal(np.hstack(parts), U)
+        other = self.make_array(noise_level=0.01, noise_seed=3)
+        np.testing.assert_array_equal(other.get_voltage_signal(self.t), U)
+        other.set_self_noise(0.01, seed=4)
+        self.assertFalse(np.allclose(other.get_voltage_signal(self.t), U))
+
+    def test_single_microphone(self):
+        mic = pa.microphones.Microphone(noise_level=0.02, noise_sample_rate=20000.)
+        self.env.add_object(mic)
+        U = mic.get_voltage_signal(self.t)
+        self.assertEqual(U.shape, self.t.shape)
+        self.assertAlmostEqual(np.sqrt(np.mean(U**2)), 0.02, delta=0.001)
+        self.assertEqual(mic.get_voltage_signal(self.t[5:6]), U[5])
+
+    def test_no_noise(self):
+        mic = self.make_array()
+        np.testing.assert_array_equal(mic.get_voltage_signal(self.t), 0.)
+
+if __name__ == '__main__':
+    unittest.main()
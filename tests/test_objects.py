@@ -0,0 +1,72 @@
+# coding:utf-8
+"""Tests for the objects of Phamarsim"""
+
+from __future__ import division
+import unittest
+import numpy as np
+
+import phamarsim as pa
+
+class CoordinateTransformTest(unittest.TestCase):
+    def setUp(self):
+        self.obj = pa.objects.SimpleObject(x=1., y=-2., z=0.5, theta=30., phi=45., alpha=10.)
+        self.points = np.random.RandomState(0).uniform(-5., 5., (4, 5, 3))
+
+    def test_batch_matches_single_points(self):
+        v = self.obj.local_to_global_position(self.points)
+        self.assertEqual(v.shape, self.points.shape)
+        for index in np.ndindex(*self.points.shape[:-1]):
+            single = self.obj.local_to_global_position(*self.points[index])
+            np.testing.assert_array_equal(v[index], single)
+
+    def test_separate_coordinates(self):
+        x, y, z = np.rollaxis(self.points, -1)
+        x1, y1, z1 = self.obj.global_to_local_position(x, y, z)
+        v = self.obj.global_to_local_position(self.points)
+        np.testing.assert_array_equal(np.stack((x1, y1, z1), axis=-1), v)
+
+    def test_round_trip(self):
+        v = self.obj.global_to_local_position(self.obj.local_to_global_position(self.points))
+        np.testing.assert_allclose(v, self.points, atol=1e-12)
+
+    def test_rotation_matrices(self):
+        theta, phi, alpha = np.array([10., 80.]), np.array([0., 135.]), np.array([5., -20.])
+        M, Minv = pa.objects.rotation_matrices(theta, phi, alpha)
+        for k in range(2):
+            Mk, Minvk = pa.objects.rotation_matrices(theta[k], phi[k], alpha[k])
+            np.testing.assert_allclose(M[k], Mk, atol=1e-15)
+            np.testing.assert_allclose(np.dot(M[k], Minv[k]), np.eye(3), atol=1e-12)
+
+    def test_spherical_round_trip(self):
+        theta, phi, r = pa.objects.cartesian_to_spherical(self.points)
+        np.testing.assert_allclose(pa.objects.spherical_to_cartesian(theta, phi, r), self.points, atol=1e-12)
+
+class PoseCacheTest(unittest.TestCase):
+    def test_pose_version(self):
+        obj = pa.objects.SimpleObject(x=1., theta=0.)
+        version = obj.get_pose_version()
+        obj.set_position(x=1.)
+        obj.set_orientation(theta=0.)
+        self.assertEqual(obj.get_pose_version(), version)
+        obj.set_position(y=2.)
+        self.assertEqual(obj.get_pose_version(), version + 1)
+        obj.set_orientation(phi=90.)
+        self.assertEqual(obj.get_pose_version(), version + 2)
+
+    def test_rotation_follows_orientation(self):
+        obj = pa.objects.SimpleObject()
+        obj.set_orientation(theta=90., phi=90., alpha=0.)
+        M, Minv = pa.objects.rotation_matrices(90., 90., 0.)
+        np.testing.assert_array_equal(obj.get_rotation_matrix(), M)
+        np.testing.assert_array_equal(obj.get_inverse_rotation_matrix(), Minv)
+        np.testing.assert_allclose(obj.local_to_global_position([0., 0., 1.]), [0., 1., 0.], atol=1e-12)
+
+    def test_returns_copies(self):
+        obj = pa.objects.SimpleObject(x=1.)
+        obj.get_position()[0] = 5.
+        obj.get_rotation_matrix()[0,0] = 5.
+        np.testing.assert_array_equal(obj.get_position(), [1., 0., 0.])
+        np.testing.assert_allclose(obj.get_rotation_matrix(), np.eye(3), atol=1e-15)
+
+if __name__ == '__main__':
+    unittest.main()
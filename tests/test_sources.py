@@ -0,0 +1,131 @@
+# coding:utf-8
+"""Tests for the sound sources of Phamarsim"""
+
+from __future__ import division
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import scipy.io.wavfile
+
+import phamarsim as pa
+
+class SignalCacheTest(unittest.TestCase):
+    def test_cache(self):
+        src = pa.sources.ChirpSource(f0=100., f1=5000., duration=0.05)
+        self.assertIsNone(src.get_cache_info())
+        t = np.arange(1000) / 20000.
+        expected = src.get_sound_signal(t)
+        src.enable_cache()
+        first = src.get_sound_signal(t)
+        second = src.get_sound_signal(t.copy())
+        self.assertIs(second, first)
+        self.assertFalse(first.flags.writeable)
+        np.testing.assert_array_equal(first, expected)
+        info = src.get_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['entries']), (1, 1, 1))
+        self.assertEqual(info['nbytes'], first.nbytes)
+        np.testing.assert_array_equal(src.get_sound_signal(t + 0.01), src._get_sound_signal(t + 0.01))
+        src.set_amplitude(2.)
+        self.assertEqual(src.get_cache_info()['entries'], 0)
+        np.testing.assert_allclose(src.get_sound_signal(t), 2. * expected)
+        src.disable_cache()
+        self.assertIsNone(src.get_cache_info())
+
+class ChirpSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.t = np.arange(1000) / 20000.
+
+    def test_linear(self):
+        chirp = pa.sources.ChirpSource(f0=100., f1=1100., duration=0.05, repeat=False)
+        t = np.array([-0.01, 0., 0.025, 0.04, 0.06])
+        phase = 2*np.pi * (100.*t + 1000. * t**2 / 0.1)
+        expected = np.where((t >= 0) & (t < 0.05), np.sin(phase), 0.)
+        np.testing.assert_allclose(chirp.get_sound_signal(t), expected, atol=1e-12)
+
+    def test_exponential_constant_frequency(self):
+        chirp = pa.sources.ChirpSource(f0=440., f1=440., duration=0.05, method='exponential')
+        np.testing.assert_allclose(chirp.get_sound_signal(self.t),
+                                   np.sin(2*np.pi*440.*np.mod(self.t, 0.05)), atol=1e-9)
+
+    def test_exponential_needs_positive_frequencies(self):
+        self.assertRaises(ValueError, pa.sources.ChirpSource, f0=0., f1=1000., method='exponential')
+        chirp = pa.sources.ChirpSource(f0=100., f1=1000., method='exponential')
+        self.assertRaises(ValueError, chirp.set_frequencies, -100., 1000.)
+        self.assertEqual(chirp.get_frequencies(), (100., 1000.))
+        self.assertTrue(np.all(np.isfinite(chirp.get_sound_signal(self.t))))
+
+class NoiseAndToneTest(unittest.TestCase):
+    def test_white_noise(self):
+        noise = pa.sources.WhiteNoiseSource(8000., amp=0.5, seed=3, block_size=1000)
+        n = np.arange(20000)
+        x = noise.get_sound_signal(n / 8000.)
+        self.assertAlmostEqual(np.std(x), 0.5, delta=0.02)
+        late = np.arange(10**9, 10**9 + 500)
+        first = noise.get_sound_signal(late / 8000.)
+        other = pa.sources.WhiteNoiseSource(8000., amp=0.5, seed=3, block_size=1000)
+        np.testing.assert_array_equal(other.get_sound_signal(n[5000:7000] / 8000.), x[5000:7000])
+        np.testing.assert_array_equal(other.get_sound_signal(late / 8000.), first)
+        other.set_seed(4)
+        self.assertLess(abs(np.corrcoef(other.get_sound_signal(n / 8000.), x)[0,1]), 0.05)
+
+    def test_multi_tone(self):
+        t = np.arange(1000) / 20000.
+        tones = pa.sources.MultiToneSource([100., 250.], [1., 0.5], [0., 1.])
+        expected = np.sin(2*np.pi*100.*t) + 0.5 * np.sin(2*np.pi*250.*t + 1.)
+        np.testing.assert_allclose(tones.get_sound_signal(t), expected, atol=1e-12)
+        harmonic = pa.sources.HarmonicSource(100., amps=[1., 0.5])
+        np.testing.assert_allclose(harmonic.get_phasors()[0], [100., 200.])
+        harmonic.set_fundamental(125.)
+        np.testing.assert_allclose(harmonic.get_sound_signal(t),
+                                   np.sin(2*np.pi*125.*t) + 0.5 * np.sin(2*np.pi*250.*t), atol=1e-12)
+
+class SampledSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.rate = 8000.
+        self.samples = np.sin(2*np.pi*440. * np.arange(8000) / self.rate)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exact_at_samples(self):
+        src = pa.sources.SampledSource(self.samples, self.rate)
+        n = np.arange(100, 200)
+        np.testing.assert_allclose(src.get_sound_signal(n / self.rate), self.samples[n], atol=1e-12)
+        src = pa.sources.SampledSource(list(self.samples), self.rate)
+        np.testing.assert_allclose(src.get_sound_signal(n / self.rate), self.samples[n], atol=1e-12)
+
+    def test_interpolation_accuracy(self):
+        t = 0.1 + np.random.RandomState(0).uniform(0., 0.5, 1000)
+        expected = np.sin(2*np.pi*440. * t)
+        sinc = pa.sources.SampledSource(self.samples, self.rate)
+        self.assertLess(np.max(np.abs(sinc.get_sound_signal(t) - expected)), 1e-3)
+        lagrange = pa.sources.SampledSource(self.samples, self.rate, interpolation='lagrange', taps=4)
+        self.assertLess(np.max(np.abs(lagrange.get_sound_signal(t) - expected)), 1e-2)
+
+    def test_outside_of_recording(self):
+        t = np.array([-1., 2., 2.125])
+        src = pa.sources.SampledSource(self.samples, self.rate)
+        np.testing.assert_array_equal(src.get_sound_signal(t), 0.)
+        looped = pa.sources.SampledSource(self.samples, self.rate, loop=True)
+        np.testing.assert_allclose(looped.get_sound_signal(t), self.samples[[0, 0, 1000]], atol=1e-12)
+
+    def test_files(self):
+        pcm = np.round(self.samples * 16000).astype('<i2')
+        filename = os.path.join(self.tmpdir, 'a.wav')
+        scipy.io.wavfile.write(filename, int(self.rate), pcm)
+        src = pa.sources.SampledSource.from_file(filename)
+        self.assertEqual(src.get_sample_rate(), self.rate)
+        self.assertEqual(src.get_duration(), 1.)
+        n = np.arange(10, 20)
+        np.testing.assert_allclose(src.get_sound_signal(n / self.rate), pcm[n] / 32768., atol=1e-12)
+
+        filename = os.path.join(self.tmpdir, 'a.npy')
+        np.save(filename, self.samples)
+        src = pa.sources.SampledSource.from_file(filename, sample_rate=self.rate)
+        np.testing.assert_allclose(src.get_sound_signal(n / self.rate), self.samples[n], atol=1e-12)
+
+if __name__ == '__main__':
+    unittest.main()